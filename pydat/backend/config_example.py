@@ -6,6 +6,12 @@ ELASTICSEARCH = {
     'user': None,
     'pass': None,
     'cacert': None,
+    # Compress request bodies, useful with remote clusters
+    'httpCompress': False,
+    # Defaults to the client's connection pool size
+    'connectionsPerNode': None,
+    'maxRetries': 100,
+    'timeout': 100,
 }
 
 PDNSSOURCES = {
@@ -2,6 +2,16 @@ import os
 import cerberus
 
 
+def _to_bool(value):
+    # Values set through environment variables are strings
+    if isinstance(value, str):
+        if value.lower() == 'true':
+            return True
+        elif value.lower() == 'false':
+            return False
+    return value
+
+
 DEFAULT_CONFIG = type('config', (), {
     'STATICFOLDER': '',
     'DISABLERESOLVE': False,
@@ -64,7 +74,27 @@ BASE_SCHEMA = {
             },
             'disable_sniffing': {
                 'type': 'boolean'
-            }
+            },
+            'httpCompress': {
+                'type': 'boolean',
+                'coerce': _to_bool,
+            },
+            'connectionsPerNode': {
+                'type': 'integer',
+                'nullable': True,
+                'min': 1,
+                'coerce': int,
+            },
+            'maxRetries': {
+                'type': 'integer',
+                'min': 0,
+                'coerce': int,
+            },
+            'timeout': {
+                'type': 'integer',
+                'min': 1,
+                'coerce': int,
+            },
         }
     },
     'SEARCHKEYS': {
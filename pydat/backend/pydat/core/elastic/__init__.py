@@ -19,9 +19,11 @@ class ElasticHandler:
         password=None,
         cacert=None,
         disable_sniffing=False,
-        max_retries=10,
+        max_retries=100,
         retry_on_timeout=True,
-        timeout=30,
+        timeout=100,
+        http_compress=False,
+        connections_per_node=None,
         # Add other options not currently handled for es config
         otherOptions=None,
         indexPrefix="pydat",
@@ -47,7 +49,8 @@ class ElasticHandler:
             'DATE_LAST_SEEN': 'dateLastSeen',
             'DATE_CREATED': 'dateCreated',
             'DATE_UPDATED': 'dateUpdated',
-            'HISTORICAL': 'historical'
+            'HISTORICAL': 'historical',
+            'DETAILS_HASH': 'detailsHash',
         })
         self.metadata_keys = list(vars(self.metadata_key_map).values())
         self.top_level_keys.extend(self.metadata_keys)
@@ -59,11 +62,17 @@ class ElasticHandler:
             'sniff_on_start': (not disable_sniffing),
             'sniff_on_connection_fail': (not disable_sniffing),
             'sniff_timeout': (None if disable_sniffing else 100),
-            'max_retries': 100,
-            'retry_on_timeout': True,
-            'timeout': 100
+            'max_retries': max_retries,
+            'retry_on_timeout': retry_on_timeout,
+            'timeout': timeout,
+            'http_compress': http_compress,
         }
 
+        # Size of the connection pool kept for each node, should cover
+        # the number of threads making requests at the same time
+        if connections_per_node is not None:
+            self.elastic_args['maxsize'] = connections_per_node
+
         security_args = dict()
 
         if username is not None and password is None:
@@ -7,10 +7,13 @@ from multiprocessing import (
 import json
 
 import queue
+import threading
 
 from pydat.core.logger import mpLogger, getLogger
 from pydat.core.elastic.ingest.event_tracker import EventTracker
 from pydat.core.elastic.ingest.stat_tracker import StatTracker
+from pydat.core.elastic.ingest.telemetry import Telemetry
+from pydat.core.elastic.ingest.checkpoint_tracker import CheckpointTracker
 from pydat.core.elastic.ingest.ingest_handler import (
     IngestHandler,
     RolloverRequired
@@ -20,6 +23,16 @@ from pydat.core.elastic.ingest.process_wrapper import (
     PopulatorOptions
 )
 from pydat.core.elastic.ingest.file_reader import FileReader
+from pydat.core.elastic.ingest.index_filters import IndexFilters
+from pydat.core.elastic.ingest.state_store import StateStore
+from pydat.core.elastic.ingest.profiler import clear_profiles, merge_profiles
+from pydat.core.elastic.ingest.bulk_files import (
+    BulkReplayer,
+    clear_bulk_files,
+    list_bulk_files,
+    read_manifest,
+    write_manifest,
+)
 from pydat.core.elastic.ingest.debug_levels import DebugLevel
 
 
@@ -60,8 +73,27 @@ class DataPopulator:
         comment="",
         bulk_fetch_size=50,
         bulk_ship_size=1000,
+        bulk_ship_bytes=5 * 1024 * 1024,
+        bulk_ship_inflight=1,
+        pre_encode=False,
         num_shipper_threads=2,
         num_fetcher_threads=2,
+        num_worker_threads=1,
+        split_size=0,
+        schedule="name",
+        batch_size=500,
+        reader_backend="csv",
+        dedup="off",
+        dedup_capacity=10000000,
+        state_dir=None,
+        index_filters=False,
+        state_store=False,
+        bulk_load=False,
+        async_translog=False,
+        telemetry_interval=0,
+        telemetry_file=None,
+        profile_dir=None,
+        emit_dir=None,
         verbose=False,
         debug=False,
     ):
@@ -91,12 +123,45 @@ class DataPopulator:
         self.ignore_field_prefixes = ignore_field_prefixes
         self.bulk_fetch_size = bulk_fetch_size
         self.bulk_ship_size = bulk_ship_size
+        self.bulk_ship_bytes = bulk_ship_bytes
+        self.bulk_ship_inflight = bulk_ship_inflight
+        self.pre_encode = pre_encode
         self.ingest_directory = ingest_directory
         self.ingest_file = ingest_file
         self.extension = extension
         self.ingest_day = ingest_day
         self.num_fetcher_threads = num_fetcher_threads
         self.num_shipper_threads = num_shipper_threads
+        self.num_worker_threads = num_worker_threads
+        self.split_size = split_size
+        self.schedule = schedule
+        self.batch_size = batch_size
+        self.reader_backend = reader_backend
+        self.dedup = dedup
+        self.dedup_capacity = dedup_capacity
+        self.state_dir = state_dir
+        self.use_index_filters = index_filters
+        if index_filters and state_dir is None:
+            raise ValueError("Index filters require a state directory")
+        self.use_state_store = state_store
+        if state_store and state_dir is None:
+            raise ValueError("The state store requires a state directory")
+        self.bulk_load = bulk_load
+        self.async_translog = async_translog
+        self.telemetry_interval = telemetry_interval
+        self.telemetry_file = telemetry_file
+        self.profile_dir = profile_dir
+        if telemetry_file is not None and not telemetry_interval:
+            raise ValueError("A telemetry file requires a telemetry interval")
+        self.emit_dir = emit_dir
+        if emit_dir is not None and (index_filters or state_store or
+                                     bulk_load):
+            raise ValueError((
+                "Bulk files cannot be emitted with index filters, the state "
+                "store or bulk loading"
+            ))
+        # Metadata record of the version whose bulk files are emitted
+        self.emitMetadata = None
         self.file_queue = jmpQueue(maxsize=10000)
 
         self.mplogger = mpLogger(debug=debug)
@@ -112,13 +177,29 @@ class DataPopulator:
 
         self.eventTracker = EventTracker()
         self.statTracker = StatTracker()
+        self.telemetry = None
+        if self.telemetry_interval:
+            self.telemetry = Telemetry(
+                interval=self.telemetry_interval,
+                path=self.telemetry_file,
+                file_queue=self.file_queue,
+                logger=self.logger,
+            )
+        self.checkpointTracker = None
+        self.indexFilters = None
+        self.stateStore = None
+        # Indices whose settings were changed for a bulk load
+        self.bulkLoadIndices = None
 
         self.readerThread = FileReader(
             self.file_queue,
             self.eventTracker,
             self.ingest_directory,
             self.ingest_file,
-            self.extension
+            self.extension,
+            split_size=self.split_size,
+            schedule=self.schedule,
+            readers=self.pipelines,
         )
 
         self.dataProcessorPool = None
@@ -161,35 +242,19 @@ class DataPopulator:
                 self.logger.debug("Cleaning up StatTracker")
             self.statTracker.shutdown()
             self.statTracker.join()
-
-            if self.debug >= DebugLevel.VERBOSE:
-                self.logger.debug("Updating Stats")
-            # Update the stats
-            try:
-                self.elastic_handler.updateMetadata(
-                    version=self.version,
-                    body={'doc': {
-                            'total': self.statTracker.total,
-                            'new': self.statTracker.new,
-                            'updated': self.statTracker.updated,
-                            'unchanged': self.statTracker.unchanged,
-                            'duplicates': self.statTracker.duplicates,
-                            'changed_stats': self.statTracker.changed_stats
-                        }
-                    }
-                )
-
-                # Clear importing on finish
-                self.elastic_handler.updateMetadata(
-                    version=0,
-                    body={
-                        'doc': {
-                            'importing': 0
-                        }
-                    }
-                )
-            except Exception:
-                self.logger.exception("Error attempting to update stats")
+            self._stopTelemetry()
+
+            if self.checkpointTracker is not None:
+                # The import completed so there is nothing to resume
+                self.checkpointTracker.shutdown()
+                self.checkpointTracker.join()
+                self.checkpointTracker.clear()
+
+            if self.emit_dir is not None:
+                # The metadata is applied when the files are replayed
+                self._writeManifest()
+            else:
+                self._updateStats()
         except KeyboardInterrupt:
             self.logger.info("Please wait for processing to complete ...")
 
@@ -200,6 +265,8 @@ class DataPopulator:
         except Exception:
             self.logger.debug("Exception closing queues", exc_info=True)
 
+        self._finishBulkLoad()
+
         if self.debug >= DebugLevel.VERBOSE:
             self.logger.debug("Refreshing Elastic Indices")
         try:
@@ -207,9 +274,73 @@ class DataPopulator:
         except Exception:
             self.logger.exception("Unable to refresh indices")
 
+        # Filters are only saved after a clean run, an interrupted one may
+        # have written documents the shippers never saw confirmed
+        if self.indexFilters is not None and not self.eventTracker.bulkError:
+            if self.debug >= DebugLevel.VERBOSE:
+                self.logger.debug("Saving index filters")
+            self.indexFilters.save(self.elastic_handler)
+
+        if self.stateStore is not None and not self.eventTracker.bulkError:
+            self.stateStore.finish(self.version)
+            self.stateStore.close()
+
         if self.verbose:
             self.logger.info("Done ...")
 
+    def _updateStats(self):
+        try:
+            self.elastic_handler.updateMetadata(
+                version=self.version,
+                body={'doc': {
+                        'total': self.statTracker.total,
+                        'new': self.statTracker.new,
+                        'updated': self.statTracker.updated,
+                        'unchanged': self.statTracker.unchanged,
+                        'duplicates': self.statTracker.duplicates,
+                        'changed_stats': self.statTracker.changed_stats
+                    }
+                }
+            )
+
+            # Clear importing on finish
+            self.elastic_handler.updateMetadata(
+                version=0,
+                body={
+                    'doc': {
+                        'importing': 0
+                    }
+                }
+            )
+        except Exception:
+            self.logger.exception("Error attempting to update stats")
+
+    def _writeManifest(self):
+        metadata = dict(self.emitMetadata)
+        metadata.update({
+            'total': self.statTracker.total,
+            'new': self.statTracker.new,
+            'updated': self.statTracker.updated,
+            'unchanged': self.statTracker.unchanged,
+            'duplicates': self.statTracker.duplicates,
+            'changed_stats': self.statTracker.changed_stats
+        })
+
+        try:
+            write_manifest(self.emit_dir, {
+                'version': self.version,
+                'metadata': metadata,
+                'files': list_bulk_files(self.emit_dir),
+            })
+        except Exception:
+            self.logger.exception("Unable to write bulk file manifest")
+            return
+
+        self.logger.info((
+            f"Bulk files for version {self.version} written to "
+            f"{self.emit_dir}, load them with --replay-bulk"
+        ))
+
     def _handleCancel(self):
         # Tell the reader to halt activites
         self.readerThread.shutdown()
@@ -246,28 +377,38 @@ class DataPopulator:
         # Send the finished message to the stats queue to shut it down
         self.statTracker.shutdown()
         self.statTracker.join()
+        self._stopTelemetry()
+
+        if self.checkpointTracker is not None:
+            self.logger.info("Saving checkpoint")
+            self.checkpointTracker.shutdown()
+            self.checkpointTracker.join()
+
+        self._finishBulkLoad()
 
         try:
             self.elastic_handler.refreshIndices()
         except Exception:
             self.logger.exception("Unable to refresh indices")
 
-        # Attempt to update the stats
+        # Attempt to update the stats, without a manifest emitted bulk
+        # files are never replayed so there is nothing to record
         try:
-            self.logger.info("Finalizing metadata")
-            self.elastic_handler.updateMetadata(
-                version=self.version,
-                body={
-                    'doc': {
-                        'total': self.statTracker.total,
-                        'new': self.statTracker.new,
-                        'updated': self.statTracker.updated,
-                        'unchanged': self.statTracker.unchanged,
-                        'duplicates': self.statTracker.duplicates,
-                        'changed_stats': self.statTracker.changed_stats
+            if self.emit_dir is None:
+                self.logger.info("Finalizing metadata")
+                self.elastic_handler.updateMetadata(
+                    version=self.version,
+                    body={
+                        'doc': {
+                            'total': self.statTracker.total,
+                            'new': self.statTracker.new,
+                            'updated': self.statTracker.updated,
+                            'unchanged': self.statTracker.unchanged,
+                            'duplicates': self.statTracker.duplicates,
+                            'changed_stats': self.statTracker.changed_stats
+                        }
                     }
-                }
-            )
+                )
         except Exception:
             self.logger.warning((
                 "Unable to finalize stats, data may be out of sync"),
@@ -282,6 +423,140 @@ class DataPopulator:
 
         self.logger.info("... Done")
 
+    def _setupCheckpoints(self, resume):
+        if self.state_dir is None:
+            return
+
+        self.checkpointTracker = CheckpointTracker(
+            self.state_dir,
+            self.version
+        )
+
+        if resume:
+            units = self.checkpointTracker.load()
+            if len(units) > 0:
+                self.logger.info((
+                    "Resuming from checkpoint, "
+                    f"{sum(1 for unit in units.values() if unit['done'])} "
+                    "completed file range(s) will be skipped"
+                ))
+            self.readerThread.checkpoints = units
+        else:
+            self.checkpointTracker.clear()
+
+        self.checkpointTracker.start()
+
+    def _setupIndexFilters(self):
+        if not self.use_index_filters:
+            return
+
+        self.indexFilters = IndexFilters(
+            self.state_dir,
+            self.elastic_handler.rollover_size,
+        )
+        self.indexFilters.setup(
+            self.elastic_handler,
+            self.elastic_handler.resolveAlias()
+        )
+
+    def _setupStateStore(self, first_import, reingest):
+        if not self.use_state_store:
+            return
+
+        store = StateStore(self.state_dir)
+        if first_import and not reingest:
+            store.clear()
+        elif not store.usable(self.version, reingest=reingest):
+            self.logger.warning((
+                "State store does not match the cluster, fetching records "
+                "from Elasticsearch instead. Rebuild the store with "
+                "--rebuild-state-store to use it"
+            ))
+            store.close()
+            return
+
+        store.begin(self.version)
+        # Connections are opened per process
+        store.close()
+        self.stateStore = store
+
+    def _setupRolloverCounts(self):
+        # Bulk files are rolled over as they are replayed
+        if self.emit_dir is not None:
+            return
+
+        # Shippers add the documents they create to these counts, so the
+        # cluster is only asked once
+        es = self.elastic_handler
+        counts = []
+        for alias in [es.indexNames.orig_write, es.indexNames.delta_write]:
+            es.refreshIndex(alias)
+            counts.append(es.countDocuments(alias))
+        self.eventTracker.setCreated(*counts)
+
+    def _stopTelemetry(self):
+        if self.telemetry is None or not self.telemetry.is_alive():
+            return
+
+        self.telemetry.shutdown()
+        self.telemetry.join()
+
+    def _setupProfiles(self):
+        if self.profile_dir is None:
+            return
+
+        os.makedirs(self.profile_dir, exist_ok=True)
+        clear_profiles(self.profile_dir)
+
+    def _reportProfiles(self):
+        if self.profile_dir is None:
+            return
+
+        try:
+            report_path = merge_profiles(
+                self.profile_dir, logger=self.logger)
+        except Exception:
+            self.logger.exception("Unable to merge pipeline profiles")
+            return
+
+        if report_path is None:
+            self.logger.warning("No pipeline profiles were written")
+        else:
+            self.logger.info(f"Profile report written to {report_path}")
+
+    def _setupBulkFiles(self):
+        if self.emit_dir is None:
+            return
+
+        os.makedirs(self.emit_dir, exist_ok=True)
+        clear_bulk_files(self.emit_dir)
+
+    def _startBulkLoad(self):
+        if not self.bulk_load:
+            return
+
+        self.logger.info("Configuring write indices for bulk loading")
+        indices = self.elastic_handler.startBulkLoad(
+            async_translog=self.async_translog)
+        self.bulkLoadIndices = sorted(
+            set(self.bulkLoadIndices or []) | set(indices))
+
+    def _finishBulkLoad(self):
+        if self.bulkLoadIndices is None:
+            return
+
+        (indices, self.bulkLoadIndices) = (self.bulkLoadIndices, None)
+        self.logger.info(
+            "Restoring index settings, waiting for replicas ...")
+        try:
+            self.elastic_handler.finishBulkLoad(indices)
+        except Exception:
+            self.logger.exception((
+                "Unable to restore the settings of indices "
+                f"{', '.join(indices)}, apply the template settings "
+                "manually"
+            ))
+
     def _handleIngest(
         self,
         first_import=False,
@@ -295,6 +570,17 @@ class DataPopulator:
             self.statTracker.seed(statsSeed['stats'])
             self.statTracker.seedChanged(statsSeed['changed'])
 
+        if self.telemetry is not None:
+            self.telemetry.start()
+
+        self._setupCheckpoints(resume=reingest)
+        self._setupIndexFilters()
+        self._setupStateStore(first_import, reingest)
+        self._startBulkLoad()
+        self._setupRolloverCounts()
+        self._setupProfiles()
+        self._setupBulkFiles()
+
         # Start up Reader Thread
         self.readerThread.start()
 
@@ -310,8 +596,18 @@ class DataPopulator:
             elastic_args=self.elastic_args,
             bulk_fetch_size=self.bulk_fetch_size,
             bulk_ship_size=self.bulk_ship_size,
+            bulk_ship_bytes=self.bulk_ship_bytes,
+            bulk_ship_inflight=self.bulk_ship_inflight,
+            pre_encode=self.pre_encode,
             num_fetcher_threads=self.num_fetcher_threads,
             num_shipper_threads=self.num_shipper_threads,
+            num_worker_threads=self.num_worker_threads,
+            batch_size=self.batch_size,
+            reader_backend=self.reader_backend,
+            dedup=self.dedup,
+            dedup_capacity=self.dedup_capacity,
+            profile_dir=self.profile_dir,
+            emit_dir=self.emit_dir,
             verbose=self.verbose,
             debug=self.debug,
         )
@@ -323,21 +619,32 @@ class DataPopulator:
             statTracker=self.statTracker,
             eventTracker=self.eventTracker,
             process_options=self.process_options,
+            checkpointTracker=self.checkpointTracker,
+            index_filters=self.indexFilters,
+            state_store=self.stateStore,
+            telemetry=self.telemetry,
         )
 
         self.dataProcessorPool.start()
 
         try:
             timer = time.time()
+            seen = self.eventTracker.changes
             while True:
                 try:
-                    timer = self.elastic_handler.rolloverTimer(timer)
+                    # Nothing is written to the cluster while emitting
+                    if self.emit_dir is None:
+                        timer = self.elastic_handler.rolloverTimer(
+                            timer, created=self.eventTracker.created)
                 except RolloverRequired as rollOver:
                     timer = time.time()
                     self.dataProcessorPool.handleRollover(
                         write_alias=rollOver.write_alias,
                         search_alias=rollOver.search_alias
                     )
+                    if self.bulkLoadIndices is not None:
+                        # Configure the newly created write index
+                        self._startBulkLoad()
 
                 # If bulkError occurs stop processing
                 if self.eventTracker.bulkError:
@@ -357,7 +664,8 @@ class DataPopulator:
                             "processing to complete ..."))
                     break
 
-                time.sleep(.1)
+                seen = self.eventTracker.wait(
+                    seen, self.elastic_handler.ROLLOVER_COUNT_TIME)
 
             # Wait on pipelines to finish up
             self.dataProcessorPool.join()
@@ -366,6 +674,10 @@ class DataPopulator:
             self._handleShutdown()
         except KeyboardInterrupt:
             self._handleCancel()
+        finally:
+            # In case of an unexpected error
+            self._finishBulkLoad()
+            self._reportProfiles()
 
         self.mplogger.join()
 
@@ -388,23 +700,10 @@ class DataPopulator:
         import_interrupted = importing > 0
 
         if import_interrupted:
-            raise InterruptedImportError(
-                "Previous Import was interupted, please resolve")
-
-        updateDoc = {
-            'doc': {
-                'importing': self.version,
-                'lastVersion': self.version
-            }
-        }
-
-        if metadata['lastVersion'] == 0:
-            updateDoc['doc']['firstVersion'] = 1
-
-        try:
-            self.elastic_handler.updateMetadata(0, updateDoc)
-        except Exception:
-            raise MetadataError("Unable to update metadata record")
+            raise InterruptedImportError((
+                "Previous Import was interupted, please resolve, e.g., by "
+                "rerunning with --redo to resume it"
+            ))
 
         # Create the entry for this import
         meta_struct = {'metadata': self.version,
@@ -423,14 +722,40 @@ class DataPopulator:
         elif self.include_fields is not None:
             meta_struct['included_keys'] = self.include_fields
 
+        if self.emit_dir is not None:
+            # The cluster is only read from, the metadata is applied when
+            # the bulk files are replayed
+            self.emitMetadata = meta_struct
+        else:
+            self._beginVersion(metadata, meta_struct)
+
+        self._handleIngest(first_import=first_import)
+
+    def _beginVersion(self, metadata, meta_struct):
+        updateDoc = {
+            'doc': {
+                'importing': self.version,
+                'lastVersion': self.version
+            }
+        }
+
+        if metadata['lastVersion'] == 0:
+            updateDoc['doc']['firstVersion'] = 1
+
+        try:
+            self.elastic_handler.updateMetadata(0, updateDoc)
+        except Exception:
+            raise MetadataError("Unable to update metadata record")
+
         try:
             self.elastic_handler.createMetadata(self.version, meta_struct)
         except Exception:
             raise MetadataError("Unable to create metadata record")
 
-        self._handleIngest(first_import=first_import)
-
     def reingest(self):
+        if self.emit_dir is not None:
+            raise ValueError("Bulk files cannot be emitted when reingesting")
+
         if not self.elastic_handler.metaExists:
             raise NoDataError(
                 "Cannot reingest when no data exists in cluster")
@@ -475,6 +800,189 @@ class DataPopulator:
             }
         )
 
+    def replayBulk(self, path, streams=4):
+        """Load bulk files written with emit_dir into the cluster
+
+        The files must continue the version the cluster is at, an
+        interrupted replay can be resumed by replaying the files again
+
+        Args:
+            path (str): Directory holding the bulk files and manifest
+            streams (int, optional): Number of files loaded at once.
+                Defaults to 4.
+        """
+        manifest = read_manifest(path)
+        if manifest is None:
+            raise NoDataError((
+                f"No manifest found in {path}, the bulk files are missing "
+                "or their ingest did not complete"
+            ))
+
+        files = [os.path.join(path, name) for name in manifest['files']]
+        missing = [name for name in files if not os.path.exists(name)]
+        if len(missing) > 0:
+            raise NoDataError(f"Missing bulk files: {', '.join(missing)}")
+
+        self.version = int(manifest['version'])
+        es = self.elastic_handler
+        if not es.metaExists:
+            if self.version != 1:
+                raise NoDataError((
+                    f"The bulk files hold version {self.version}, cannot "
+                    "load them into a cluster without data"
+                ))
+            es.initialize(self._getTemplate())
+
+        metadata = es.metaRecord
+        if metadata is None:
+            raise MetadataError("Unable to get metadata from cluster")
+
+        importing = int(metadata['importing'])
+        if importing > 0 and importing != self.version:
+            raise InterruptedImportError((
+                "Previous Import was interupted, please resolve before "
+                "replaying bulk files"
+            ))
+        elif importing == 0:
+            if int(metadata['lastVersion']) != self.version - 1:
+                raise MetadataError((
+                    f"The bulk files hold version {self.version} but the "
+                    f"cluster is at version {metadata['lastVersion']}"
+                ))
+            self._beginVersion(metadata, manifest['metadata'])
+        else:
+            self.logger.info(f"Resuming replay of version {self.version}")
+
+        self._startBulkLoad()
+        try:
+            replayer = BulkReplayer(
+                es,
+                files,
+                streams=streams,
+                bulk_size=self.bulk_ship_size,
+                bulk_bytes=self.bulk_ship_bytes,
+                max_inflight=self.bulk_ship_inflight,
+                # Configure newly created write indices
+                on_rollover=(
+                    self._startBulkLoad
+                    if self.bulkLoadIndices is not None else None
+                ),
+                logger=self.logger,
+            )
+            count = replayer.run()
+        finally:
+            self._finishBulkLoad()
+
+        es.refreshIndices()
+        try:
+            es.updateMetadata(version=0, body={'doc': {'importing': 0}})
+        except Exception:
+            raise MetadataError("Unable to update metadata record")
+
+        self.logger.info((
+            f"Replayed {count} bulk actions of version {self.version} from "
+            f"{len(files)} file(s)"
+        ))
+
+    def rebuildStateStore(self, slices=4):
+        """Rebuild the local state store from the data in the cluster
+
+        Args:
+            slices (int, optional): Number of parallel scroll slices to read
+                the cluster with. Defaults to 4.
+        """
+        if self.state_dir is None:
+            raise ValueError("The state store requires a state directory")
+
+        if not self.elastic_handler.metaExists:
+            raise NoDataError("No data exists in cluster")
+
+        metadata = self.elastic_handler.metaRecord
+        if metadata is None:
+            raise MetadataError("Unable to get metadata from cluster")
+        if int(metadata['importing']) > 0:
+            raise InterruptedImportError((
+                "Previous Import was interupted, please resolve before "
+                "rebuilding the state store"
+            ))
+
+        keys = self.elastic_handler.metadata_key_map
+        fields = [
+            keys.VERSION_KEY,
+            keys.FIRST_SEEN,
+            keys.DATE_FIRST_SEEN,
+            keys.DATE_CREATED,
+            keys.DETAILS_HASH,
+        ]
+        records = queue.Queue(maxsize=slices * 4)
+        errors = []
+
+        def scan_slice(slice_id):
+            try:
+                batch = []
+                for hit in self.elastic_handler.scanDocuments(
+                    self.elastic_handler.indexNames.orig_search,
+                    source=fields,
+                    slice_id=slice_id,
+                    max_slices=slices,
+                ):
+                    source = hit['_source']
+                    batch.append((
+                        hit['_id'],
+                        source.get(keys.VERSION_KEY),
+                        hit['_index'],
+                        source.get(keys.FIRST_SEEN),
+                        source.get(keys.DATE_FIRST_SEEN),
+                        source.get(keys.DATE_CREATED),
+                        source.get(keys.DETAILS_HASH),
+                    ))
+                    if len(batch) >= 10000:
+                        records.put(batch)
+                        batch = []
+                records.put(batch)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                records.put(None)
+
+        store = StateStore(self.state_dir)
+        store.clear()
+
+        scanners = [
+            threading.Thread(target=scan_slice, args=(slice_id,))
+            for slice_id in range(slices)
+        ]
+        for scanner in scanners:
+            scanner.start()
+
+        count = 0
+        remaining = slices
+        while remaining > 0:
+            batch = records.get()
+            if batch is None:
+                remaining -= 1
+                continue
+            store.apply(records=batch)
+            count += len(batch)
+            if self.verbose:
+                self.logger.info(f"Loaded {count} records into state store")
+
+        for scanner in scanners:
+            scanner.join()
+
+        if len(errors) > 0:
+            store.close()
+            raise errors[0]
+
+        store.finish(int(metadata['lastVersion']))
+        store.close()
+        self.logger.info(f"Rebuilt state store with {count} records")
+
+    @property
+    def total_bytes(self):
+        """Total size of the data files found by the file reader"""
+        return self.readerThread.total_bytes
+
     @property
     def stats(self):
         return self.statTracker
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+import time
+import random
+from threading import Lock
+
+
+class RetriesExhausted(Exception):
+    pass
+
+
+class AdaptiveBatchSize:
+    """Request size controller that backs off when elasticsearch is busy
+
+    The size is halved every time a request is rejected (HTTP 429) and
+    grown again by a quarter after a run of successful requests, never
+    going above the configured maximum. Retries of rejected requests are
+    spaced out with exponential backoff and full jitter so the pipelines
+    do not retry in lockstep. A controller can be shared by threads
+    sending requests concurrently.
+
+    Args:
+        size (int): Starting, and maximum, size of a request
+        min_size (int, optional): Smallest size to shrink to. Defaults to 1.
+        grow_after (int, optional): Number of consecutive successes before
+            growing the size. Defaults to 10.
+        base_delay (float, optional): Delay in seconds before the first
+            retry. Defaults to 0.5.
+        max_delay (float, optional): Cap on the retry delay in seconds.
+            Defaults to 60.
+        should_stop (callable, optional): Checked while waiting to retry,
+            when it returns True retrying is abandoned. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        size,
+        min_size=1,
+        grow_after=10,
+        base_delay=0.5,
+        max_delay=60,
+        should_stop=None,
+    ):
+        self.max_size = max(1, size)
+        self.min_size = max(1, min(min_size, self.max_size))
+        self.size = self.max_size
+        self.grow_after = grow_after
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.should_stop = should_stop
+        self.failures = 0
+        self.successes = 0
+        self.rejections = 0
+        self._lock = Lock()
+
+    def succeeded(self):
+        """Record a request that was accepted"""
+        with self._lock:
+            self.failures = 0
+            self.successes += 1
+            if (self.successes >= self.grow_after and
+                    self.size < self.max_size):
+                self.size = min(
+                    self.max_size, self.size + max(1, self.size // 4))
+                self.successes = 0
+
+    def rejected(self, attempted=None):
+        """Record a rejected request, shrinking the size
+
+        Args:
+            attempted (int, optional): Size of the rejected request, if it
+                was smaller than the current size, e.g., a request limited
+                by its size in bytes. Defaults to None.
+        """
+        with self._lock:
+            self.rejections += 1
+            self.failures += 1
+            self.successes = 0
+            size = self.size
+            if attempted is not None:
+                size = min(size, attempted)
+            self.size = max(self.min_size, size // 2)
+
+    def delay(self):
+        """The time to wait before retrying after the latest rejection"""
+        ceiling = min(
+            self.max_delay,
+            self.base_delay * (2 ** max(0, self.failures - 1)))
+        return random.uniform(0, ceiling)
+
+    def backoff(self):
+        """Wait before retrying a rejected request
+
+        Returns:
+            float: The time waited in seconds
+
+        Raises:
+            RetriesExhausted: If should_stop indicates to give up
+        """
+        delay = self.delay()
+        deadline = time.time() + delay
+        while True:
+            if self.should_stop is not None and self.should_stop():
+                raise RetriesExhausted("Stopped while waiting to retry")
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, .1))
+        return delay
@@ -0,0 +1,19 @@
+from pydat.core.elastic.ingest.benchmark.synthetic import SyntheticWhois
+from pydat.core.elastic.ingest.benchmark.fake_elastic import (
+    FakeElasticsearch,
+)
+from pydat.core.elastic.ingest.benchmark.runner import (
+    SCENARIOS,
+    IngestBenchmark,
+    BenchmarkResult,
+    run_scenarios,
+)
+
+__all__ = [
+    'SyntheticWhois',
+    'FakeElasticsearch',
+    'SCENARIOS',
+    'IngestBenchmark',
+    'BenchmarkResult',
+    'run_scenarios',
+]
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+import json
+import time
+import copy
+from threading import Lock
+from types import SimpleNamespace
+
+
+class _Serializer:
+    def dumps(self, data):
+        return json.dumps(data, separators=(',', ':'), default=str)
+
+
+class _Indices:
+    def __init__(self, cluster):
+        self._cluster = cluster
+
+    def get_alias(self, name):
+        return {
+            index: {'aliases': {name: {}}}
+            for index in self._cluster.resolve(name)
+        }
+
+    def refresh(self, index=None):
+        return {}
+
+    def rollover(self, alias, body=None, new_index=None, dry_run=False):
+        return self._cluster.rollover(alias, new_index, dry_run)
+
+
+class _Cat:
+    def __init__(self, cluster):
+        self._cluster = cluster
+
+    def count(self, index, h=None):
+        count = self._cluster.count(index=index)['count']
+        if h == "count":
+            return str(count)
+        return f"{int(time.time())} 00:00:00 {count}"
+
+
+def _merge(target, partial):
+    for (key, value) in partial.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = value
+
+
+class FakeElasticsearch:
+    """In-process stand-in for the parts of the cluster used by the ingest
+
+    Serves mget, bulk, count, cat.count and the alias and rollover calls
+    made by IngestHandler from documents kept in memory, so the pipeline
+    stages can be run without a cluster. Assign an instance to the `_es`
+    attribute of an IngestHandler to use it
+
+    Args:
+        prefix (str, optional): Index prefix of the handler.
+            Defaults to "pydat".
+        mget_latency (float, optional): Seconds added to every mget.
+            Defaults to 0.
+        bulk_latency (float, optional): Seconds added to every bulk
+            request. Defaults to 0.
+        bulk_item_latency (float, optional): Seconds added per action of a
+            bulk request. Defaults to 0.
+    """
+
+    def __init__(
+        self,
+        prefix="pydat",
+        mget_latency=0,
+        bulk_latency=0,
+        bulk_item_latency=0,
+    ):
+        self.prefix = prefix
+        self.mget_latency = mget_latency
+        self.bulk_latency = bulk_latency
+        self.bulk_item_latency = bulk_item_latency
+        self.transport = SimpleNamespace(serializer=_Serializer())
+        self.indices = _Indices(self)
+        self.cat = _Cat(self)
+        self.requests = {'mget': 0, 'bulk': 0}
+        self._lock = Lock()
+        # Documents by index then id
+        self._documents = dict()
+        # Indices of each alias, the last one is the write index
+        self._aliases = dict()
+        for (kind, search) in [('data', 'orig'), ('data-delta', 'delta')]:
+            index = f"{prefix}-{kind}-000001"
+            self._documents[index] = dict()
+            self._aliases[f"{prefix}-{kind}-write"] = [index]
+            self._aliases[f"{prefix}-data-{search}"] = [index]
+
+    def resolve(self, name):
+        """The indices behind an index or alias name"""
+        if name in self._aliases:
+            return list(self._aliases[name])
+        if name in self._documents:
+            return [name]
+        return []
+
+    def _write_index(self, name):
+        if name in self._aliases:
+            return self._aliases[name][-1]
+        return name
+
+    def rollover(self, alias, new_index=None, dry_run=False):
+        with self._lock:
+            old_index = self._aliases[alias][-1]
+            if new_index is None:
+                (base, number) = old_index.rsplit('-', 1)
+                new_index = f"{base}-{int(number) + 1:06d}"
+            if dry_run:
+                return {'old_index': old_index, 'new_index': new_index}
+            self._documents[new_index] = dict()
+            self._aliases[alias] = [new_index]
+            for (name, indices) in self._aliases.items():
+                if name != alias and old_index in indices:
+                    indices.append(new_index)
+        return {'old_index': old_index, 'new_index': new_index}
+
+    def count(self, index=None):
+        with self._lock:
+            return {'count': sum(
+                len(self._documents.get(name, {}))
+                for name in self.resolve(index)
+            )}
+
+    def mget(self, body):
+        if self.mget_latency:
+            time.sleep(self.mget_latency)
+
+        docs = list()
+        with self._lock:
+            self.requests['mget'] += 1
+            for doc in body['docs']:
+                index = self._write_index(doc['_index'])
+                if index not in self._documents:
+                    docs.append({
+                        '_index': index,
+                        '_id': doc['_id'],
+                        'error': {'type': 'index_not_found_exception'},
+                    })
+                    continue
+                source = self._documents[index].get(doc['_id'])
+                if source is None:
+                    docs.append({
+                        '_index': index, '_id': doc['_id'], 'found': False})
+                    continue
+
+                fields = doc.get('_source', True)
+                if isinstance(fields, list):
+                    source = {
+                        field: source[field] for field in fields
+                        if field in source
+                    }
+                else:
+                    source = copy.deepcopy(source)
+                docs.append({
+                    '_index': index,
+                    '_id': doc['_id'],
+                    'found': True,
+                    '_source': source,
+                })
+
+        return {'docs': docs}
+
+    def bulk(self, body):
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        lines = iter(line for line in body.split("\n") if line)
+
+        items = list()
+        with self._lock:
+            self.requests['bulk'] += 1
+            for line in lines:
+                (op_type, meta) = next(iter(json.loads(line).items()))
+                data = None
+                if op_type != 'delete':
+                    data = json.loads(next(lines))
+                items.append({op_type: self._apply(op_type, meta, data)})
+
+        if self.bulk_latency or self.bulk_item_latency:
+            time.sleep(self.bulk_latency + self.bulk_item_latency * len(items))
+
+        return {
+            'took': 1,
+            'errors': any(
+                next(iter(item.values()))['status'] >= 300
+                for item in items
+            ),
+            'items': items,
+        }
+
+    def _apply(self, op_type, meta, data):
+        index = self._write_index(meta['_index'])
+        _id = meta.get('_id')
+        documents = self._documents.setdefault(index, dict())
+        result = {'_index': index, '_id': _id}
+
+        if op_type == 'create':
+            if _id in documents:
+                result.update({'status': 409, 'error': {
+                    'type': 'version_conflict_engine_exception',
+                    'reason': f"[{_id}]: version conflict, document "
+                              "already exists"}})
+                return result
+            documents[_id] = data
+            result.update({'status': 201, 'result': 'created'})
+        elif op_type == 'index':
+            status = 200 if _id in documents else 201
+            documents[_id] = data
+            result.update({
+                'status': status,
+                'result': 'updated' if status == 200 else 'created'})
+        elif op_type == 'update':
+            if _id not in documents:
+                result.update({'status': 404, 'error': {
+                    'type': 'document_missing_exception',
+                    'reason': f"[{_id}]: document missing"}})
+                return result
+            _merge(documents[_id], data['doc'])
+            result.update({'status': 200, 'result': 'updated'})
+        elif op_type == 'delete':
+            if documents.pop(_id, None) is None:
+                result.update({'status': 404, 'result': 'not_found'})
+            else:
+                result.update({'status': 200, 'result': 'deleted'})
+
+        return result
@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+
+import os
+import time
+import queue
+import logging
+import tempfile
+
+from pydat.core.elastic.ingest.event_tracker import EventTracker
+from pydat.core.elastic.ingest.stat_tracker import StatTracker
+from pydat.core.elastic.ingest.ingest_handler import IngestHandler
+from pydat.core.elastic.ingest.process_wrapper import PopulatorOptions
+from pydat.core.elastic.ingest.seen_domains import SeenDomains
+from pydat.core.elastic.ingest.data_processors import (
+    DataReader,
+    DataFetcher,
+    DataWorker,
+    DataShipper,
+)
+from pydat.core.elastic.ingest.benchmark.synthetic import (
+    SyntheticWhois,
+    IGNORED_PREFIXES,
+)
+from pydat.core.elastic.ingest.benchmark.fake_elastic import (
+    FakeElasticsearch,
+)
+
+
+SCENARIOS = ['first_import', 'incremental', 'reingest']
+STAGES = ['read', 'fetch', 'work', 'ship']
+
+
+class StageResult:
+    """Rows handled by a stage and the time it took"""
+
+    def __init__(self, rows, seconds):
+        self.rows = rows
+        self.seconds = seconds
+
+    @property
+    def rate(self):
+        if self.seconds <= 0:
+            return 0.0
+        return self.rows / self.seconds
+
+
+class BenchmarkResult:
+    """Outcome of a benchmark scenario
+
+    Args:
+        scenario (str): The scenario run
+        stages (dict): StageResult of each stage
+        stats (dict): Ingest stats, as kept by the StatTracker
+        requests (dict): Number of mget and bulk requests made
+        options (dict, optional): Ingest options the scenario ran with.
+            Defaults to None.
+    """
+
+    def __init__(self, scenario, stages, stats, requests, options=None):
+        self.scenario = scenario
+        self.stages = stages
+        self.stats = stats
+        self.requests = requests
+        self.options = options or dict()
+
+    @property
+    def seconds(self):
+        return sum(stage.seconds for stage in self.stages.values())
+
+    @property
+    def rate(self):
+        """Rows read per second across all stages"""
+        if self.seconds <= 0:
+            return 0.0
+        return self.stages['read'].rows / self.seconds
+
+    def as_dict(self):
+        return {
+            'scenario': self.scenario,
+            'seconds': self.seconds,
+            'rows_per_second': self.rate,
+            'stages': {
+                name: {
+                    'rows': stage.rows,
+                    'seconds': stage.seconds,
+                    'rows_per_second': stage.rate,
+                }
+                for (name, stage) in self.stages.items()
+            },
+            'stats': self.stats,
+            'requests': self.requests,
+            'options': self.options,
+        }
+
+
+class IngestBenchmark:
+    """Runs the ingest stages against a FakeElasticsearch
+
+    The stages run one after the other over the whole file, in the
+    current thread, so the time spent in each is measured on its own and
+    runs are reproducible
+
+    Args:
+        data (SyntheticWhois): Generator of the data to ingest
+        workdir (str, optional): Directory to write the csv files to.
+            Defaults to None, a temporary directory.
+        mget_latency (float, optional): Seconds added to every mget.
+            Defaults to 0.
+        bulk_latency (float, optional): Seconds added to every bulk
+            request. Defaults to 0.
+        **options: Overrides of the ingest options, e.g., batch_size
+    """
+
+    DEFAULT_OPTIONS = {
+        'ingest_day': "2021-01-01",
+        'ingest_now': "2021-01-01",
+        'ignore_field_prefixes': IGNORED_PREFIXES,
+        'include_fields': None,
+        'exclude_fields': None,
+        'bulk_fetch_size': 50,
+        'bulk_ship_size': 1000,
+        'bulk_ship_bytes': 5 * 1024 * 1024,
+        'bulk_ship_inflight': 1,
+        'pre_encode': False,
+        'batch_size': 500,
+        'reader_backend': 'csv',
+        'dedup': 'off',
+        'dedup_capacity': 10000000,
+        'verbose': False,
+        'debug': 0,
+    }
+
+    def __init__(
+        self,
+        data,
+        workdir=None,
+        mget_latency=0,
+        bulk_latency=0,
+        **options
+    ):
+        self.data = data
+        self.workdir = workdir
+        self.mget_latency = mget_latency
+        self.bulk_latency = bulk_latency
+        self.options = dict(self.DEFAULT_OPTIONS)
+        self.options.update(options)
+        self.logger = logging.getLogger(__name__)
+
+    def handler(self, cluster):
+        es = IngestHandler(hosts="localhost:9200")
+        es._es = cluster
+        return es
+
+    def run(self, scenario):
+        """Run a scenario on a new fake cluster
+
+        Args:
+            scenario (str): One of SCENARIOS
+
+        Returns:
+            BenchmarkResult: The measurements of the timed ingest
+        """
+        if scenario not in SCENARIOS:
+            raise ValueError(f"Unknown scenario {scenario}")
+
+        if self.workdir is not None:
+            os.makedirs(self.workdir, exist_ok=True)
+            return self._run(scenario, self.workdir)
+
+        with tempfile.TemporaryDirectory() as workdir:
+            return self._run(scenario, workdir)
+
+    def _run(self, scenario, workdir):
+        cluster = FakeElasticsearch()
+
+        # Earlier versions are loaded without latency or timing
+        if scenario == 'first_import':
+            timed = (1, False)
+        elif scenario == 'incremental':
+            self.ingest(cluster, workdir, 1)
+            timed = (2, False)
+        else:
+            self.ingest(cluster, workdir, 1)
+            self.ingest(cluster, workdir, 2)
+            timed = (2, True)
+
+        cluster.mget_latency = self.mget_latency
+        cluster.bulk_latency = self.bulk_latency
+        cluster.requests = {'mget': 0, 'bulk': 0}
+        (stages, stats) = self.ingest(
+            cluster, workdir, timed[0], reingest=timed[1])
+
+        return BenchmarkResult(
+            scenario, stages, stats, cluster.requests, dict(self.options))
+
+    def ingest(self, cluster, workdir, version, reingest=False):
+        """Ingest a version of the data, one stage at a time
+
+        Args:
+            cluster (FakeElasticsearch): The cluster to ingest into
+            workdir (str): Directory holding the csv files
+            version (int): The version to ingest
+            reingest (bool, optional): Redo an ingest of the version.
+                Defaults to False.
+
+        Returns:
+            tuple: StageResult of each stage and the ingest stats
+        """
+        path = os.path.join(workdir, self.data.filename(version))
+        if not os.path.exists(path):
+            self.data.write(path, version)
+
+        options = PopulatorOptions(
+            version=version,
+            reingest=reingest,
+            first_import=(version == 1),
+            **self.options
+        )
+        es = self.handler(cluster)
+        event_tracker = EventTracker()
+        stat_tracker = StatTracker()
+        stats = stat_tracker.get_tracker()
+        stages = dict()
+
+        # Read
+        data_queue = queue.Queue()
+        reader = DataReader(
+            0, None, data_queue, event_tracker, options, logger=self.logger)
+        start = time.perf_counter()
+        reader.parse_csv(path)
+        read_batches = list(data_queue.queue)
+        stages['read'] = StageResult(
+            sum(len(batch['rows']) for batch in read_batches),
+            time.perf_counter() - start)
+
+        # Fetch
+        seen_domains = None
+        if options.dedup != 'off':
+            seen_domains = SeenDomains(
+                mode=options.dedup, capacity=options.dedup_capacity)
+        fetcher = DataFetcher(
+            0, 0, None, None, event_tracker, es, es.resolveAlias(),
+            options.first_import and not reingest, options,
+            statTracker=stats, seen_domains=seen_domains,
+            logger=self.logger,
+        )
+        start = time.perf_counter()
+        work_batches = [
+            fetcher.handle_batch(batch['header'], batch['rows'])
+            for batch in read_batches
+        ]
+        stages['fetch'] = StageResult(
+            stages['read'].rows, time.perf_counter() - start)
+
+        # Work
+        worker = DataWorker(
+            0, None, None, stats, event_tracker, es, options,
+            logger=self.logger)
+        start = time.perf_counter()
+        insert_queue = queue.Queue()
+        for batch in work_batches:
+            commands = worker.handle_batch(batch)
+            if options.pre_encode and len(commands) > 0:
+                commands = worker.encode_batch(commands)
+            if len(commands) > 0:
+                insert_queue.put((None, commands))
+        stages['work'] = StageResult(
+            sum(len(batch) for batch in work_batches),
+            time.perf_counter() - start)
+
+        # Ship
+        commands = sum(len(batch) for (_, batch) in insert_queue.queue)
+        shipper = DataShipper(
+            0, 0, es, insert_queue, event_tracker, options,
+            statTracker=stats, logger=self.logger)
+        shipper.finish()
+        start = time.perf_counter()
+        shipper.run()
+        stages['ship'] = StageResult(commands, time.perf_counter() - start)
+
+        if event_tracker.shipError:
+            raise RuntimeError("Unable to ship documents to the fake cluster")
+
+        stats.flush()
+        stat_tracker.shutdown()
+        stat_tracker.run()
+
+        return (stages, dict(stat_tracker.stats))
+
+
+def run_scenarios(scenarios=None, rows=10000, seed=0, **kwargs):
+    """Run benchmark scenarios on the same synthetic data
+
+    Args:
+        scenarios (list, optional): Scenarios to run. Defaults to None,
+            all of SCENARIOS.
+        rows (int, optional): Domains in the first version.
+            Defaults to 10000.
+        seed (int, optional): Defaults to 0.
+        **kwargs: Passed to SyntheticWhois for the data settings
+            (duplicate_rate, change_rate, new_rate) and to IngestBenchmark
+            for the rest
+
+    Returns:
+        list: BenchmarkResult of each scenario
+    """
+    data_args = {
+        name: kwargs.pop(name)
+        for name in ['duplicate_rate', 'change_rate', 'new_rate']
+        if name in kwargs
+    }
+    data = SyntheticWhois(rows, seed=seed, **data_args)
+    benchmark = IngestBenchmark(data, **kwargs)
+    return [benchmark.run(scenario) for scenario in (scenarios or SCENARIOS)]
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+
+import csv
+import random
+
+
+# Fields of the WHOIS dumps, as mapped by the data template
+DETAIL_FIELDS = [
+    'registrarName',
+    'contactEmail',
+    'whoisServer',
+    'nameServers',
+    'createdDate',
+    'updatedDate',
+    'expiresDate',
+    'standardRegCreatedDate',
+    'standardRegUpdatedDate',
+    'standardRegExpiresDate',
+    'status',
+    'Audit_auditUpdatedDate',
+    'registrant_email',
+    'registrant_name',
+    'registrant_organization',
+    'registrant_street1',
+    'registrant_street2',
+    'registrant_street3',
+    'registrant_street4',
+    'registrant_city',
+    'registrant_state',
+    'registrant_postalCode',
+    'registrant_country',
+    'registrant_fax',
+    'registrant_faxExt',
+    'registrant_telephone',
+    'registrant_telephoneExt',
+    'administrativeContact_email',
+    'administrativeContact_name',
+    'administrativeContact_organization',
+    'administrativeContact_street1',
+    'administrativeContact_street2',
+    'administrativeContact_street3',
+    'administrativeContact_street4',
+    'administrativeContact_city',
+    'administrativeContact_state',
+    'administrativeContact_postalCode',
+    'administrativeContact_country',
+    'administrativeContact_fax',
+    'administrativeContact_faxExt',
+    'administrativeContact_telephone',
+    'administrativeContact_telephoneExt',
+]
+
+# Contacts found in the dumps that are usually ignored with
+# ignore_field_prefixes
+IGNORED_PREFIXES = ['billingContact', 'technicalContact', 'zoneContact']
+IGNORED_FIELDS = [
+    f"{prefix}_{name}"
+    for prefix in IGNORED_PREFIXES
+    for name in ['email', 'name', 'organization', 'telephone']
+]
+
+WHOIS_HEADER = ['domainName'] + DETAIL_FIELDS + IGNORED_FIELDS
+
+TLDS = ['com', 'net', 'org', 'info', 'biz']
+REGISTRARS = [
+    'Example Registrar, Inc.',
+    'Registrar of Names LLC',
+    'Domains & More Ltd',
+    'Sample Registry Services',
+]
+COUNTRIES = ['UNITED STATES', 'CANADA', 'GERMANY', 'JAPAN', 'BRAZIL']
+
+
+class SyntheticWhois:
+    """Deterministic generator of WHOIS csv dumps
+
+    Version 1 holds `rows` domains. Every later version holds the domains
+    of the version before it, where each domain changed with a probability
+    of change_rate, plus rows * new_rate new domains. Rows repeated within
+    a file, as happens in real dumps, are added with a probability of
+    duplicate_rate. The same seed always generates the same files
+
+    Args:
+        rows (int): Number of domains in the first version
+        duplicate_rate (float, optional): Fraction of rows repeated in a
+            file. Defaults to 0.01.
+        change_rate (float, optional): Fraction of domains changed in each
+            version after the first. Defaults to 0.1.
+        new_rate (float, optional): New domains in each version after the
+            first, as a fraction of rows. Defaults to 0.05.
+        seed (int, optional): Defaults to 0.
+    """
+
+    def __init__(
+        self,
+        rows,
+        duplicate_rate=0.01,
+        change_rate=0.1,
+        new_rate=0.05,
+        seed=0
+    ):
+        self.rows = rows
+        self.duplicate_rate = duplicate_rate
+        self.change_rate = change_rate
+        self.new_rate = new_rate
+        self.seed = seed
+
+    @property
+    def new_per_version(self):
+        return int(self.rows * self.new_rate)
+
+    def domain_count(self, version):
+        """Number of distinct domains in a version"""
+        return self.rows + self.new_per_version * (version - 1)
+
+    def changed(self, number, version):
+        """Whether a domain changed in a version"""
+        if version <= 1 or number >= self.domain_count(version - 1):
+            return False
+        rng = random.Random(f"{self.seed}:changed:{number}:{version}")
+        return rng.random() < self.change_rate
+
+    def changed_count(self, version):
+        """Number of domains that changed in a version"""
+        return sum(
+            1 for number in range(self.domain_count(version))
+            if self.changed(number, version)
+        )
+
+    def revision(self, number, version):
+        return sum(
+            1 for past in range(2, version + 1)
+            if self.changed(number, past)
+        )
+
+    def domain(self, number):
+        rng = random.Random(f"{self.seed}:domain:{number}")
+        label = "".join(
+            rng.choice("abcdefghijklmnopqrstuvwxyz0123456789-")
+            for _ in range(rng.randint(3, 20))
+        ).strip('-')
+        return f"d{number:x}{label}.{rng.choice(TLDS)}"
+
+    def row(self, number, version):
+        """Generate the csv row of a domain in a version
+
+        Args:
+            number (int): The domain number
+            version (int): The version of the data
+
+        Returns:
+            list: The row, matching WHOIS_HEADER
+        """
+        revision = self.revision(number, version)
+        rng = random.Random(f"{self.seed}:row:{number}:{revision}")
+        name = f"Person {rng.randint(0, 1000000)}"
+        organization = f"Organization {rng.randint(0, 100000)} & Co"
+        email = f"contact{rng.randint(0, 1000000)}@example.com"
+        created = f"{rng.randint(1995, 2020)}-{rng.randint(1, 12):02d}-01"
+        updated = f"{2020 + revision}-{rng.randint(1, 12):02d}-01"
+        expires = f"{2025 + revision}-{rng.randint(1, 12):02d}-01"
+        country = rng.choice(COUNTRIES)
+
+        values = {
+            'registrarName': rng.choice(REGISTRARS),
+            'contactEmail': email,
+            'whoisServer': 'whois.example.com',
+            'nameServers': (
+                f"ns1.host{rng.randint(0, 999)}.com|"
+                f"ns2.host{rng.randint(0, 999)}.com"
+            ),
+            'createdDate': f"{created}T00:00:00Z",
+            'updatedDate': f"{updated}T00:00:00Z",
+            'expiresDate': f"{expires}T00:00:00Z",
+            'standardRegCreatedDate': f"{created} 00:00:00 UTC",
+            'standardRegUpdatedDate': f"{updated} 00:00:00 UTC",
+            'standardRegExpiresDate': f"{expires} 00:00:00 UTC",
+            'status': 'clientTransferProhibited',
+            'Audit_auditUpdatedDate': f"{updated} 00:00:00 UTC",
+        }
+        for contact in ['registrant', 'administrativeContact']:
+            values.update({
+                f"{contact}_email": email,
+                f"{contact}_name": name,
+                f"{contact}_organization": organization,
+                f"{contact}_street1": f"{rng.randint(1, 9999)} Main St",
+                f"{contact}_city": f"City {rng.randint(0, 500)}",
+                f"{contact}_state": f"State {rng.randint(0, 50)}",
+                f"{contact}_postalCode": f"{rng.randint(0, 99999):05d}",
+                f"{contact}_country": country,
+                f"{contact}_telephone": f"1{rng.randint(0, 10**10):010d}",
+            })
+        for field in IGNORED_FIELDS:
+            values[field] = name if field.endswith('_name') else ''
+
+        return [self.domain(number)] + [
+            values.get(field, '') for field in WHOIS_HEADER[1:]]
+
+    def rows_for(self, version):
+        """Generate the rows of a version, including duplicates"""
+        rng = random.Random(f"{self.seed}:duplicates:{version}")
+        for number in range(self.domain_count(version)):
+            row = self.row(number, version)
+            yield row
+            if rng.random() < self.duplicate_rate:
+                yield row
+
+    def filename(self, version):
+        """Name of the file of a version, unique to the generator settings
+        """
+        return (
+            f"whois.{self.rows}.{self.duplicate_rate}.{self.change_rate}."
+            f"{self.new_rate}.{self.seed}.v{version}.csv"
+        )
+
+    def write(self, path, version):
+        """Write the csv dump of a version
+
+        Args:
+            path (str): The file to write
+            version (int): The version of the data
+
+        Returns:
+            int: The number of rows written
+        """
+        count = 0
+        with open(path, 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file, quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(WHOIS_HEADER)
+            for row in self.rows_for(version):
+                writer.writerow(row)
+                count += 1
+        return count
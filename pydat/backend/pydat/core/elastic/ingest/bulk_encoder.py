@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+import json
+from elasticsearch import helpers
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(data):
+    """Encode data as compact JSON bytes
+
+    Uses orjson when it is installed, otherwise the standard library with
+    the same settings as the elasticsearch client serializer
+
+    Args:
+        data (dict): The data to encode
+
+    Returns:
+        bytes: The encoded data
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=str)
+    return json.dumps(
+        data, ensure_ascii=False, separators=(',', ':'), default=str
+    ).encode('utf-8')
+
+
+class PreparedAction:
+    """A bulk command along with its encoded NDJSON lines
+
+    The shipper sends the lines as they are, the command is kept so the
+    result of the action can be interpreted once elasticsearch confirms it
+    """
+    __slots__ = ['command', 'lines']
+
+    def __init__(self, command, lines):
+        self.command = command
+        self.lines = lines
+
+
+def prepare(command):
+    """Encode a bulk command into its action and source lines
+
+    Args:
+        command (dict): Bulk command as accepted by the bulk helpers
+
+    Returns:
+        PreparedAction: The command and its encoded lines
+    """
+    (action, data) = helpers.expand_action(command)
+    lines = [dumps(action)]
+    if data is not None:
+        lines.append(dumps(data))
+    return PreparedAction(command, lines)
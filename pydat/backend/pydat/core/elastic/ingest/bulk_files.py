@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+
+import os
+import gzip
+import json
+import time
+import queue
+import logging
+from threading import Thread, Lock, Event
+
+from pydat.core.elastic.ingest.adaptive import AdaptiveBatchSize
+from pydat.core.elastic.ingest.bulk_encoder import PreparedAction
+from pydat.core.elastic.ingest.ingest_handler import RolloverRequired
+
+
+# Uncompressed size after which a new bulk file is started
+BULK_FILE_BYTES = 128 * 1024 * 1024
+BULK_FILE_SUFFIX = ".ndjson.gz"
+# Favor speed, the files are short lived
+COMPRESS_LEVEL = 3
+MANIFEST_NAME = "manifest.json"
+
+
+class BulkFileWriter:
+    """Writes bulk actions to rotating gzip compressed NDJSON files
+
+    Files are named {name}.{sequence}.ndjson.gz and are only given that
+    name once they are closed, so a partially written file is never
+    picked up by a replay
+
+    Args:
+        path (str): Directory to write the files to
+        name (str): Prefix of the file names, unique to the writer
+        max_bytes (int, optional): Uncompressed size after which a new
+            file is started. Defaults to BULK_FILE_BYTES.
+    """
+
+    def __init__(self, path, name, max_bytes=BULK_FILE_BYTES):
+        self.path = path
+        self.name = name
+        self.max_bytes = max_bytes
+        self.files = []
+        self._file = None
+        self._filename = None
+        self._bytes = 0
+
+    def write(self, lines):
+        """Write the lines of an action
+
+        Args:
+            lines (list): Encoded NDJSON lines of the action
+
+        Returns:
+            int: The number of uncompressed bytes written
+        """
+        if self._file is None:
+            self._filename = os.path.join(
+                self.path,
+                f"{self.name}.{len(self.files):05d}{BULK_FILE_SUFFIX}"
+            )
+            self._file = gzip.open(
+                f"{self._filename}.tmp", 'wb', compresslevel=COMPRESS_LEVEL)
+            self._bytes = 0
+
+        data = b"\n".join(lines) + b"\n"
+        self._file.write(data)
+        self._bytes += len(data)
+        # Files are only rotated in between actions
+        if self._bytes >= self.max_bytes:
+            self.close()
+        return len(data)
+
+    def close(self):
+        if self._file is None:
+            return
+
+        self._file.close()
+        os.replace(f"{self._filename}.tmp", self._filename)
+        self.files.append(self._filename)
+        self._file = None
+
+
+def read_actions(filename):
+    """Read the actions of a bulk file
+
+    Args:
+        filename (str): The bulk file
+
+    Yields:
+        PreparedAction: The lines of each action, without a command
+    """
+    with gzip.open(filename, 'rb') as bulk_file:
+        lines = (line.rstrip(b"\n") for line in bulk_file)
+        for line in lines:
+            if not line:
+                continue
+
+            action = [line]
+            # Every action but a delete is followed by its source
+            if next(iter(json.loads(line))) != 'delete':
+                action.append(next(lines))
+            yield PreparedAction(None, action)
+
+
+def list_bulk_files(path):
+    """Completed bulk files in a directory, sorted by name"""
+    return sorted(
+        name for name in os.listdir(path)
+        if name.endswith(BULK_FILE_SUFFIX)
+    )
+
+
+def clear_bulk_files(path):
+    """Remove the bulk files, partial or not, and manifest of a directory
+    """
+    for name in os.listdir(path):
+        if (name == MANIFEST_NAME or name.endswith(BULK_FILE_SUFFIX) or
+                name.endswith(f"{BULK_FILE_SUFFIX}.tmp")):
+            os.remove(os.path.join(path, name))
+
+
+def write_manifest(path, manifest):
+    """Write the manifest that marks the bulk files of a directory complete
+
+    Args:
+        path (str): Directory holding the bulk files
+        manifest (dict): Details of the ingest the files hold
+    """
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    # Written aside and moved so a replay never sees a partial manifest
+    with open(f"{manifest_path}.tmp", 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+
+def read_manifest(path):
+    """Read the manifest of a directory of bulk files
+
+    Args:
+        path (str): Directory holding the bulk files
+
+    Returns:
+        dict: The manifest, None if the directory has none
+    """
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+
+    with open(manifest_path, 'r') as manifest_file:
+        return json.load(manifest_file)
+
+
+class BulkReplayer:
+    """Loads bulk files into elasticsearch over parallel bulk streams
+
+    Every stream loads one file at a time through
+    IngestHandler.shipDocuments, so requests are bounded by both their
+    number of actions and their payload size. Write indices are rolled
+    over as they fill up, the same as while ingesting
+
+    Args:
+        es (IngestHandler): Handler of the cluster to load into
+        files (list): Paths of the bulk files to load
+        streams (int, optional): Number of files loaded at once.
+            Defaults to 4.
+        bulk_size (int, optional): Maximum number of actions per request.
+            Defaults to 1000.
+        bulk_bytes (int, optional): Target payload size in bytes of a
+            request. Defaults to 5MB.
+        max_inflight (int, optional): Requests in flight per stream.
+            Defaults to 1.
+        on_rollover (function, optional): Called after a write index was
+            rolled over. Defaults to None.
+        logger (Logger, optional): Defaults to None.
+    """
+
+    def __init__(
+        self,
+        es,
+        files,
+        streams=4,
+        bulk_size=1000,
+        bulk_bytes=5 * 1024 * 1024,
+        max_inflight=1,
+        on_rollover=None,
+        logger=None,
+    ):
+        self.es = es
+        self.files = files
+        self.streams = max(1, streams)
+        self.bulk_size = bulk_size
+        self.bulk_bytes = bulk_bytes
+        self.max_inflight = max_inflight
+        self.on_rollover = on_rollover
+        self.logger = logger or logging.getLogger(__name__)
+        # Documents in the data and delta write indices
+        self.created = [0, 0]
+        self.actions = 0
+        self.errors = []
+        self._lock = Lock()
+        self._stop = Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        """Load every file, stopping at the first error
+
+        Raises:
+            BulkShipError: If elasticsearch rejects an action or request
+
+        Returns:
+            int: The number of actions loaded
+        """
+        es = self.es
+        write_aliases = [es.indexNames.orig_write, es.indexNames.delta_write]
+        for (position, alias) in enumerate(write_aliases):
+            es.refreshIndex(alias)
+            self.created[position] = es.countDocuments(alias)
+
+        files = queue.Queue()
+        for filename in self.files:
+            files.put(filename)
+
+        threads = [
+            Thread(target=self._stream, args=(files,), daemon=True)
+            for _ in range(min(self.streams, len(self.files)))
+        ]
+        for thread in threads:
+            thread.start()
+
+        timer = time.time()
+        try:
+            running = threads
+            while len(running) > 0:
+                try:
+                    timer = es.rolloverTimer(timer, created=self.created)
+                except RolloverRequired as rollOver:
+                    timer = time.time()
+                    self._rollover(
+                        rollOver.write_alias, rollOver.search_alias)
+
+                # The created counts are checked for rollovers on an
+                # interval while waiting on the streams
+                running[0].join(es.ROLLOVER_COUNT_TIME)
+                running = [thread for thread in running if thread.is_alive()]
+        except KeyboardInterrupt:
+            self.stop()
+            raise
+        finally:
+            for thread in threads:
+                thread.join()
+
+        if len(self.errors) > 0:
+            raise self.errors[0]
+
+        return self.actions
+
+    def _rollover(self, write_alias, search_alias):
+        if not self.es.rolloverIndices(
+            write_alias=write_alias,
+            search_alias=search_alias
+        ):
+            return
+
+        with self._lock:
+            self.created[
+                int(write_alias == self.es.indexNames.delta_write)] = 0
+        if self.on_rollover is not None:
+            self.on_rollover()
+
+    def _stream(self, files):
+        delta_prefix = f"{self.es.indexNames.prefix}-data-delta-"
+        controller = AdaptiveBatchSize(
+            self.bulk_size, should_stop=self._stop.is_set)
+
+        def confirm(ok, response):
+            (op_type, result) = next(iter(response.items()))
+            if (ok and op_type in ['create', 'index'] and
+                    result.get('status') == 201):
+                with self._lock:
+                    self.created[
+                        int(result['_index'].startswith(delta_prefix))] += 1
+
+        def actions(filename, count):
+            for action in read_actions(filename):
+                if self._stop.is_set():
+                    break
+                count[0] += 1
+                yield action
+
+        while not self._stop.is_set():
+            try:
+                filename = files.get_nowait()
+            except queue.Empty:
+                return
+
+            count = [0]
+            try:
+                self.es.shipDocuments(
+                    actions(filename, count), self.bulk_size,
+                    bulk_bytes=self.bulk_bytes, callback=confirm,
+                    controller=controller, max_inflight=self.max_inflight)
+            except Exception as e:
+                if not self._stop.is_set():
+                    self.logger.error(f"Unable to load {filename}: {e}")
+                    with self._lock:
+                        self.errors.append(e)
+                self._stop.set()
+                return
+
+            with self._lock:
+                self.actions += count[0]
+            self.logger.debug(f"Loaded {count[0]} actions from {filename}")
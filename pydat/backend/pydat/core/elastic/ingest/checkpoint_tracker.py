@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+
+import os
+import json
+import time
+import logging
+from threading import Thread, Lock
+from multiprocessing import Queue as mpQueue
+import queue
+
+
+def checkpoint_key(file_range):
+    """Generate the key a work unit's progress is stored under
+
+    Args:
+        file_range (FileRange): The unit of work
+
+    Returns:
+        str: Key identifying the file range across runs
+    """
+    path = os.path.abspath(file_range.path)
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        size = -1
+    end = file_range.end if file_range.end is not None else ''
+    return f"{path}|{size}|{file_range.start}|{end}"
+
+
+class _BatchMarker:
+    """Marks the position in a work unit that a batch of rows ends at
+
+    The marker travels with the batch through the pipeline and is
+    acknowledged once every command generated from the batch has been
+    confirmed by elasticsearch
+    """
+
+    __slots__ = ['tracker', 'key', 'seq', 'offset']
+
+    def __init__(self, tracker, key, seq, offset):
+        self.tracker = tracker
+        self.key = key
+        self.seq = seq
+        self.offset = offset
+
+    def ack(self):
+        self.tracker._ack(self)
+
+    def poison(self):
+        """Indicate rows of the batch were dropped
+
+        The unit's committed offset no longer advances past the batch, so
+        it is read again when the run is resumed
+        """
+        self.tracker._poison(self)
+
+
+class _CheckpointTracker:
+    """Per-pipeline client of the CheckpointTracker
+
+    Batches can be confirmed out of order (multiple shippers), so the
+    committed offset of a unit only advances over a contiguous run of
+    confirmed batches
+    """
+    MAX_CHUNK_SIZE = 100
+
+    def __init__(self, queue):
+        self._queue = queue
+        self._lock = Lock()
+        self._units = dict()
+        self._chunk = []
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if len(self._chunk) > 0:
+            self._queue.put(self._chunk)
+            self._chunk = []
+
+    def _update(self, key, offset, done):
+        self._chunk.append((key, offset, done))
+        if done or len(self._chunk) >= self.MAX_CHUNK_SIZE:
+            self._flush()
+
+    def begin(self, file_range):
+        """Start tracking a work unit
+
+        Args:
+            file_range (FileRange): The unit that is about to be read
+
+        Returns:
+            str: The key of the unit, used for marking batches
+        """
+        key = checkpoint_key(file_range)
+        with self._lock:
+            self._units[key] = {
+                'next_seq': 0,
+                'acked': 0,
+                'pending': dict(),
+                'final_seq': None,
+                'poisoned': False,
+            }
+        return key
+
+    def mark(self, key, offset):
+        """Create a marker for the next batch read from a unit
+
+        Args:
+            key (str): Key returned by begin
+            offset (int): Offset in the unit just past the batch's last
+                row, or None if it is unknown
+
+        Returns:
+            _BatchMarker: marker to be acknowledged when the batch is shipped
+        """
+        with self._lock:
+            unit = self._units[key]
+            seq = unit['next_seq']
+            unit['next_seq'] += 1
+        return _BatchMarker(self, key, seq, offset)
+
+    def complete(self, key):
+        """Indicate all batches of a unit have been read
+        """
+        with self._lock:
+            unit = self._units[key]
+            unit['final_seq'] = unit['next_seq']
+            self._check_done(key, unit)
+
+    def _check_done(self, key, unit):
+        if unit['poisoned']:
+            return
+        if (unit['final_seq'] is not None and
+                unit['acked'] >= unit['final_seq']):
+            self._update(key, None, True)
+            del self._units[key]
+
+    def _ack(self, marker):
+        with self._lock:
+            unit = self._units.get(marker.key)
+            if unit is None:
+                return
+            unit['pending'][marker.seq] = marker.offset
+
+            offset = None
+            while unit['acked'] in unit['pending']:
+                offset = unit['pending'].pop(unit['acked'])
+                unit['acked'] += 1
+
+            if offset is not None:
+                self._update(marker.key, offset, False)
+            self._check_done(marker.key, unit)
+
+    def _poison(self, marker):
+        with self._lock:
+            unit = self._units.get(marker.key)
+            if unit is None:
+                return
+            # The batch is never acked, so acks stop at its seq
+            unit['poisoned'] = True
+
+
+class CheckpointTracker(Thread):
+    """Multi-processing safe tracker of committed ingest progress
+
+    Pipelines report how far into each work unit they have confirmed
+    data was written to elasticsearch. The progress is periodically saved
+    to a file in the state directory so an interrupted import can resume
+    where it left off instead of reprocessing every file
+    """
+    SAVE_INTERVAL = 5  # seconds
+    FILENAME = "checkpoint.json"
+
+    def __init__(self, state_dir, version, logger=None, **kwargs):
+        super().__init__(**kwargs)
+        self.daemon = True
+        self.path = os.path.join(state_dir, self.FILENAME)
+        self.version = version
+        self._units = dict()
+        self._queue = mpQueue()
+        self._shutdown = False
+        self._dirty = False
+        if logger is None:
+            self.logger = logging.getLogger(__name__)
+        else:
+            self.logger = logger
+
+        os.makedirs(state_dir, exist_ok=True)
+
+    def get_tracker(self):
+        return _CheckpointTracker(self._queue)
+
+    @property
+    def units(self):
+        return self._units
+
+    def load(self):
+        """Load saved progress for this tracker's version
+
+        Returns:
+            dict: Saved state of each unit keyed by checkpoint_key, empty
+                if there is no usable checkpoint
+        """
+        try:
+            with open(self.path, 'r') as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+        except FileNotFoundError:
+            return self._units
+        except Exception:
+            self.logger.warning(
+                f"Unable to read checkpoint file {self.path}, ignoring")
+            return self._units
+
+        if checkpoint.get('version') != self.version:
+            self.logger.warning((
+                "Checkpoint file is for version "
+                f"{checkpoint.get('version')}, ignoring"
+            ))
+            return self._units
+
+        self._units = checkpoint.get('units', dict())
+        return self._units
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as checkpoint_file:
+            json.dump(
+                {'version': self.version, 'units': self._units},
+                checkpoint_file
+            )
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+    def clear(self):
+        """Remove the checkpoint file, e.g., once an import completes
+        """
+        self._units = dict()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def shutdown(self):
+        self._shutdown = True
+
+    def run(self):
+        last_save = time.time()
+        while 1:
+            try:
+                chunk = self._queue.get(True, 0.2)
+            except queue.Empty:
+                if self._shutdown:
+                    break
+                chunk = []
+
+            for (key, offset, done) in chunk:
+                unit = self._units.setdefault(
+                    key, {'offset': None, 'done': False})
+                if done:
+                    unit['done'] = True
+                elif unit['offset'] is None or offset > unit['offset']:
+                    unit['offset'] = offset
+                self._dirty = True
+
+            if self._dirty and time.time() - last_save >= self.SAVE_INTERVAL:
+                self._save_safe()
+                last_save = time.time()
+
+        if self._dirty:
+            self._save_safe()
+        self._queue.close()
+
+    def _save_safe(self):
+        try:
+            self.save()
+        except Exception:
+            self.logger.exception("Unable to save checkpoint file")
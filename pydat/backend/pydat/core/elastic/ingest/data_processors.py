@@ -1,17 +1,48 @@
 #!/usr/bin/env python
 
+import io
 import os
 import re
 import csv
+import html
+import json
+import locale
 import time
+import zlib
 import hashlib
 import logging
-from threading import Thread
+from threading import Thread, Lock
 
-from html.parser import HTMLParser
-import queue
+from collections import deque
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.csv
+except ImportError:
+    pyarrow = None
 
 from pydat.core.elastic.ingest.debug_levels import DebugLevel
+from pydat.core.elastic.ingest.adaptive import (
+    AdaptiveBatchSize,
+    RetriesExhausted,
+)
+from pydat.core.elastic.ingest.bulk_encoder import (
+    PreparedAction,
+    prepare,
+)
+from pydat.core.elastic.ingest.seen_domains import (
+    NEW,
+    DUPLICATE,
+    MAYBE,
+)
+from pydat.core.elastic.ingest.file_reader import (
+    END_OF_STREAM,
+    FileRange,
+    LineReader,
+    RangeStream,
+    open_data_file,
+)
 from pydat.core.elastic.ingest.ingest_handler import (
     BulkFetchError,
     BulkShipError,
@@ -22,6 +53,36 @@ from pydat.core.elastic.ingest.ingest_handler import (
 # 'track_total_hits' required on search to get accurate total hits
 # routing less helpful in low shard-count setups
 
+READER_BACKENDS = ['csv', 'arrow']
+
+# Vectorized equivalent of DataReader.validate_row's label checks, one or
+# more valid labels followed by the tld
+DOMAIN_PATTERN = r"^(?:[A-Za-z0-9_-]{0,63}\.)+[^.]*$"
+
+# Size of the blocks handed to pyarrow's csv parser
+ARROW_BLOCK_SIZE = 1 << 22
+# Size of the blocks read from a file, each is parsed in parallel by pyarrow
+# in ARROW_BLOCK_SIZE chunks
+ARROW_READ_SIZE = 1 << 24
+
+
+class FetchError(Exception):
+    """The current records of entries could not be fetched"""
+    pass
+
+
+class IncompleteBatch(Exception):
+    """Rows of a batch were dropped because of an error
+
+    Args:
+        results (list): (entry, current entry) tuples of the rows that
+            could still be handled
+    """
+
+    def __init__(self, results):
+        super().__init__("Rows of the batch were dropped")
+        self.results = results
+
 
 def _generateDocId(domainName):
     try:
@@ -52,6 +113,8 @@ class DataReader(Thread):
         data_queue,
         eventTracker,
         process_options,
+        checkpoints=None,
+        telemetry=None,
         logger=None
     ):
         super().__init__()
@@ -62,40 +125,84 @@ class DataReader(Thread):
         else:
             self.logger = logging.getLogger(f'dataReader.{self.myid}')
 
+        self.checkpoints = checkpoints
+        self._checkpoint_key = None
+        self.telemetry = telemetry
+
         self.file_queue = file_queue
         self.data_queue = data_queue
         self.eventTracker = eventTracker
         self.verbose = process_options.verbose
         self.debug = process_options.debug
+        self.batch_size = process_options.batch_size
+        self.reader_backend = process_options.reader_backend
         self._shutdown = False
-        self._pause = False
         # This is a naive regex for domain name labels
         self.label_regex = re.compile("^([A-Za-z0-9_-]{0,63})$")
 
+        if self.reader_backend == 'arrow' and pyarrow is None:
+            self.logger.warning(
+                "pyarrow not installed, falling back to csv reader backend")
+            self.reader_backend = 'csv'
+
     def shutdown(self):
         self._shutdown = True
 
-    def pause(self):
-        self._pause = True
-
-    def unpause(self):
-        self._pause = False
-
     def run(self):
-        while not self._shutdown:
-            try:
-                datafile = self.file_queue.get(True, 0.2)
+        try:
+            while not self._shutdown:
+                datafile = self.file_queue.get()
+                if datafile is END_OF_STREAM:
+                    self.file_queue.task_done()
+                    self.logger.debug("End of the file queue seen")
+                    break
+
                 try:
-                    self.parse_csv(datafile)
+                    if isinstance(datafile, FileRange):
+                        self.parse_range(datafile)
+                    else:
+                        self.parse_csv(datafile)
+                except Exception:
+                    self.logger.exception("Unhandled Exception")
                 finally:
                     self.file_queue.task_done()
-            except queue.Empty:
-                if self.eventTracker.fileReaderDone:
-                    self.logger.debug("FileReaderDone Event seen")
-                    break
-            except Exception:
-                self.logger.exception("Unhandled Exception")
-        self.logger.debug("Reader exiting")
+        finally:
+            self.logger.debug("Reader exiting")
+            # The pipeline waits on the event tracker for the reader to exit
+            self.eventTracker.notify()
+
+    def parse_range(self, file_range):
+        start = file_range.start
+        if file_range.offset is not None:
+            start = file_range.offset
+
+        if self.checkpoints is None:
+            self.parse_csv(file_range.path, start, file_range.end)
+            return
+
+        self._checkpoint_key = self.checkpoints.begin(file_range)
+        try:
+            self.parse_csv(file_range.path, start, file_range.end)
+            if not self._shutdown:
+                self.checkpoints.complete(self._checkpoint_key)
+        finally:
+            self._checkpoint_key = None
+
+    def put_batch(self, header, rows, offset=None):
+        """Queue a batch of rows for the fetchers
+
+        Args:
+            header (list): The csv header
+            rows (list): The rows of the batch
+            offset (int, optional): Offset in the file just past the last
+                row, used for checkpointing. Defaults to None.
+        """
+        marker = None
+        if self._checkpoint_key is not None:
+            marker = self.checkpoints.mark(self._checkpoint_key, offset)
+        self.data_queue.put({'header': header, 'rows': rows, 'marker': marker})
+        if self.telemetry is not None:
+            self.telemetry.addRows('read', len(rows))
 
     def check_header(self, header):
         for field in header:
@@ -119,17 +226,12 @@ class DataReader(Thread):
                 f"Unable to iterate through csv file {filename}")
             return
 
+        rows = []
         try:
             if not self.check_header(header):
                 raise csv.Error('CSV header not found')
 
             for row in dnsreader:
-                while self._pause:
-                    if self._shutdown:
-                        if self.debug >= DebugLevel.VERBOSE:
-                            self.logger.debug("Shutdown received while paused")
-                        break
-                    time.sleep(.5)
                 if self._shutdown:
                     if self.debug >= DebugLevel.VERBOSE:
                         self.logger.debug("Shutdown received")
@@ -140,7 +242,11 @@ class DataReader(Thread):
                     )
                     continue
                 if self.validate_row(header, row):
-                    self.data_queue.put({'header': header, 'row': row})
+                    rows.append(row)
+                    if len(rows) >= self.batch_size:
+                        self.put_batch(
+                            header, rows, getattr(csvfile, 'offset', None))
+                        rows = []
         except csv.Error:
             self.logger.exception(
                 "CSV Parse Error in file %s - line %i\n" % (
@@ -150,8 +256,12 @@ class DataReader(Thread):
         except Exception:
             self.logger.exception(
                 f"Unable to process file {filename}")
+        finally:
+            if len(rows) > 0:
+                self.put_batch(
+                    header, rows, getattr(csvfile, 'offset', None))
 
-    def parse_csv(self, filename):
+    def parse_csv(self, filename, start=0, end=None):
         if self._shutdown:
             return
 
@@ -165,14 +275,217 @@ class DataReader(Thread):
             return
 
         try:
-            with open(filename, newline='') as csvfile:
+            with open_data_file(filename) as datafile:
                 if self.verbose:
-                    self.logger.info("Processing file: %s" % filename)
-                self._parse_csv(filename, csvfile)
+                    if start > 0 or end is not None:
+                        self.logger.info(
+                            f"Processing file: {filename} "
+                            f"(bytes {start}-{end if end is not None else ''})"
+                        )
+                    else:
+                        self.logger.info("Processing file: %s" % filename)
+                if self.reader_backend == 'arrow':
+                    self._parse_arrow(filename, io.BufferedReader(
+                        RangeStream(datafile, start, end)))
+                else:
+                    self._parse_csv(
+                        filename, LineReader(datafile, start, end))
         except FileNotFoundError:
             self.logger.warning(
                 f"File {filename} could not be found or opened")
             return
+        except (OSError, EOFError, RuntimeError):
+            self.logger.exception(
+                f"Unable to read or decompress file {filename}")
+            return
+
+    def _parse_arrow(self, filename, datafile):
+        """Parse a file in blocks with pyarrow's multithreaded csv reader
+
+        Rows are validated with vectorized compute kernels and only rows
+        that fail are passed through validate_row so the same errors are
+        logged as with the csv backend. Blocks pyarrow doesn't parse the
+        same way as the csv module are parsed again with it
+        """
+        encoding = locale.getpreferredencoding(False)
+        try:
+            header_line = datafile.readline()
+            header = next(csv.reader(
+                [header_line.decode(encoding)],
+                strict=True,
+                skipinitialspace=True
+            ))
+        except Exception:
+            self.logger.exception(
+                f"Unable to iterate through csv file {filename}")
+            return
+
+        if not self.check_header(header):
+            self.logger.error(
+                f"CSV Parse Error in file {os.path.basename(filename)} - "
+                "CSV header not found")
+            return
+
+        # Columns are named by position so duplicate header names
+        # can't collide and every column is kept as a string
+        column_names = [f"c{i}" for i in range(len(header))]
+        read_options = pyarrow.csv.ReadOptions(
+            use_threads=True,
+            block_size=ARROW_BLOCK_SIZE,
+            column_names=column_names,
+            encoding=encoding,
+        )
+        convert_options = pyarrow.csv.ConvertOptions(
+            column_types={name: pyarrow.string() for name in column_names},
+            strings_can_be_null=False,
+            quoted_strings_can_be_null=False,
+        )
+
+        try:
+            for block in self.read_arrow_blocks(datafile):
+                if self._shutdown:
+                    if self.debug >= DebugLevel.VERBOSE:
+                        self.logger.debug("Shutdown received")
+                    break
+
+                try:
+                    # Chunks are split on any newline, a value holding
+                    # one fails to parse and the csv module is used
+                    table = pyarrow.csv.read_csv(
+                        io.BytesIO(block),
+                        read_options=read_options,
+                        convert_options=convert_options,
+                    )
+                except pyarrow.ArrowInvalid:
+                    table = None
+
+                rows = None
+                if table is not None:
+                    rows = self.validate_arrow_batch(header, table)
+                if rows is None:
+                    rows = self.parse_csv_block(
+                        filename, header, block.decode(encoding))
+                    if rows is None:
+                        break
+
+                for index in range(0, len(rows), self.batch_size):
+                    # Arrow reads ahead so the exact offset of a row
+                    # isn't known, ranges can only be resumed from the start
+                    self.put_batch(
+                        header, rows[index:index + self.batch_size])
+        except Exception:
+            self.logger.exception(
+                f"Unable to process file {filename}")
+
+    def read_arrow_blocks(self, datafile):
+        """Read a file in blocks of whole rows
+
+        A block holding an odd number of quotes might end in a quoted
+        value that spans lines, so lines are added until it no longer does
+
+        Args:
+            datafile (file object): Binary stream positioned after the header
+
+        Yields:
+            bytes: A block of ARROW_READ_SIZE bytes or more
+        """
+        while True:
+            block = datafile.read(ARROW_READ_SIZE)
+            if not block:
+                return
+            block += datafile.readline()
+            quotes = block.count(b'"')
+            while quotes % 2 == 1:
+                line = datafile.readline()
+                if not line:
+                    break
+                block += line
+                quotes += line.count(b'"')
+            yield block
+
+    def parse_csv_block(self, filename, header, block):
+        """Parse a block of a file with the csv module
+
+        Used for blocks pyarrow can't parse the way the csv backend would
+
+        Args:
+            filename (str): Path of the file, for logging
+            header (list): The csv header
+            block (str): Decoded block of whole rows
+
+        Returns:
+            list: The valid rows, or None if the block is not valid csv
+        """
+        dnsreader = csv.reader(
+            io.StringIO(block), strict=True, skipinitialspace=True)
+        rows = []
+        try:
+            for row in dnsreader:
+                if not row:
+                    self.logger.warning(
+                        f"Skipping empty row in file {filename}"
+                    )
+                    continue
+                if self.validate_row(header, row):
+                    rows.append(row)
+        except csv.Error:
+            self.logger.exception(
+                "CSV Parse Error in file %s - line %i of block\n" % (
+                    os.path.basename(filename),
+                    dnsreader.line_num)
+            )
+            return None
+        return rows
+
+    def validate_arrow_batch(self, header, record_batch):
+        """Validate an arrow record batch and convert it to csv style rows
+
+        Args:
+            header (list): The csv header
+            record_batch (pyarrow.RecordBatch): Parsed block of the file
+
+        Returns:
+            list: The valid rows as lists of strings, or None if the block
+                has to be parsed with the csv module
+        """
+        if record_batch.num_rows == 0:
+            return []
+
+        compute = pyarrow.compute
+        # Emulate the csv module's skipinitialspace
+        columns = [
+            compute.utf8_ltrim(column, characters=' ')
+            for column in record_batch.columns
+        ]
+
+        # pyarrow only unquotes values that start with a quote, while the
+        # csv module skips the spaces before it first
+        for column in columns:
+            if compute.any(compute.starts_with(column, '"')).as_py():
+                return None
+
+        domains = columns[0]
+        lengths = compute.utf8_length(domains)
+        valid = compute.and_(
+            compute.and_(
+                compute.greater(lengths, 0),
+                compute.less_equal(lengths, 255)
+            ),
+            compute.match_substring_regex(domains, DOMAIN_PATTERN)
+        )
+
+        invalid_count = len(valid) - compute.sum(valid).as_py()
+        if invalid_count > 0:
+            # Re-validate rejected rows to log why they were rejected
+            invalid = compute.invert(valid)
+            rejected = [
+                column.filter(invalid).to_pylist() for column in columns]
+            for row in zip(*rejected):
+                self.validate_row(header, list(row))
+            columns = [column.filter(valid) for column in columns]
+
+        return [list(row) for row in zip(
+            *[column.to_pylist() for column in columns])]
 
     def validate_row(self, header, row):
         try:
@@ -218,6 +531,94 @@ class DataReader(Thread):
             return False
 
 
+class RowDecoder:
+    """Pre-compiled conversion of csv rows for a given header
+
+    The header of a file does not change between rows, so the decisions
+    about which columns to keep and where the domain name lives are made
+    once when the decoder is created instead of for every row
+    """
+
+    def __init__(self, header, ignore_field_prefixes=None):
+        self.header = header
+        self.domain_index = None
+        self.columns = []
+
+        prefixes = tuple(ignore_field_prefixes or ())
+        for (index, name) in enumerate(header):
+            if prefixes and name.startswith(prefixes):
+                continue
+            if name == 'domainName':
+                self.domain_index = index
+                continue
+            self.columns.append((index, name))
+
+    def decode(self, row):
+        """Convert a csv row into a domain name and details
+
+        Args:
+            row (list): A csv row matching the decoder's header
+
+        Returns:
+            tuple: The domain name and a dict of the remaining fields
+        """
+        details = {}
+        for (index, name) in self.columns:
+            item = row[index]
+            if item == "":
+                details[name] = None
+            elif '&' in item:
+                details[name] = html.unescape(item)
+            else:
+                details[name] = item
+
+        if self.domain_index is not None:
+            domainName = row[self.domain_index]
+        else:
+            domainName = ''
+
+        return (domainName, details)
+
+
+class DetailsHasher:
+    """Stable fingerprint of the details compared between versions
+
+    Only the fields that are compared when looking for changes, per the
+    include/exclude settings, are hashed. The settings themselves are part
+    of the fingerprint so changing them invalidates stored fingerprints
+    """
+
+    def __init__(self, include_fields=None, exclude_fields=None):
+        self.include_fields = include_fields
+        self.exclude_fields = (
+            set(exclude_fields) if exclude_fields is not None else None)
+        spec = json.dumps({
+            'include': include_fields,
+            'exclude': exclude_fields,
+        }, sort_keys=True)
+        self._prefix = hashlib.sha1(spec.encode('utf-8')).hexdigest()[:8]
+
+    def __call__(self, details):
+        if self.exclude_fields is not None:
+            details = {
+                key: value for (key, value) in details.items()
+                if key not in self.exclude_fields
+            }
+        elif self.include_fields is not None:
+            details = {
+                key: details[key] for key in self.include_fields
+                if key in details
+            }
+
+        payload = json.dumps(
+            details, sort_keys=True, separators=(',', ':'),
+            ensure_ascii=False)
+        digest = hashlib.blake2b(
+            payload.encode('utf-8', 'surrogatepass'), digest_size=16
+        ).hexdigest()
+        return f"{self._prefix}:{digest}"
+
+
 class DataFetcher(Thread):
     """Bulk Fetching of Records
 
@@ -226,6 +627,9 @@ class DataFetcher(Thread):
     the source to be sent to the worker
     """
 
+    # Rounds of failed or missing documents retried before giving up
+    FETCH_RETRIES = 3
+
     def __init__(
         self,
         pipelineid,
@@ -237,6 +641,11 @@ class DataFetcher(Thread):
         index_list,
         skip_fetch,
         process_options,
+        statTracker=None,
+        seen_domains=None,
+        index_filters=None,
+        state_store=None,
+        telemetry=None,
         logger=None
     ):
         super().__init__()
@@ -254,7 +663,16 @@ class DataFetcher(Thread):
         self.fetcher_threads = []
         self.eventTracker = eventTracker
         self.bulk_fetch_size = process_options.bulk_fetch_size
+        # Shrinks the fetch size when the cluster rejects requests
+        self.fetch_size = AdaptiveBatchSize(
+            self.bulk_fetch_size, should_stop=lambda: self._shutdown)
         self.skip_fetch = skip_fetch
+        self.statTracker = statTracker
+        self.telemetry = telemetry
+        self.seen_domains = seen_domains
+        self.index_filters = index_filters
+        self.state_store = state_store
+        self.reingest = process_options.reingest
         self.ignore_field_prefixes = process_options.ignore_field_prefixes
         self.verbose = process_options.verbose
         self.debug = process_options.debug
@@ -262,53 +680,62 @@ class DataFetcher(Thread):
         self.ingest_day = process_options.ingest_day
         self.ingest_now = process_options.ingest_now
         self.index_list = index_list
+        self.hasher = DetailsHasher(
+            process_options.include_fields, process_options.exclude_fields)
+        # Fields needed to tell whether a record changed, the full source
+        # is only fetched when the fingerprint differs
+        self.fetch_fields = [
+            self.es.metadata_key_map.VERSION_KEY,
+            self.es.metadata_key_map.FIRST_SEEN,
+            self.es.metadata_key_map.DATE_FIRST_SEEN,
+            self.es.metadata_key_map.DATE_CREATED,
+            self.es.metadata_key_map.DETAILS_HASH,
+        ]
+        self._decoder = None
         self._shutdown = False
-        self._finish = False
 
     def shutdown(self):
         self._shutdown = True
 
     def finish(self):
-        self._finish = True
+        """Exit once the batches queued so far are handled"""
+        self.data_queue.put(END_OF_STREAM)
+
+    def get_decoder(self, header):
+        """Return the row decoder for a header, compiling it if needed
+        """
+        if (self._decoder is None or (
+                self._decoder.header is not header and
+                self._decoder.header != header)):
+            self._decoder = RowDecoder(header, self.ignore_field_prefixes)
+        return self._decoder
 
     def run(self):
         try:
-            fetch = list()
             while not self._shutdown:
-                try:
-                    work = self.data_queue.get_nowait()
-                except queue.Empty:
-                    if self._finish:
-                        if len(fetch) > 0:
-                            data = self.handle_fetch(fetch)
-                            for item in data:
-                                self.work_queue.put(item)
-                        break
-                    time.sleep(.01)
-                    continue
-                except Exception:
-                    self.logger.exception("Unhandled Exception")
-                    continue
+                work = self.data_queue.get()
+                if work is END_OF_STREAM:
+                    self.data_queue.task_done()
+                    break
 
                 try:
-                    entry = self.parse_entry(work['row'], work['header'])
-                    if entry is None:
-                        self.logger.warning("Malformed Entry")
-                        continue
-
-                    # Pre-empt all of this processing when not necessary
-                    if (self.skip_fetch):
-                        self.work_queue.put((entry, None))
-                        continue
-
-                    doc_id = _generateDocId(entry['domainName'])
-                    fetch.append((doc_id, entry))
-
-                    if len(fetch) >= self.bulk_fetch_size:
-                        data = self.handle_fetch(fetch)
-                        for item in data:
-                            self.work_queue.put(item)
-                        fetch = list()
+                    marker = work.get('marker')
+                    try:
+                        batch = self.handle_batch(
+                            work['header'], work['rows'])
+                    except IncompleteBatch as e:
+                        # The rows that were handled are still passed on,
+                        # but the range must be read again on resume
+                        self.logger.error(
+                            "Rows dropped, the batch is not checkpointed")
+                        batch = e.results
+                        if marker is not None:
+                            marker.poison()
+                            marker = None
+                    if len(batch) > 0:
+                        self.work_queue.put((marker, batch))
+                    elif marker is not None:
+                        marker.ack()
                 except Exception:
                     self.logger.exception("Unhandled Exception")
                 finally:
@@ -317,27 +744,99 @@ class DataFetcher(Thread):
         except Exception:
             self.logger.exception("Unhandled Exception")
 
+    def update_index_list(self, index_list):
+        """Switch to a new list of indices to fetch from
+
+        Used after a rollover, once records can be in a different index
+        than the ones created before it, so fetching is no longer skipped
+        """
+        self.index_list = index_list
+        self.skip_fetch = False
+
+    def handle_batch(self, header, rows):
+        """Parse a batch of csv rows and fetch their current records
+
+        Args:
+            header (list): The csv header of the file the rows came from
+            rows (list): The csv rows to process
+
+        Returns:
+            list: (entry, current entry) tuples for the worker
+
+        Raises:
+            IncompleteBatch: If rows were dropped because of an error
+        """
+        results = list()
+        fetch = list()
+        complete = True
+        for row in rows:
+            try:
+                entry = self.parse_entry(row, header)
+                if entry is None:
+                    self.logger.warning("Malformed Entry")
+                    continue
+
+                doc_id = _generateDocId(entry['domainName'])
+
+                seen = NEW
+                if self.seen_domains is not None:
+                    seen = self.seen_domains.check(doc_id)
+                    if seen == DUPLICATE:
+                        self.handle_duplicate(entry)
+                        continue
+
+                # Pre-empt all of this processing when not necessary,
+                # possible duplicates are still checked against es
+                if (self.skip_fetch and seen != MAYBE):
+                    results.append((entry, None))
+                    continue
+
+                fetch.append((doc_id, entry))
+
+                if len(fetch) >= self.fetch_size.size:
+                    (pending, fetch) = (fetch, list())
+                    results.extend(self.handle_fetch(pending))
+            except FetchError:
+                complete = False
+            except Exception:
+                self.logger.exception("Unhandled Exception")
+                complete = False
+
+        if len(fetch) > 0:
+            try:
+                results.extend(self.handle_fetch(fetch))
+            except FetchError:
+                complete = False
+
+        if self.telemetry is not None:
+            self.telemetry.addRows('fetch', len(rows))
+
+        if not complete:
+            raise IncompleteBatch(results)
+        return results
+
+    def handle_duplicate(self, entry):
+        """Account for a domain this pipeline has already handled this run
+
+        The entry is dropped without being fetched, matching how the
+        worker treats a domain that already has the current version
+        """
+        if self.debug >= DebugLevel.VERBOSE:
+            self.logger.debug('%s: Duplicate' % entry['domainName'])
+
+        if self.reingest or self.statTracker is None:
+            return
+
+        self.statTracker.incr('total')
+        self.statTracker.incr('duplicates')
+
     def parse_entry(self, input_entry, header):
         if len(input_entry) == 0:
             return None
 
-        htmlparser = HTMLParser()
-
-        details = {}
-        domainName = ''
-        for (i, item) in enumerate(input_entry):
-            if any(header[i].startswith(s)
-                    for s in self.ignore_field_prefixes):
-                continue
-            if header[i] == 'domainName':
-                if self.debug >= DebugLevel.NOISY:
-                    self.logger.debug("Processing domain: %s" % item)
-                domainName = item
-                continue
-            if item == "":
-                details[header[i]] = None
-            else:
-                details[header[i]] = htmlparser.unescape(item)
+        (domainName, details) = self.get_decoder(header).decode(input_entry)
+        if self.debug >= DebugLevel.NOISY:
+            self.logger.debug("Processing domain: %s" % domainName)
 
         entry = {
             self.es.metadata_key_map.VERSION_KEY: self.version,
@@ -347,6 +846,7 @@ class DataFetcher(Thread):
             self.es.metadata_key_map.DATE_CREATED: self.ingest_now,
             self.es.metadata_key_map.DATE_UPDATED: self.ingest_now,
             self.es.metadata_key_map.HISTORICAL: False,
+            self.es.metadata_key_map.DETAILS_HASH: self.hasher(details),
             'tld': parse_domain(domainName)[1],
             'details': details,
             'domainName': domainName}
@@ -354,53 +854,300 @@ class DataFetcher(Thread):
         return entry
 
     def handle_fetch(self, fetch_list):
+        """Find the current records of entries
+
+        Args:
+            fetch_list (list): (doc_id, entry) tuples
+
+        Returns:
+            list: (entry, current entry) tuples
+
+        Raises:
+            FetchError: If the records could not be fetched
+        """
+        if self.state_store is not None:
+            return self.fetch_sources(self.lookup_state(fetch_list))
+
         results = list()
         try:
             docs = list()
+            targets = list()
             for (doc_id, entry) in fetch_list:
-                for index_name in self.index_list:
+                index_list = self.index_list
+                if self.index_filters is not None:
+                    index_list = self.index_filters.candidates(
+                        index_list, doc_id)
+                targets.append(len(index_list))
+                for index_name in index_list:
                     getdoc = {
                         '_index': index_name,
                         '_id': doc_id,
+                        '_source': self.fetch_fields,
                     }
                     docs.append(getdoc)
         except Exception:
             self.logger.exception("Unable to generate doc list")
-            return results
+            raise FetchError("Unable to generate doc list")
 
-        fetched = None
-        try:
-            fetched = self.es.fetchDocuments(docs)
-        except BulkFetchError as e:
-            self.logger.error(f"Unable to bulk fetch documents: {str(e)}")
-            self.eventTracker.setShipError()
-        except Exception:
-            self.logger.exception("Unhandled exception bulk fetching docs")
-            self.eventTracker.setShipError()
+        if len(docs) == 0:
+            # No index can hold any of the documents
+            return [(entry, None) for (_, entry) in fetch_list]
 
-        if fetched is None:
-            self.logger.error("Unable to bulk fetch documents")
-            return results
+        fetched = self._fetch(docs)
 
         try:
-            for (doc_count, index) in enumerate(
-                    range(0, len(fetched), len(self.index_list))):
+            position = 0
+            for (count, (doc_id, entry)) in zip(targets, fetch_list):
                 found = None
-                doc_results = fetched[index:index + len(self.index_list)]
+                doc_results = fetched[position:position + count]
+                position += count
 
                 for res in doc_results:
                     if res['found']:
                         found = res
                         break
 
-                if found is not None:
-                    results.append((fetch_list[doc_count][1], found))
-                else:
-                    results.append((fetch_list[doc_count][1], None))
-
-            return results
+                results.append((entry, found))
         except Exception:
             self.logger.exception("Unhandled Exception")
+            raise FetchError("Unable to match fetched documents")
+
+        return self.fetch_sources(results)
+
+    def lookup_state(self, fetch_list):
+        """Find the current records of entries in the local state store
+
+        Args:
+            fetch_list (list): (doc_id, entry) tuples
+
+        Returns:
+            list: (entry, found record) tuples, shaped like an mget result
+                limited to the fields in fetch_fields
+        """
+        keys = self.es.metadata_key_map
+        records = self.state_store.lookup(
+            [doc_id for (doc_id, _) in fetch_list])
+
+        results = list()
+        for (doc_id, entry) in fetch_list:
+            record = records.get(doc_id)
+            if record is None:
+                results.append((entry, None))
+                continue
+
+            (_id, version, index, first_seen, date_first_seen, date_created,
+             details_hash) = record
+            results.append((entry, {
+                '_index': index,
+                '_id': _id,
+                'found': True,
+                '_source': {
+                    keys.VERSION_KEY: version,
+                    keys.FIRST_SEEN: first_seen,
+                    keys.DATE_FIRST_SEEN: date_first_seen,
+                    keys.DATE_CREATED: date_created,
+                    keys.DETAILS_HASH: details_hash,
+                }
+            }))
+
+        return results
+
+    def _fetch(self, docs):
+        """Fetch documents, backing off and retrying when rejected
+
+        Documents the cluster returns an error for, or leaves out of its
+        response, are retried up to FETCH_RETRIES times
+
+        Returns:
+            list: The mget result of every document
+
+        Raises:
+            FetchError: If the documents could not be fetched
+        """
+        fetched = [None] * len(docs)
+        pending = list(range(len(docs)))
+        retries = 0
+        try:
+            while len(pending) > 0:
+                # Sizes are in entries, each of which can span indices
+                limit = self.fetch_size.size * max(1, len(self.index_list))
+                positions = pending[:limit]
+                chunk = [docs[position] for position in positions]
+                start = time.perf_counter()
+                try:
+                    response = self.es.fetchDocuments(chunk)
+                    self.fetch_size.succeeded()
+                    if self.telemetry is not None:
+                        self.telemetry.observe(
+                            'mget', time.perf_counter() - start)
+                except BulkFetchError as e:
+                    if self.telemetry is not None:
+                        self.telemetry.addRejected('mget', len(chunk))
+                    self.fetch_size.rejected(
+                        len(chunk) // max(1, len(self.index_list)))
+                    delay = self.fetch_size.backoff()
+                    self.logger.warning((
+                        f"{str(e)}, retried after {delay:.1f}s with size "
+                        f"{self.fetch_size.size}"
+                    ))
+                    continue
+
+                failed = list()
+                for (offset, position) in enumerate(positions):
+                    res = None
+                    if offset < len(response):
+                        res = response[offset]
+                    if (res is not None and res.get('error', {}).get(
+                            'type') == 'index_not_found_exception'):
+                        # Indices are fetched from before a rollover
+                        # creates them
+                        res = dict(res, found=False)
+                    # Failed items hold an error instead of 'found'
+                    if res is None or 'found' not in res:
+                        failed.append(position)
+                    else:
+                        fetched[position] = res
+                pending = failed + pending[len(positions):]
+
+                if len(failed) > 0:
+                    retries += 1
+                    if retries > self.FETCH_RETRIES:
+                        raise FetchError((
+                            f"{len(failed)} documents could not be fetched "
+                            f"after {self.FETCH_RETRIES} retries"
+                        ))
+                    delay = self.fetch_size.backoff()
+                    self.logger.warning((
+                        f"{len(failed)} documents could not be fetched, "
+                        f"retried after {delay:.1f}s"
+                    ))
+        except FetchError as e:
+            self.logger.error(str(e))
+            raise
+        except RetriesExhausted:
+            self.logger.warning("Shutdown while retrying fetch")
+            raise FetchError("Shutdown while retrying fetch")
+        except Exception:
+            self.logger.exception("Unhandled exception bulk fetching docs")
+            self.eventTracker.setShipError()
+            self.logger.error("Unable to bulk fetch documents")
+            raise FetchError("Unable to bulk fetch documents")
+
+        return fetched
+
+    def fetch_sources(self, results):
+        """Fetch the full source of records that may have changed
+
+        Records are first fetched with only the fields in fetch_fields,
+        the full source is only needed when a record does not already have
+        the current version and its details fingerprint differs
+
+        Args:
+            results (list): (entry, found record) tuples from handle_fetch
+
+        Returns:
+            list: The results with the full source of changed records
+
+        Raises:
+            FetchError: If the sources could not be fetched
+        """
+        version_key = self.es.metadata_key_map.VERSION_KEY
+        hash_key = self.es.metadata_key_map.DETAILS_HASH
+
+        required = list()
+        for (position, (entry, found)) in enumerate(results):
+            if found is None:
+                continue
+            source = found['_source']
+            if (source.get(version_key) == self.version or
+                    source.get(hash_key) == entry[hash_key]):
+                continue
+            required.append(position)
+
+        if len(required) == 0:
+            return results
+
+        fetched = self._fetch([
+            {
+                '_index': results[position][1]['_index'],
+                '_id': results[position][1]['_id'],
+            }
+            for position in required
+        ])
+
+        for (position, res) in zip(required, fetched):
+            if res['found']:
+                results[position] = (results[position][0], res)
+            else:
+                # Deleted since it was first fetched
+                results[position] = (results[position][0], None)
+
+        return results
+
+
+class _SplitMarker:
+    """Marker of a batch split between workers
+
+    The marker of the whole batch is acknowledged once every part is
+    """
+
+    __slots__ = ['marker', 'remaining', 'lock']
+
+    def __init__(self, marker, parts):
+        self.marker = marker
+        self.remaining = parts
+        self.lock = Lock()
+
+    def ack(self):
+        with self.lock:
+            self.remaining -= 1
+            done = self.remaining == 0
+        if done:
+            self.marker.ack()
+
+
+class WorkRouter:
+    """Routes the batches of the fetchers to the queues of the workers
+
+    Entries are routed by a hash of their document id, so a domain always
+    lands on the same worker and its entries are diffed in the order they
+    were fetched. Used in place of the work queue by the fetchers
+
+    Args:
+        work_queues (list): Work queue of each worker
+    """
+
+    def __init__(self, work_queues):
+        self.work_queues = work_queues
+
+    def route(self, entry):
+        """The position of the worker an entry is routed to"""
+        if entry is None:
+            return 0
+        doc_id = _generateDocId(entry['domainName'])
+        return zlib.crc32(doc_id.encode('utf-8')) % len(self.work_queues)
+
+    def put(self, item):
+        (marker, batch) = item
+        if len(self.work_queues) == 1:
+            self.work_queues[0].put(item)
+            return
+
+        parts = [list() for _ in self.work_queues]
+        for pair in batch:
+            parts[self.route(pair[0])].append(pair)
+
+        routed = [
+            (position, part) for (position, part) in enumerate(parts)
+            if len(part) > 0
+        ]
+        if marker is not None and len(routed) > 1:
+            marker = _SplitMarker(marker, len(routed))
+        for (position, part) in routed:
+            self.work_queues[position].put((marker, part))
+
+    def qsize(self):
+        return sum(work_queue.qsize() for work_queue in self.work_queues)
 
 
 class DataWorker(Thread):
@@ -420,10 +1167,12 @@ class DataWorker(Thread):
         eventTracker,
         es,
         process_options,
+        telemetry=None,
+        workerid=0,
         logger=None,
     ):
         super().__init__()
-        self.myid = pipelineid
+        self.myid = f"{pipelineid}.{workerid}"
 
         if logger is not None:
             self.logger = logger
@@ -435,14 +1184,15 @@ class DataWorker(Thread):
         self.insert_queue = insert_queue
         self.statTracker = statTracker
         self.eventTracker = eventTracker
+        self.telemetry = telemetry
         self._shutdown = False
-        self._finish = False
         self.version = process_options.version
         self.reingest = process_options.reingest
         self.include_fields = process_options.include_fields
         self.exclude_fields = process_options.exclude_fields
         self.ingest_day = process_options.ingest_day
         self.ingest_now = process_options.ingest_now
+        self.pre_encode = process_options.pre_encode
         self.verbose = process_options.verbose
         self.debug = process_options.debug
 
@@ -450,36 +1200,75 @@ class DataWorker(Thread):
         self._shutdown = True
 
     def finish(self):
-        self._finish = True
+        """Exit once the batches queued so far are handled"""
+        self.work_queue.put(END_OF_STREAM)
 
     def run(self):
         try:
             while not self._shutdown:
-                try:
-                    (entry, current_entry_raw) = self.work_queue.get_nowait()
-                except queue.Empty:
-                    if self._finish:
-                        break
-                    time.sleep(.0001)
-                    continue
-                except Exception:
-                    self.logger.exception("Unhandled Exception")
+                work = self.work_queue.get()
+                if work is END_OF_STREAM:
+                    self.work_queue.task_done()
+                    break
 
+                (marker, batch) = work
                 try:
-                    if entry is None:
-                        self.logger.warning("Malformed Entry")
-                        continue
-
-                    if (not self.reingest or
-                            self.update_required(current_entry_raw)):
-                        self.statTracker.incr('total')
-                        self.process_entry(entry, current_entry_raw)
+                    commands = self.handle_batch(batch)
+                    if self.telemetry is not None:
+                        self.telemetry.addRows('work', len(batch))
+                    if self.pre_encode and len(commands) > 0:
+                        commands = self.encode_batch(commands)
+                    if len(commands) > 0:
+                        self.insert_queue.put((marker, commands))
+                    elif marker is not None:
+                        marker.ack()
                 finally:
                     self.work_queue.task_done()
 
         except Exception:
             self.logger.exception("Unhandled Exception")
 
+    def handle_batch(self, batch):
+        """Generate the elasticsearch commands for a batch of entries
+
+        Args:
+            batch (list): (entry, current entry) tuples from the fetcher
+
+        Returns:
+            list: Commands to be sent by the shipper
+        """
+        api_commands = []
+        for (entry, current_entry_raw) in batch:
+            try:
+                if entry is None:
+                    self.logger.warning("Malformed Entry")
+                    continue
+
+                if (not self.reingest or
+                        self.update_required(current_entry_raw)):
+                    self.statTracker.incr('total')
+                    api_commands.extend(
+                        self.process_entry(entry, current_entry_raw))
+            except Exception:
+                self.logger.exception("Unhandled Exception")
+
+        return api_commands
+
+    def encode_batch(self, commands):
+        """Encode a batch of commands so the shipper can send them as is
+
+        Args:
+            commands (list): Commands generated by handle_batch
+
+        Returns:
+            list: PreparedAction instances, in the same order
+        """
+        start = time.perf_counter()
+        prepared = [prepare(command) for command in commands]
+        self.statTracker.addTime(
+            'worker_serialize', time.perf_counter() - start)
+        return prepared
+
     def update_required(self, current_entry):
         if current_entry is None:
             return True
@@ -508,7 +1297,14 @@ class DataWorker(Thread):
             self.statTracker.incr('duplicates')
             return api_commands
 
-        if self.exclude_fields is not None:
+        hash_key = self.es.metadata_key_map.DETAILS_HASH
+        if (entry.get(hash_key) is not None and
+                current_entry.get(hash_key) == entry[hash_key]):
+            # The compared details are identical, the fetcher only
+            # retrieved the fingerprint
+            changed = set()
+
+        elif self.exclude_fields is not None:
             details_copy = details.copy()
             for exclude in self.exclude_fields:
                 del details_copy[exclude]
@@ -585,6 +1381,8 @@ class DataWorker(Thread):
                 'details': details
                 }
             }
+            if entry.get(hash_key) is not None:
+                doc_diff['doc'][hash_key] = entry[hash_key]
             api_commands.append(
                 self.process_command(
                     'update',
@@ -619,8 +1417,7 @@ class DataWorker(Thread):
         else:
             api_commands.extend(self._process_new(entry))
 
-        for command in api_commands:
-            self.insert_queue.put(command)
+        return api_commands
 
     def process_command(self, request, index, _id, entry=None):
         if request == 'create':
@@ -672,6 +1469,11 @@ class DataShipper(Thread):
         insert_queue,
         eventTracker,
         process_options,
+        statTracker=None,
+        index_filters=None,
+        state_store=None,
+        telemetry=None,
+        bulk_writer=None,
         logger=None
     ):
         super().__init__()
@@ -684,42 +1486,230 @@ class DataShipper(Thread):
 
         self.insert_queue = insert_queue
         self.bulk_ship_size = process_options.bulk_ship_size
+        self.bulk_ship_bytes = process_options.bulk_ship_bytes
+        self.bulk_ship_inflight = process_options.bulk_ship_inflight
+        self.index_filters = index_filters
+        self.state_store = state_store
         self.eventTracker = eventTracker
+        self.statTracker = statTracker
+        self.telemetry = telemetry
+        # When set, commands are written to bulk files instead of being
+        # sent to the cluster
+        self.bulk_writer = bulk_writer
         self.es = es
-        self._finish = False
         self._shutdown = False
 
     def finish(self):
-        self._finish = True
+        """Exit once the batches queued so far are shipped"""
+        self.insert_queue.put(END_OF_STREAM)
 
     def shutdown(self):
         self._shutdown = True
 
+    def batches(self):
+        """Take encoded batches off the insert queue until finished
+
+        Yields:
+            tuple: (marker, batch) where batch holds PreparedAction
+                instances
+        """
+        while not self._shutdown:
+            work = self.insert_queue.get()
+            if work is END_OF_STREAM:
+                self.insert_queue.task_done()
+                break
+
+            (marker, batch) = work
+            try:
+                yield (marker, self.encode_batch(batch))
+            finally:
+                self.insert_queue.task_done()
+
     def run(self):
-        def bulk_iter():
-            while not (self._finish and self.insert_queue.empty()):
-                if self._shutdown:
-                    break
+        if self.bulk_writer is not None:
+            self.emit()
+            return
 
-                try:
-                    req = self.insert_queue.get_nowait()
-                except queue.Empty:
-                    time.sleep(.1)
-                    continue
+        # Batches whose commands have been handed to the bulk helper but
+        # not all confirmed, as [marker, unconfirmed command count, batch]
+        unconfirmed = deque()
+        # Confirmed changes not yet written to the state store
+        changes = {'records': [], 'updates': [], 'placeholders': []}
+        # Documents created in the data and delta write indices, added to
+        # the shared counts used to decide when to roll over
+        created = [0, 0]
 
-                try:
+        def bulk_iter():
+            for (marker, batch) in self.batches():
+                unconfirmed.append([marker, len(batch), batch])
+                for req in batch:
                     yield req
-                finally:
-                    self.insert_queue.task_done()
+
+        def confirm(ok, response):
+            (op_type, result) = next(iter(response.items()))
+            if (ok and op_type in ['create', 'index'] and
+                    result.get('status') == 201):
+                created[int(self.is_delta(result['_index']))] += 1
+
+            if self.index_filters is not None and 'create' in response:
+                # A conflict also means the document is in the index
+                result = response['create']
+                if ok or result.get('status') == 409:
+                    self.index_filters.add(result['_index'], result['_id'])
+
+            # Results are returned in the same order commands were sent
+            (marker, remaining, batch) = unconfirmed[0]
+            if self.state_store is not None:
+                self.state_change(
+                    batch[len(batch) - remaining].command, ok, response,
+                    changes)
+
+            unconfirmed[0][1] -= 1
+            if unconfirmed[0][1] == 0:
+                unconfirmed.popleft()
+                self.add_created(created)
+                if self.telemetry is not None:
+                    self.telemetry.addRows('ship', len(batch))
+                if self.state_store is not None:
+                    self.write_state(changes)
+                if marker is not None:
+                    marker.ack()
+
+        # Shrinks the request size when the cluster rejects requests
+        controller = AdaptiveBatchSize(
+            self.bulk_ship_size, should_stop=lambda: self._shutdown)
 
         try:
-            self.es.shipDocuments(bulk_iter(), self.bulk_ship_size)
+            self.es.shipDocuments(
+                bulk_iter(), self.bulk_ship_size,
+                bulk_bytes=self.bulk_ship_bytes, callback=confirm,
+                controller=controller, max_inflight=self.bulk_ship_inflight,
+                telemetry=self.telemetry)
+        except RetriesExhausted:
+            self.logger.warning("Shutdown while retrying bulk ship")
         except BulkShipError as e:
             self.logger.error(f"Exception in bulk ship response: {str(e)}")
             self.eventTracker.setShipError()
         except Exception:
             self.logger.exception("Unhandled exception in bulk ship")
             self.eventTracker.setShipError()
+        finally:
+            self.add_created(created)
+            if self.state_store is not None:
+                self.write_state(changes)
+                self.state_store.close()
+
+    def emit(self):
+        """Write the commands to bulk files instead of the cluster
+
+        Nothing is confirmed by the cluster, so the created counts, index
+        filters and state store are left alone
+        """
+        try:
+            for (marker, batch) in self.batches():
+                size = 0
+                for action in batch:
+                    size += self.bulk_writer.write(action.lines)
+                if self.telemetry is not None:
+                    self.telemetry.addRows('ship', len(batch))
+                    self.telemetry.addBytes(size)
+                if marker is not None:
+                    marker.ack()
+        except Exception:
+            self.logger.exception("Unable to write bulk file")
+            self.eventTracker.setShipError()
+        finally:
+            try:
+                self.bulk_writer.close()
+            except Exception:
+                self.logger.exception("Unable to close bulk file")
+                self.eventTracker.setShipError()
+
+    def is_delta(self, index):
+        return index.startswith(f"{self.es.indexNames.prefix}-data-delta-")
+
+    def add_created(self, created):
+        if not any(created):
+            return
+
+        self.eventTracker.addCreated(data=created[0], delta=created[1])
+        created[:] = [0, 0]
+
+    def encode_batch(self, batch):
+        """Encode the commands of a batch the worker did not encode
+
+        Args:
+            batch (list): Commands and/or PreparedAction instances
+
+        Returns:
+            list: PreparedAction instances, in the same order
+        """
+        start = time.perf_counter()
+        prepared = [
+            command if isinstance(command, PreparedAction)
+            else prepare(command)
+            for command in batch
+        ]
+        if self.statTracker is not None:
+            self.statTracker.addTime(
+                'shipper_serialize', time.perf_counter() - start)
+        return prepared
+
+    def state_change(self, command, ok, response, changes):
+        """Record the effect of a confirmed command on the state store
+
+        Args:
+            command (dict): The bulk command that was sent
+            ok (bool): Whether the command succeeded
+            response (dict): The bulk response for the command
+            changes (dict): Pending changes to add to
+        """
+        result = response[list(response)[0]]
+        index = result['_index']
+        if self.is_delta(index):
+            # Historical copies are not tracked
+            return
+
+        keys = self.es.metadata_key_map
+        op_type = command['_op_type']
+        if not ok:
+            if op_type == 'create' and result.get('status') == 409:
+                # Exists with unknown contents
+                changes['placeholders'].append((result['_id'], index))
+            return
+
+        if op_type in ['create', 'index']:
+            source = command['_source']
+            changes['records'].append((
+                result['_id'],
+                source[keys.VERSION_KEY],
+                index,
+                source[keys.FIRST_SEEN],
+                source[keys.DATE_FIRST_SEEN],
+                source[keys.DATE_CREATED],
+                source.get(keys.DETAILS_HASH),
+            ))
+        elif op_type == 'update':
+            doc = command['doc']
+            changes['updates'].append((
+                doc[keys.VERSION_KEY],
+                doc.get(keys.DETAILS_HASH),
+                result['_id'],
+            ))
+            # In case the store was missing the record
+            changes['placeholders'].append((result['_id'], index))
+
+    def write_state(self, changes):
+        if not any(changes.values()):
+            return
+
+        try:
+            self.state_store.apply(**changes)
+        except Exception:
+            self.logger.exception("Unable to update state store")
+            self.eventTracker.setShipError()
+        for pending in changes.values():
+            pending.clear()
 
 
 def parse_domain(domainName):
@@ -3,21 +3,50 @@ import multiprocessing
 
 class EventTracker:
     def __init__(self):
-        self._pauseEvent = multiprocessing.Event()
         self._shutdownEvent = multiprocessing.Event()
         self._bulkShipEvent = multiprocessing.Event()
         self._bulkFetchEvent = multiprocessing.Event()
         self._fileReaderDoneEvent = multiprocessing.Event()
+        # Number of rollovers done, pipelines watch it to pick up the new
+        # write indices
+        self._rollovers = multiprocessing.Value('i', 0)
+        # Number of rollovers announced and the index the last one creates,
+        # pipelines fetch from it before the write alias is switched
+        self._announced = multiprocessing.Value('i', 0)
+        self._announcedIndex = multiprocessing.Array('c', 256)
+        # Documents created in the current data and delta write indices
+        self._created = multiprocessing.Array('q', 2)
+        # Number of events recorded, bumped under the condition so the
+        # pipelines and pool can sleep until something happens
+        self._changed = multiprocessing.Condition()
+        self._changes = multiprocessing.RawValue('i', 0)
 
     @property
-    def paused(self):
-        return self._pauseEvent.is_set()
+    def changes(self):
+        """Number of events recorded so far, to be passed to wait"""
+        return self._changes.value
 
-    def pause(self):
-        self._pauseEvent.set()
+    def notify(self):
+        """Record an event, waking every process waiting on the tracker"""
+        with self._changed:
+            self._changes.value += 1
+            self._changed.notify_all()
 
-    def unpause(self):
-        self._pauseEvent.clear()
+    def wait(self, seen, timeout=None):
+        """Wait for an event recorded after the first 'seen' ones
+
+        Args:
+            seen (int): Number of events already handled by the caller
+            timeout (float, optional): Seconds to wait at most. Defaults to
+                None, waiting until an event is recorded.
+
+        Returns:
+            int: Number of events recorded so far
+        """
+        with self._changed:
+            self._changed.wait_for(
+                lambda: self._changes.value != seen, timeout)
+            return self._changes.value
 
     @property
     def shutdown(self):
@@ -25,6 +54,7 @@ class EventTracker:
 
     def setShutdown(self):
         self._shutdownEvent.set()
+        self.notify()
 
     @property
     def shipError(self):
@@ -32,6 +62,7 @@ class EventTracker:
 
     def setShipError(self):
         self._bulkShipEvent.set()
+        self.notify()
 
     @property
     def fetchError(self):
@@ -39,6 +70,7 @@ class EventTracker:
 
     def setFetchError(self):
         self._bulkFetchEvent.set()
+        self.notify()
 
     @property
     def bulkError(self):
@@ -50,3 +82,52 @@ class EventTracker:
 
     def setFileReaderDone(self):
         self._fileReaderDoneEvent.set()
+        self.notify()
+
+    @property
+    def rollovers(self):
+        return self._rollovers.value
+
+    @property
+    def created(self):
+        """(data, delta) documents in the current write indices"""
+        with self._created.get_lock():
+            return tuple(self._created[:])
+
+    def setCreated(self, data, delta):
+        with self._created.get_lock():
+            self._created[0] = data
+            self._created[1] = delta
+
+    def addCreated(self, data=0, delta=0):
+        with self._created.get_lock():
+            self._created[0] += data
+            self._created[1] += delta
+
+    @property
+    def announcedRollover(self):
+        """(rollovers announced, index the last one creates)"""
+        with self._announced.get_lock():
+            return (
+                self._announced.value,
+                self._announcedIndex.value.decode()
+            )
+
+    def announceRollover(self, index):
+        """Record that a write index is about to be rolled over
+
+        Args:
+            index (str): Name of the index the rollover creates
+        """
+        with self._announced.get_lock():
+            self._announcedIndex.value = index.encode()
+            self._announced.value += 1
+        self.notify()
+
+    def setRolledOver(self, delta=False):
+        """Record a rollover of the data or delta write index"""
+        with self._created.get_lock():
+            self._created[1 if delta else 0] = 0
+        with self._rollovers.get_lock():
+            self._rollovers.value += 1
+        self.notify()
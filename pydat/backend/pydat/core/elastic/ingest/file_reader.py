@@ -1,14 +1,300 @@
+import io
 import os
+import bz2
+import gzip
+import lzma
+import locale
+from collections import namedtuple
 
 import logging
 from threading import Thread
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from pydat.core.elastic.ingest.checkpoint_tracker import checkpoint_key
+
+
+# Mapping of compression type to the file extensions and leading magic
+# bytes used to identify it
+COMPRESSION_TYPES = {
+    'gzip': (('.gz', '.gzip'), b'\x1f\x8b'),
+    'bz2': (('.bz2',), b'BZh'),
+    'xz': (('.xz', '.lzma'), b'\xfd7zXZ\x00'),
+    'zstd': (('.zst', '.zstd'), b'\x28\xb5\x2f\xfd'),
+}
+
+COMPRESSION_EXTENSIONS = tuple(
+    ext for (exts, _) in COMPRESSION_TYPES.values() for ext in exts)
+
+
+# A unit of work for a pipeline, the rows of 'path' that begin in the
+# byte range [start, end). An 'end' of None reads until the end of the file.
+# 'offset', if set, is where reading should begin when resuming a
+# partially processed range
+FileRange = namedtuple('FileRange', ['path', 'start', 'end', 'offset'])
+# namedtuple's 'defaults' argument requires python 3.7
+FileRange.__new__.__defaults__ = (None,)
+
+# Put on a queue in between pipeline stages to tell one of the threads
+# taking items off it that no more are coming
+END_OF_STREAM = None
+
+# Orders in which the FileReader can queue work units
+SCHEDULES = ["name", "size"]
+
+
+def strip_compression_extension(path):
+    """Remove a trailing compression extension from a path, if present
+
+    Args:
+        path (str): File name or path
+
+    Returns:
+        str: The path without any known compression extension
+    """
+    (base, ext) = os.path.splitext(path)
+    if ext.lower() in COMPRESSION_EXTENSIONS:
+        return base
+    return path
+
+
+def detect_compression(filename):
+    """Detect the compression used by a data file
+
+    The leading magic bytes of the file are checked first, falling back
+    to the file extension if the file cannot be read
+
+    Args:
+        filename (str): Path to the file to check
+
+    Returns:
+        str: The compression type (a key of COMPRESSION_TYPES) or None
+            if the file does not appear to be compressed
+    """
+    try:
+        with open(filename, 'rb') as datafile:
+            magic = datafile.read(6)
+        for (name, (_, signature)) in COMPRESSION_TYPES.items():
+            if magic.startswith(signature):
+                return name
+        return None
+    except OSError:
+        pass
+
+    (_, ext) = os.path.splitext(filename)
+    for (name, (extensions, _)) in COMPRESSION_TYPES.items():
+        if ext.lower() in extensions:
+            return name
+
+    return None
+
+
+def open_data_file(filename):
+    """Open a data file for binary reading, decompressing it on the fly
+
+    Args:
+        filename (str): Path to the file to open
+
+    Raises:
+        RuntimeError: If the file is zstd compressed but the zstandard
+            library is not installed
+
+    Returns:
+        file object: A readable binary stream of the decompressed data
+    """
+    compression = detect_compression(filename)
+
+    if compression == 'gzip':
+        return gzip.open(filename, 'rb')
+    elif compression == 'bz2':
+        return bz2.open(filename, 'rb')
+    elif compression == 'xz':
+        return lzma.open(filename, 'rb')
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise RuntimeError(
+                f"zstandard library required to read {filename}")
+        dctx = zstandard.ZstdDecompressor()
+        return io.BufferedReader(dctx.stream_reader(
+            open(filename, 'rb'),
+            read_across_frames=True,
+            closefd=True
+        ))
+    else:
+        return open(filename, 'rb')
+
+
+def skip_to_offset(datafile, current, offset):
+    """Move a binary data stream forward to the given offset
+
+    Decompression streams can't be seeked efficiently so they are read
+    through to the requested offset instead
+
+    Args:
+        datafile (file object): Binary stream as returned by open_data_file
+        current (int): The current offset of the stream
+        offset (int): The offset to move to
+    """
+    if datafile.seekable():
+        datafile.seek(offset)
+        return
+
+    remaining = offset - current
+    while remaining > 0:
+        chunk = datafile.read(min(remaining, 1 << 20))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+
+
+def split_file(path, split_size):
+    """Split a data file into newline aligned byte ranges
+
+    Compressed files cannot be seeked into and so are never split
+
+    Args:
+        path (str): Path to the file to split
+        split_size (int): Approximate size in bytes of each range, a
+            value of 0 or None disables splitting
+
+    Returns:
+        list(FileRange): The ranges covering the whole file
+    """
+    if not split_size or split_size <= 0:
+        return [FileRange(path, 0, None)]
+
+    size = os.path.getsize(path)
+    if size <= split_size or detect_compression(path) is not None:
+        return [FileRange(path, 0, None)]
+
+    boundaries = [0]
+    with open(path, 'rb') as datafile:
+        offset = split_size
+        while offset < size:
+            datafile.seek(offset)
+            # Skip to the start of the next full line
+            datafile.readline()
+            boundary = datafile.tell()
+            if boundary >= size:
+                break
+            boundaries.append(boundary)
+            offset = boundary + split_size
+
+    ranges = []
+    for (index, start) in enumerate(boundaries):
+        if index + 1 < len(boundaries):
+            end = boundaries[index + 1]
+        else:
+            end = None
+        ranges.append(FileRange(path, start, end))
+
+    return ranges
+
+
+class LineReader:
+    """Iterator over the decoded lines of a byte range of a data file
+
+    The first line of the file (the csv header) is always returned first
+    so that ranges which do not start at the beginning of the file can
+    still be parsed on their own. Lines are returned while the line starts
+    before the end of the range
+
+    Args:
+        datafile (file object): Binary stream as returned by open_data_file
+        start (int, optional): Offset of the first line in the range.
+            Defaults to 0.
+        end (int, optional): Offset of the end of the range, None to read
+            to the end of the stream. Defaults to None.
+        encoding (str, optional): Encoding of the data, defaults to the
+            locale's preferred encoding like the builtin open
+    """
+
+    def __init__(self, datafile, start=0, end=None, encoding=None):
+        self.datafile = datafile
+        self.start = start
+        self.end = end
+        self.encoding = encoding or locale.getpreferredencoding(False)
+        self.offset = 0
+
+    def __iter__(self):
+        header = self.datafile.readline()
+        if not header:
+            return
+        self.offset = len(header)
+        yield header.decode(self.encoding)
+
+        if self.start > self.offset:
+            skip_to_offset(self.datafile, self.offset, self.start)
+            self.offset = self.start
+
+        end = self.end
+        encoding = self.encoding
+        for line in self.datafile:
+            if end is not None and self.offset >= end:
+                break
+            self.offset += len(line)
+            yield line.decode(encoding)
+
+
+class RangeStream(io.RawIOBase):
+    """Binary stream over the header and a byte range of a data file
+
+    The binary counterpart to LineReader for consumers that parse raw
+    bytes themselves. Since FileRange boundaries are newline aligned the
+    range can be copied byte for byte
+
+    Args:
+        datafile (file object): Binary stream as returned by open_data_file
+        start (int, optional): Offset of the first line in the range.
+            Defaults to 0.
+        end (int, optional): Offset of the end of the range, None to read
+            to the end of the stream. Defaults to None.
+    """
+
+    def __init__(self, datafile, start=0, end=None):
+        super().__init__()
+        self.datafile = datafile
+        self.end = end
+        self._pending = datafile.readline()
+        self.offset = len(self._pending)
+
+        if start > self.offset:
+            skip_to_offset(datafile, self.offset, start)
+            self.offset = start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._pending:
+            size = min(len(buffer), len(self._pending))
+            buffer[:size] = self._pending[:size]
+            self._pending = self._pending[size:]
+            return size
+
+        size = len(buffer)
+        if self.end is not None:
+            size = min(size, self.end - self.offset)
+        if size <= 0:
+            return 0
+
+        data = self.datafile.read(size)
+        buffer[:len(data)] = data
+        self.offset += len(data)
+        return len(data)
+
 
 class FileReader(Thread):
     """Simple data file organizer
 
     This class focuses on iterating through directories and putting
-    found files into a queue for processing by pipelines
+    found files into a queue for processing by pipelines. Files are
+    queued in sorted-name order, or with a 'size' schedule, largest
+    work unit first. Once every file was processed each of the 'readers'
+    taking files off the queue is sent END_OF_STREAM
     """
 
     def __init__(
@@ -18,6 +304,10 @@ class FileReader(Thread):
         directory,
         _file,
         extension,
+        split_size=0,
+        schedule="name",
+        checkpoints=None,
+        readers=0,
         logger=None,
     ):
         super().__init__()
@@ -33,6 +323,12 @@ class FileReader(Thread):
         self.directory = directory
         self.file = _file
         self.extension = extension
+        self.split_size = split_size
+        self.schedule = schedule
+        self.checkpoints = checkpoints or dict()
+        self.readers = readers
+        # Total size of the data files found, for progress reporting
+        self.total_bytes = 0
         self._shutdown = False
 
     def shutdown(self):
@@ -43,29 +339,150 @@ class FileReader(Thread):
             if self.directory:
                 self.scan_directory(self.directory)
             elif self.file:
-                self.file_queue.put(self.file)
+                self.queue_file(self.file)
             else:
                 self.logger.error("File or Directory required")
         except Exception:
             self.logger.exception("Unknown exception in File Reader")
         finally:
             self.file_queue.join()
+            for _ in range(self.readers):
+                self.file_queue.put(END_OF_STREAM)
             self.logger.debug("Setting FileReaderDone event")
             self.eventTracker.setFileReaderDone()
 
+    def _match_extension(self, name):
+        if self.extension == '':
+            return True
+        fn, ext = os.path.splitext(strip_compression_extension(name))
+        return ext != '' and ext.endswith(self.extension)
+
+    def collect_files(self, directory):
+        """Recursively find the data files in a directory
+
+        Args:
+            directory (str): Directory to scan
+
+        Returns:
+            list(tuple(str, int)): Path and size of every matching file,
+                in sorted-name order
+        """
+        found = []
+        try:
+            with os.scandir(directory) as iterator:
+                entries = sorted(iterator, key=lambda entry: entry.name)
+        except OSError:
+            self.logger.exception(f"Unable to scan directory {directory}")
+            return found
+
+        for entry in entries:
+            if self._shutdown:
+                break
+            try:
+                if entry.is_dir():
+                    found.extend(self.collect_files(entry.path))
+                elif entry.is_file():
+                    if self._match_extension(entry.name):
+                        found.append((entry.path, entry.stat().st_size))
+                else:
+                    self.logger.warning(
+                        "%s is neither a file nor directory" % entry.path)
+            except OSError:
+                self.logger.warning(f"Unable to stat {entry.path}, skipping")
+
+        return found
+
     def scan_directory(self, directory):
-        for path in sorted(os.listdir(directory)):
-            fp = os.path.join(directory, path)
+        files = self.collect_files(directory)
+        self.total_bytes = sum(size for (_, size) in files)
+        self.logger.info(
+            f"Found {len(files)} files ({self.total_bytes} bytes) to process")
 
-            if os.path.isdir(fp):
-                self.scan_directory(fp)
-            elif os.path.isfile(fp):
+        if self.schedule == "size":
+            self.queue_ranges(self._largest_first(files))
+        else:
+            for (path, size) in files:
                 if self._shutdown:
                     return
-                if self.extension != '':
-                    fn, ext = os.path.splitext(path)
-                    if ext == '' or not ext.endswith(self.extension):
-                        continue
-                self.file_queue.put(fp)
-            else:
-                self.logger.warning("%s is neither a file nor directory" % fp)
+                self.queue_ranges(self.split_ranges(path))
+
+    def _largest_first(self, files):
+        """Order the work units of all files from largest to smallest
+
+        Handing the largest units out first keeps a single large file from
+        being left to one pipeline at the end of the run
+        """
+        sized = []
+        for (path, size) in files:
+            if self._shutdown:
+                break
+            for file_range in self.split_ranges(path):
+                end = file_range.end if file_range.end is not None else size
+                start = file_range.start
+                if file_range.offset is not None:
+                    start = file_range.offset
+                sized.append((end - start, file_range))
+
+        sized.sort(key=lambda item: item[0], reverse=True)
+        return [file_range for (_, file_range) in sized]
+
+    def queue_file(self, path):
+        try:
+            self.total_bytes = os.path.getsize(path)
+        except OSError:
+            self.total_bytes = 0
+        self.queue_ranges(self.split_ranges(path))
+
+    def split_ranges(self, path):
+        """Split a file into work units and apply saved progress
+
+        Returns:
+            list(FileRange): The units of the file still to be processed
+        """
+        try:
+            ranges = split_file(path, self.split_size)
+        except OSError:
+            self.logger.warning(
+                f"Unable to split file {path}, queueing whole file")
+            ranges = [FileRange(path, 0, None)]
+
+        if len(ranges) > 1:
+            self.logger.debug(f"Split {path} into {len(ranges)} ranges")
+
+        if len(self.checkpoints) > 0:
+            ranges = [
+                file_range for file_range in map(self.resume_range, ranges)
+                if file_range is not None
+            ]
+
+        return ranges
+
+    def queue_ranges(self, ranges):
+        for file_range in ranges:
+            if self._shutdown:
+                return
+            self.file_queue.put(file_range)
+
+    def resume_range(self, file_range):
+        """Apply saved progress from a previous run to a file range
+
+        Returns:
+            FileRange: The range to process or None if it was already
+                completely processed
+        """
+        state = self.checkpoints.get(checkpoint_key(file_range))
+        if state is None:
+            return file_range
+
+        if state.get('done'):
+            self.logger.debug(
+                f"Skipping completed range {file_range.path} "
+                f"({file_range.start}-{file_range.end})")
+            return None
+
+        if state.get('offset') is not None:
+            self.logger.debug(
+                f"Resuming {file_range.path} at offset {state['offset']}")
+            return file_range._replace(offset=state['offset'])
+
+        return file_range
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+import os
+import json
+import time
+import ctypes
+import logging
+import multiprocessing
+from multiprocessing import RawArray
+
+from pydat.core.elastic.ingest.seen_domains import BloomFilter
+
+
+class IndexFilters:
+    """Bloom filters of the document ids held by each data index
+
+    Used by fetchers to only ask the indices that may hold a document for
+    it, instead of every index behind the search alias. The filters are
+    kept in shared memory so the shippers of every pipeline can add the
+    documents they create, and are saved in the state directory along
+    with the document count of the index they describe. A saved filter
+    whose index count no longer matches is rebuilt by scanning the ids in
+    the index, since a filter missing a document would cause an update to
+    be treated as a new record.
+
+    Indices without a filter, e.g., ones created by a rollover during the
+    run, are always assumed to possibly hold a document
+    """
+    VERSION = 1
+    ERROR_RATE = 0.01
+    DIRNAME = "index_filters"
+
+    def __init__(self, state_dir, capacity, logger=None):
+        self.path = os.path.join(state_dir, self.DIRNAME)
+        self.capacity = capacity
+        # index name -> (capacity, shared buffer)
+        self._buffers = dict()
+        self._filters = dict()
+        self._lock = multiprocessing.Lock()
+        if logger is None:
+            self.logger = logging.getLogger(__name__)
+        else:
+            self.logger = logger
+
+        os.makedirs(self.path, exist_ok=True)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Views of the shared buffers are recreated in each process
+        state['_filters'] = dict()
+        return state
+
+    @property
+    def indices(self):
+        return list(self._buffers.keys())
+
+    def _filename(self, index):
+        return os.path.join(self.path, f"{index}.bloom")
+
+    def _allocate(self, index, capacity):
+        buffer = RawArray(
+            ctypes.c_ubyte, BloomFilter.num_bytes(capacity, self.ERROR_RATE))
+        self._buffers[index] = (capacity, buffer)
+        self._filters.pop(index, None)
+        return buffer
+
+    def _filter(self, index):
+        bloom = self._filters.get(index)
+        if bloom is None:
+            (capacity, buffer) = self._buffers[index]
+            bloom = BloomFilter(capacity, self.ERROR_RATE, buffer)
+            self._filters[index] = bloom
+        return bloom
+
+    def setup(self, es, index_list):
+        """Load or build the filter of each index
+
+        Must be called before the pipeline processes are started
+
+        Args:
+            es (IngestHandler): handler used to count and scan indices
+            index_list (list): The data indices to create filters for
+        """
+        for index in index_list:
+            count = es.countDocuments(index)
+            if not self._load(index, count):
+                self._build(es, index, count)
+
+    def _load(self, index, count):
+        try:
+            with open(self._filename(index), 'rb') as filter_file:
+                header = json.loads(filter_file.readline())
+                if (header.get('version') != self.VERSION or
+                        header.get('count') != count or
+                        header.get('error_rate') != self.ERROR_RATE):
+                    self.logger.info(f"Filter for {index} is out of date")
+                    return False
+
+                buffer = self._allocate(index, header['capacity'])
+                view = memoryview(buffer).cast('B')
+                if filter_file.readinto(view) != len(view):
+                    raise ValueError("Truncated filter file")
+        except FileNotFoundError:
+            return False
+        except Exception:
+            self.logger.warning(
+                f"Unable to read filter for {index}, rebuilding")
+            self._buffers.pop(index, None)
+            return False
+
+        self.logger.debug(f"Loaded filter for {index}")
+        return True
+
+    def _build(self, es, index, count):
+        self.logger.info(f"Building filter for {index} ({count} documents)")
+        start = time.time()
+        self._allocate(index, max(self.capacity, count))
+        bloom = self._filter(index)
+        for doc_id in es.scanDocumentIds(index):
+            bloom.add(doc_id)
+        self.logger.info(
+            f"Built filter for {index} in {time.time() - start:.1f}s")
+
+    def save(self, es):
+        """Save every filter along with the current count of its index
+
+        The indices should be refreshed before calling so the counts
+        include every document written
+        """
+        for (index, (capacity, buffer)) in self._buffers.items():
+            try:
+                count = es.countDocuments(index)
+                filename = self._filename(index)
+                tmp_filename = f"{filename}.tmp"
+                with open(tmp_filename, 'wb') as filter_file:
+                    filter_file.write(json.dumps({
+                        'version': self.VERSION,
+                        'count': count,
+                        'capacity': capacity,
+                        'error_rate': self.ERROR_RATE,
+                    }).encode('utf-8') + b"\n")
+                    filter_file.write(memoryview(buffer).cast('B'))
+                os.replace(tmp_filename, filename)
+            except Exception:
+                self.logger.exception(f"Unable to save filter for {index}")
+
+    def candidates(self, index_list, doc_id):
+        """Filter an index list down to the indices that may hold a document
+
+        Args:
+            index_list (list): indices to consider, order is preserved
+            doc_id (str): The id of the document
+
+        Returns:
+            list: The indices that may hold the document
+        """
+        return [
+            index for index in index_list
+            if index not in self._buffers or doc_id in self._filter(index)
+        ]
+
+    def add(self, index, doc_id):
+        """Record a document created in an index
+        """
+        if index not in self._buffers:
+            return
+
+        bloom = self._filter(index)
+        # Bits are set a byte at a time, so writers must not interleave
+        with self._lock:
+            bloom.add(doc_id)
@@ -1,8 +1,12 @@
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import elasticsearch
 from elasticsearch import helpers
 
 from pydat.core.elastic import ElasticHandler
+from pydat.core.elastic.ingest.adaptive import AdaptiveBatchSize
+from pydat.core.elastic.ingest.bulk_encoder import PreparedAction
 
 METADATA_INDEX_BODY = {
     "settings": {
@@ -48,6 +52,9 @@ class RolloverRequired(Exception):
 
 class IngestHandler(ElasticHandler):
     ROLLOVER_TIME = 30  # 30 seconds
+    # Interval when checking document counts tracked by the caller
+    ROLLOVER_COUNT_TIME = 1  # 1 second
+    REPLICA_WAIT_TIMEOUT = "30m"
 
     def __init__(
         self,
@@ -152,11 +159,144 @@ class IngestHandler(ElasticHandler):
         es = self.connect()
         es.indices.refresh(index=name)
 
+    def writeIndices(self):
+        """The indices behind the data and delta write aliases"""
+        es = self.connect()
+        indices = []
+        for alias in [
+            self.indexNames.orig_write, self.indexNames.delta_write
+        ]:
+            try:
+                indices.extend(es.indices.get_alias(name=alias).keys())
+            except elasticsearch.exceptions.NotFoundError:
+                self.logger.warning(f"Unable to find alias {alias}")
+        return sorted(indices)
+
+    def templateSettings(self):
+        """The index settings of the data template"""
+        es = self.connect()
+        template = es.indices.get_template(
+            name=self.indexNames.template_name)
+        return template[self.indexNames.template_name].get(
+            'settings', {}).get('index', {})
+
+    def startBulkLoad(self, async_translog=False):
+        """Configure the write indices for a large amount of writes
+
+        Refreshes are disabled and replicas dropped until finishBulkLoad
+        restores the template settings. Can be called again after a
+        rollover to configure the new write index
+
+        Args:
+            async_translog (bool, optional): Also fsync the translog in
+                the background instead of on every request, writes
+                acknowledged in the last few seconds can be lost if a node
+                fails. Defaults to False.
+
+        Returns:
+            list: The indices that were configured
+        """
+        es = self.connect()
+        indices = self.writeIndices()
+        settings = {
+            'refresh_interval': "-1",
+            'number_of_replicas': 0,
+        }
+        if async_translog:
+            settings['translog.durability'] = "async"
+
+        es.indices.put_settings(
+            index=','.join(indices), body={'index': settings})
+        return indices
+
+    def finishBulkLoad(self, indices, wait=True):
+        """Restore the template settings of indices used for a bulk load
+
+        Args:
+            indices (list): The indices configured by startBulkLoad
+            wait (bool, optional): Wait for the replicas to be allocated.
+                Defaults to True.
+        """
+        es = self.connect()
+        template = self.templateSettings()
+        settings = {
+            'refresh_interval': template.get('refresh_interval'),
+            'number_of_replicas': template.get('number_of_replicas'),
+            # None resets a setting to the elasticsearch default
+            'translog.durability': template.get(
+                'translog', {}).get('durability'),
+        }
+        index = ','.join(indices)
+        es.indices.put_settings(index=index, body={'index': settings})
+        es.indices.refresh(index=index)
+
+        if wait:
+            health = es.cluster.health(
+                index=index,
+                wait_for_status="green",
+                timeout=self.REPLICA_WAIT_TIMEOUT,
+                ignore=408
+            )
+            if health.get('timed_out'):
+                self.logger.warning((
+                    "Timed out waiting for replicas to be allocated, "
+                    f"cluster status is {health.get('status')}"
+                ))
+
     def resolveAlias(self):
         es = self.connect()
         index_list = es.indices.get_alias(name=self.indexNames.orig_search)
         return sorted(index_list.keys(), reverse=True)
 
+    def countDocuments(self, index):
+        es = self.connect()
+        return es.count(index=index)['count']
+
+    def scanDocuments(
+        self,
+        index,
+        source=False,
+        slice_id=None,
+        max_slices=None,
+        size=5000
+    ):
+        """Iterate over every document in an index
+
+        Args:
+            index (str): The index (or alias) to scan
+            source (bool|list, optional): Source fields to retrieve, as
+                per the '_source' search option. Defaults to False.
+            slice_id (int, optional): Slice of the scroll to retrieve, for
+                scanning in parallel. Defaults to None.
+            max_slices (int, optional): Number of slices the scroll is
+                split into. Defaults to None.
+            size (int, optional): Number of documents per scroll request.
+                Defaults to 5000.
+
+        Yields:
+            dict: search hits
+        """
+        es = self.connect()
+        query = {"query": {"match_all": {}}, "_source": source}
+        if max_slices is not None and max_slices > 1:
+            query["slice"] = {"id": slice_id, "max": max_slices}
+
+        yield from helpers.scan(es, index=index, query=query, size=size)
+
+    def scanDocumentIds(self, index, size=5000):
+        """Iterate over the ids of every document in an index
+
+        Args:
+            index (str): The index to scan
+            size (int, optional): Number of ids per scroll request.
+                Defaults to 5000.
+
+        Yields:
+            str: document ids
+        """
+        for hit in self.scanDocuments(index, size=size):
+            yield hit['_id']
+
     @property
     def rolloverRequiredOrig(self):
         es = self.connect()
@@ -205,42 +345,102 @@ class IngestHandler(ElasticHandler):
         else:
             return 0
 
-    def rolloverIndices(self, write_alias, search_alias):
+    def nextIndex(self, write_alias):
+        """Name of the index a write alias would be rolled over to
+
+        Args:
+            write_alias (str): The write alias
+
+        Returns:
+            str: The name given by a dry run of the rollover
+        """
+        es = self.connect()
+        return es.indices.rollover(
+            alias=write_alias, dry_run=True)['new_index']
+
+    def rolloverIndices(self, write_alias, search_alias, new_index=None):
+        """Roll a write alias over to a new index
+
+        The alias is switched atomically by elasticsearch, so writes can
+        carry on while it happens
+
+        Args:
+            write_alias (str): The write alias
+            search_alias (str): The search alias the new index is added to
+            new_index (str, optional): Name of the new index. Defaults to
+                None, letting elasticsearch increment the current name.
+
+        Returns:
+            bool: True if the alias was rolled over
+        """
         es = self.connect()
         try:
             orig_name = list(es.indices.get_alias(name=write_alias).keys())[0]
         except Exception:
             self.logger.exception("Unable to get/resolve index alias")
+            return False
 
         try:
             es.indices.rollover(
                 alias=write_alias,
                 body={
                     "aliases": {search_alias: {}}
-                }
+                },
+                new_index=new_index
             )
         except Exception:
             self.logger.exception("Unable to issue rollover command: %s")
+            return False
 
         try:
             es.indices.refresh(index=orig_name)
         except Exception:
             self.logger.exception("Unable to refresh rolled over index")
 
-    def rolloverTimer(self, timer):
+        return True
+
+    def rolloverTimer(self, timer, created=None):
+        """Check whether a write index should be rolled over
+
+        Args:
+            timer (float): Time of the last check
+            created (tuple, optional): (data, delta) document counts of the
+                write indices, as tracked by the caller. When given they
+                are checked every ROLLOVER_COUNT_TIME seconds, otherwise
+                the cluster is asked for the counts every ROLLOVER_TIME
+                seconds. Defaults to None.
+
+        Raises:
+            RolloverRequired: If an index needs to be rolled over
+
+        Returns:
+            float: Time of the last check
+        """
         now = time.time()
-        if now - timer >= self.ROLLOVER_TIME:
+        if created is not None:
+            if now - timer < self.ROLLOVER_COUNT_TIME:
+                return timer
             timer = now
-            if self.rolloverRequiredOrig:
-                raise RolloverRequired(
-                    write_alias=self.indexNames.orig_write,
-                    search_alias=self.indexNames.orig_search
-                )
-            elif self.rolloverRequiredDelta:
-                raise RolloverRequired(
-                    write_alias=self.indexNames.delta_write,
-                    search_alias=self.indexNames.delta_search
-                )
+            orig_required = created[0] > self.rollover_size
+            delta_required = created[1] > self.rollover_size
+        elif now - timer >= self.ROLLOVER_TIME:
+            timer = now
+            orig_required = self.rolloverRequiredOrig
+            delta_required = (
+                not orig_required and self.rolloverRequiredDelta)
+        else:
+            return timer
+
+        if orig_required:
+            raise RolloverRequired(
+                write_alias=self.indexNames.orig_write,
+                search_alias=self.indexNames.orig_search
+            )
+        elif delta_required:
+            raise RolloverRequired(
+                write_alias=self.indexNames.delta_write,
+                search_alias=self.indexNames.delta_search
+            )
 
         return timer
 
@@ -252,9 +452,9 @@ class IngestHandler(ElasticHandler):
             response = es.mget(body={"docs": documents})
             fetched = response['docs']
         except elasticsearch.exceptions.TransportError as e:
-            if (e.status_code == 429 and "circuit_break" in e.error):
+            if e.status_code == 429:
                 raise BulkFetchError((
-                    "fetch size too large! Reduce and try again"
+                    "fetch rejected by cluster, reduce size and try again"
                 )) from None
             else:
                 raise RuntimeError("Unexpected elastic transport error")
@@ -263,15 +463,128 @@ class IngestHandler(ElasticHandler):
 
         return fetched
 
-    def shipDocuments(self, documents_iter, bulk_size):
+    def _prepareAction(self, es, document):
+        if isinstance(document, PreparedAction):
+            return document.lines
+
+        (action, data) = helpers.expand_action(document)
+        lines = [es.transport.serializer.dumps(action).encode('utf-8')]
+        if data is not None:
+            lines.append(es.transport.serializer.dumps(data).encode('utf-8'))
+        return lines
+
+    def _shipChunk(self, es, chunk, controller, telemetry=None):
+        """Send a chunk of prepared actions, retrying rejected ones
+
+        Actions rejected by the cluster (HTTP 429), either the whole request
+        or individual items, are resent after backing off, with the request
+        size reduced per the controller
+
+        Args:
+            es (Elasticsearch): client connection
+            chunk (list): Serialized lines of each action
+            controller (AdaptiveBatchSize): Controls the request size and
+                the delay between retries
+            telemetry (_TelemetryTracker, optional): Records request
+                latency, bytes sent and rejections. Defaults to None.
+
+        Returns:
+            list: (ok, response) for each action, in order
+        """
+        results = [None] * len(chunk)
+        pending = list(range(len(chunk)))
+        while len(pending) > 0:
+            batch = pending[:controller.size]
+            body = b"\n".join(
+                line for position in batch for line in chunk[position])
+            start = time.perf_counter()
+            try:
+                response = es.bulk(body=body + b"\n")
+            except elasticsearch.exceptions.TransportError as e:
+                if e.status_code != 429:
+                    raise RuntimeError(
+                        "Unhandled elasticsearch transport exception")
+                if telemetry is not None:
+                    telemetry.addRejected('bulk', len(batch))
+                controller.rejected(len(batch))
+                delay = controller.backoff()
+                self.logger.warning((
+                    "Bulk request rejected by cluster, retried after "
+                    f"{delay:.1f}s with size {controller.size}"
+                ))
+                continue
+
+            if telemetry is not None:
+                telemetry.observe('bulk', time.perf_counter() - start)
+                telemetry.addBytes(len(body) + 1)
+
+            retry = list()
+            for (position, item) in zip(batch, response['items']):
+                result = item[list(item)[0]]
+                status = result.get('status', 500)
+                if status == 429:
+                    retry.append(position)
+                else:
+                    results[position] = (200 <= status < 300, item)
+
+            pending = retry + pending[len(batch):]
+            if len(retry) > 0:
+                if telemetry is not None:
+                    telemetry.addRejected('bulk', len(retry))
+                controller.rejected(len(batch))
+                delay = controller.backoff()
+                self.logger.warning((
+                    f"{len(retry)} bulk items rejected by cluster, retried "
+                    f"after {delay:.1f}s with size {controller.size}"
+                ))
+            else:
+                controller.succeeded()
+
+        return results
+
+    def shipDocuments(
+        self,
+        documents_iter,
+        bulk_size,
+        bulk_bytes=None,
+        callback=None,
+        controller=None,
+        max_inflight=1,
+        telemetry=None
+    ):
+        """Send documents to elasticsearch using the bulk api
+
+        Requests are filled until they hold bulk_size actions or their
+        payload reaches bulk_bytes, whichever comes first
+
+        Args:
+            documents_iter (iterator): Bulk actions to send, either command
+                dicts or PreparedAction instances whose lines are sent as is
+            bulk_size (int): Maximum number of actions per bulk request
+            bulk_bytes (int, optional): Target payload size in bytes of a
+                bulk request. Defaults to None, no limit.
+            callback (function, optional): Called with (ok, response) for
+                each action, in order, once elasticsearch has accepted it.
+                Defaults to None.
+            controller (AdaptiveBatchSize, optional): Controls the request
+                size when the cluster rejects requests. Defaults to a
+                controller starting at bulk_size.
+            max_inflight (int, optional): Number of bulk requests to have
+                in flight at once, results are still handled in the order
+                requests were sent. Defaults to 1.
+            telemetry (_TelemetryTracker, optional): Records request
+                latency, bytes sent and rejections. Defaults to None.
+
+        Raises:
+            BulkShipError: If elasticsearch rejects an action or the request
+            RetriesExhausted: If the controller gives up retrying
+        """
         es = self.connect()
+        if controller is None:
+            controller = AdaptiveBatchSize(bulk_size)
 
-        try:
-            for (ok, response) in helpers.streaming_bulk(
-                es, documents_iter,
-                raise_on_error=False,
-                chunk_size=bulk_size
-            ):
+        def handle(results):
+            for (ok, response) in results:
                 resp = response[list(response)[0]]
                 if not ok and resp['status'] not in [404, 409]:
                     self.logger.debug("Response: %s" % (str(resp)))
@@ -279,16 +592,64 @@ class IngestHandler(ElasticHandler):
                         "Error making bulk request, received "
                         f"error reason: {resp['error']['reason']}"
                     )
-        except elasticsearch.exceptions.TransportError as e:
-            if (e.status_code == 429 and "circuit_break" in e.error):
-                raise BulkShipError((
-                    "Bulk Ship too large! Reduce and try again"
-                )) from None
-            else:
-                raise RuntimeError(
-                    "Unhandled elasticsearch transport exception")
-        except Exception:
-            raise
+                if callback is not None:
+                    callback(ok, response)
+
+        # Requests sent but not yet handled, oldest first
+        inflight = deque()
+        executor = None
+        if max_inflight > 1:
+            executor = ThreadPoolExecutor(max_workers=max_inflight)
+
+        def ship(chunk):
+            if executor is None:
+                handle(self._shipChunk(es, chunk, controller, telemetry))
+                return
+
+            if len(inflight) >= max_inflight:
+                handle(inflight.popleft().result())
+            inflight.append(
+                executor.submit(
+                    self._shipChunk, es, chunk, controller, telemetry))
+            # Results are handled in the order requests were sent
+            while len(inflight) > 0 and inflight[0].done():
+                handle(inflight.popleft().result())
+
+        try:
+            chunk = list()
+            chunk_bytes = 0
+            for document in documents_iter:
+                lines = self._prepareAction(es, document)
+                size = sum(len(line) + 1 for line in lines)
+                # Send what was gathered rather than go over the payload
+                # size, an action larger than the payload size is sent on
+                # its own
+                if (bulk_bytes and len(chunk) > 0 and
+                        chunk_bytes + size > bulk_bytes):
+                    ship(chunk)
+                    chunk = list()
+                    chunk_bytes = 0
+
+                chunk.append(lines)
+                chunk_bytes += size
+                if len(chunk) >= controller.size:
+                    ship(chunk)
+                    chunk = list()
+                    chunk_bytes = 0
+
+            if len(chunk) > 0:
+                ship(chunk)
+
+            while len(inflight) > 0:
+                handle(inflight.popleft().result())
+        finally:
+            if executor is not None:
+                # Results of requests still in flight after an error are
+                # dropped, so their actions are never confirmed.
+                # shutdown's cancel_futures requires python 3.9
+                for future in inflight:
+                    future.cancel()
+                executor.shutdown(wait=True)
 
     def initialize(self, template):
         es = self.connect()
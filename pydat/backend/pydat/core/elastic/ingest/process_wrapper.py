@@ -17,12 +17,21 @@ from pydat.core.elastic.ingest.data_processors import (
     DataFetcher,
     DataWorker,
     DataShipper,
+    WorkRouter,
 )
+from pydat.core.elastic.ingest.file_reader import END_OF_STREAM
+from pydat.core.elastic.ingest.seen_domains import SeenDomains
+from pydat.core.elastic.ingest.bulk_files import BulkFileWriter
+from pydat.core.elastic.ingest.profiler import PipelineProfiler
 
 from pydat.core.elastic.ingest.debug_levels import DebugLevel
 from pydat.core.logger import getLogger
 
 
+# Approximate number of rows allowed to wait in each in-process queue
+QUEUE_ROW_LIMIT = 10000
+
+
 class PopulatorOptions(SimpleNamespace):
     def __init__(
         self,
@@ -40,8 +49,18 @@ class PopulatorOptions(SimpleNamespace):
             'elastic_args',
             'bulk_fetch_size',
             'bulk_ship_size',
+            'bulk_ship_bytes',
+            'bulk_ship_inflight',
+            'pre_encode',
             'num_fetcher_threads',
+            'num_worker_threads',
             'num_shipper_threads',
+            'batch_size',
+            'reader_backend',
+            'dedup',
+            'dedup_capacity',
+            'profile_dir',
+            'emit_dir',
             'verbose',
             'debug',
         ]
@@ -54,7 +73,7 @@ class PopulatorOptions(SimpleNamespace):
         if len(unexpected_options) > 0:
             raise ValueError((
                 "Unexpected arguments: "
-                f"{','.join(list(unexpected_options.keys()))}"
+                f"{','.join(unexpected_options)}"
             ))
 
         super().__init__(**kwargs)
@@ -71,6 +90,10 @@ class DataProcessor(Process):
         eventTracker,
         process_options,
         skip_fetch,
+        checkpointTracker=None,
+        index_filters=None,
+        state_store=None,
+        telemetry=None,
     ):
         super().__init__()
         self.myid = pipeline_id
@@ -85,13 +108,21 @@ class DataProcessor(Process):
         self.file_queue = file_queue
         self.statTracker = statTracker
         self.eventTracker = eventTracker
+        self.checkpointTracker = checkpointTracker
+        self.index_filters = index_filters
+        self.state_store = state_store
+        self.telemetry = telemetry
         self.process_options = process_options
 
         self.fetcher_threads = []
-        self.worker_thread = None
+        self.worker_threads = []
         self.shipper_threads = []
         self.reader_thread = None
-        self._paused = multiprocessing.Value('b', False)
+        self.seen_domains = None
+        self.profiler = None
+        self._rollovers = 0
+        # Number of announced rollovers whose index is being fetched from
+        self._announced = multiprocessing.Value('i', 0)
         self._complete = multiprocessing.Value('b', False)
         self._shuttered = multiprocessing.Value('b', False)
         self.es = IngestHandler(
@@ -101,6 +132,7 @@ class DataProcessor(Process):
         self.skip_fetch = skip_fetch
 
         self.num_fetcher_threads = self.process_options.num_fetcher_threads
+        self.num_worker_threads = self.process_options.num_worker_threads
         self.num_shipper_threads = self.process_options.num_shipper_threads
         self.verbose = self.process_options.verbose
         self.debug = self.process_options.debug
@@ -108,13 +140,10 @@ class DataProcessor(Process):
 
         # These are created when the process starts up
         self.data_queue = None
-        self.work_queue = None
+        self.work_queues = None
+        self.work_router = None
         self.insert_queue = None
 
-    @property
-    def paused(self):
-        return self._paused.value
-
     @property
     def complete(self):
         return self._complete.value
@@ -123,37 +152,54 @@ class DataProcessor(Process):
     def shuttered(self):
         return self._shuttered.value
 
+    @property
+    def announced(self):
+        return self._announced.value
+
     def update_index_list(self):
         self.index_list = self.es.resolveAlias()
 
-    def _pause(self):
-        if self.reader_thread.isAlive():
-            try:
-                self.reader_thread.pause()
-                self.cleanup()
-                self._paused.value = True
-            except Exception:
-                self.logger.exception("Unable to pause reader thread")
-        else:
-            self.logger.debug("Pause requested when reader thread not alive")
-
-    def _unpause(self):
-        if self.complete:
-            # Don't unpause if it's already complete
+    def handle_rollover(self):
+        """Point the running fetchers at the indices after a rollover"""
+        self.logger.debug("Rollover detected, updating index list")
+        try:
+            self.update_index_list()
+        except Exception:
+            self.logger.exception("Unable to resolve indices after rollover")
+            self.eventTracker.setFetchError()
             return
 
-        if self.reader_thread.isAlive():
-            try:
-                self.reader_thread.unpause()
-            except Exception:
-                self.logger.exception("Unable to unpause reader thread")
-            # Disable skipping fetch phase
-            self.skip_fetch = False
-            self.update_index_list()
-            self.startup_rest()
-            self._paused.value = False
-        else:
-            self.logger.debug("Pause requested when reader thread not alive")
+        self.apply_index_list()
+
+    def prepare_rollover(self, index):
+        """Start fetching from the index an announced rollover creates
+
+        Records are created in it as soon as the write alias is switched,
+        so it has to be fetched from by then or they'd be created again
+        """
+        self.logger.debug(f"Rollover to {index} announced")
+        self.index_list = sorted(set(self.index_list) | {index}, reverse=True)
+        self.apply_index_list()
+
+    def apply_index_list(self):
+        # New threads are started with the current settings
+        self.skip_fetch = False
+        for fetcher in self.fetcher_threads:
+            fetcher.update_index_list(self.index_list)
+
+    def record_depths(self):
+        # Queues hold batches, report roughly how many rows are waiting
+        batch_size = self.process_options.batch_size
+        for (name, work_queue) in [
+            ('data', self.data_queue),
+            ('insert', self.insert_queue),
+        ]:
+            self.telemetry.setDepth(name, work_queue.qsize() * batch_size)
+        # Batches are split between the workers
+        self.telemetry.setDepth(
+            'work',
+            self.work_router.qsize() * batch_size // self.num_worker_threads
+        )
 
     def _drain(self):
         while not self.file_queue.empty():
@@ -163,12 +209,13 @@ class DataProcessor(Process):
             except queue.Empty:
                 break
 
-        while not self.work_queue.empty():
-            try:
-                self.work_queue.get_nowait()
-                self.work_queue.task_done()
-            except queue.Empty:
-                break
+        for work_queue in self.work_queues:
+            while not work_queue.empty():
+                try:
+                    work_queue.get_nowait()
+                    work_queue.task_done()
+                except queue.Empty:
+                    break
 
         while not self.insert_queue.empty():
             try:
@@ -177,6 +224,16 @@ class DataProcessor(Process):
             except queue.Empty:
                 break
 
+    @staticmethod
+    def _wake(work_queue, threads):
+        """Wake threads blocked on a queue so they see the shutdown"""
+        for _ in range(threads):
+            try:
+                work_queue.put_nowait(END_OF_STREAM)
+            except queue.Full:
+                # The threads have work left and will check when done
+                break
+
     def shutdown(self):
         self.logger.debug("Shutting down reader")
         self.reader_thread.shutdown()
@@ -184,14 +241,18 @@ class DataProcessor(Process):
         self.logger.debug("Shutting down fetchers")
         [fetcher.shutdown() for fetcher in self.fetcher_threads]
 
-        self.logger.debug("Shutting down worker thread")
-        self.worker_thread.shutdown()
+        self.logger.debug("Shutting down worker threads")
+        [worker.shutdown() for worker in self.worker_threads]
 
         self.logger.debug("Shutting down shippers")
         [shipper.shutdown() for shipper in self.shipper_threads]
 
         # Drain queues
         self._drain()
+        self._wake(self.data_queue, len(self.fetcher_threads))
+        for work_queue in self.work_queues:
+            self._wake(work_queue, 1)
+        self._wake(self.insert_queue, len(self.shipper_threads))
 
         self.logger.debug("Waiting for shippers to finish")
         # Shippers can't be forced to shutdown
@@ -200,45 +261,73 @@ class DataProcessor(Process):
             shipper.join()
 
         self.statTracker.flush()
+        if self.checkpointTracker is not None:
+            self.checkpointTracker.flush()
+        if self.telemetry is not None:
+            self.telemetry.flush()
+        if self.profiler is not None:
+            # Give the other threads a moment to exit so their profiles
+            # are complete
+            for thread in ([self.reader_thread] + self.worker_threads +
+                           self.fetcher_threads):
+                thread.join(1)
+            self.save_profiles()
         self.logger.debug("Shutdown Complete")
         self._shuttered.value = True
 
     def cleanup(self):
-        self.logger.debug("Waiting for fetchers to finish")
-        for fetcher in self.fetcher_threads:
-            fetcher.finish()
-            fetcher.join()
-
-        self.logger.debug("Waiting for worker to finish")
-        self.worker_thread.finish()
-        self.worker_thread.join()
-
-        self.logger.debug("Waiting for shippers to finish")
-        for shipper in self.shipper_threads:
-            shipper.finish()
-            shipper.join()
+        # Threads of a stage share their queue, so every one of them is
+        # sent the end of the stream before any is waited on
+        for (name, threads) in [
+            ('fetchers', self.fetcher_threads),
+            ('workers', self.worker_threads),
+            ('shippers', self.shipper_threads),
+        ]:
+            self.logger.debug(f"Waiting for {name} to finish")
+            for thread in threads:
+                thread.finish()
+            for thread in threads:
+                thread.join()
 
         self.logger.debug("Cleanup Complete")
 
     def finish(self):
         self.cleanup()
         self.statTracker.flush()
+        if self.checkpointTracker is not None:
+            self.checkpointTracker.flush()
+        if self.telemetry is not None:
+            self.telemetry.flush()
+        if self.profiler is not None:
+            self.save_profiles()
         self._shuttered.value = True
 
+    def save_profiles(self):
+        try:
+            self.profiler.save()
+        except Exception:
+            self.logger.exception("Unable to save profiles")
+
     def startup_rest(self):
-        self.logger.debug("Starting Worker")
-        self.worker_thread = DataWorker(
-            pipelineid=self.myid,
-            work_queue=self.work_queue,
-            insert_queue=self.insert_queue,
-            statTracker=self.statTracker,
-            eventTracker=self.eventTracker,
-            es=self.es,
-            process_options=self.process_options,
-            logger=self.logger,
-        )
-        self.worker_thread.daemon = True
-        self.worker_thread.start()
+        self.logger.debug("Starting Workers")
+        for (workerid, work_queue) in enumerate(self.work_queues):
+            worker_thread = DataWorker(
+                pipelineid=self.myid,
+                work_queue=work_queue,
+                insert_queue=self.insert_queue,
+                statTracker=self.statTracker,
+                eventTracker=self.eventTracker,
+                es=self.es,
+                process_options=self.process_options,
+                telemetry=self.telemetry,
+                workerid=workerid,
+                logger=self.logger,
+            )
+            worker_thread.daemon = True
+            if self.profiler is not None:
+                self.profiler.attach(worker_thread, 'worker')
+            worker_thread.start()
+            self.worker_threads.append(worker_thread)
 
         self.logger.debug("starting Fetchers")
         for fetcherid in range(self.num_fetcher_threads):
@@ -247,18 +336,31 @@ class DataProcessor(Process):
                 fetcherid=fetcherid,
                 es=self.es,
                 data_queue=self.data_queue,
-                work_queue=self.work_queue,
+                work_queue=self.work_router,
                 eventTracker=self.eventTracker,
                 index_list=self.index_list,
                 skip_fetch=self.skip_fetch,
                 process_options=self.process_options,
+                statTracker=self.statTracker,
+                seen_domains=self.seen_domains,
+                index_filters=self.index_filters,
+                state_store=self.state_store,
+                telemetry=self.telemetry,
                 logger=self.logger,
             )
+            if self.profiler is not None:
+                self.profiler.attach(fetcher_thread, 'fetcher')
             fetcher_thread.start()
             self.fetcher_threads.append(fetcher_thread)
 
         self.logger.debug("Starting Shippers")
         for shipperid in range(self.num_shipper_threads):
+            bulk_writer = None
+            if self.process_options.emit_dir is not None:
+                bulk_writer = BulkFileWriter(
+                    self.process_options.emit_dir,
+                    f"bulk.{self.myid}.{shipperid}"
+                )
             shipper_thread = DataShipper(
                 pipelineid=self.myid,
                 shipperid=shipperid,
@@ -266,7 +368,14 @@ class DataProcessor(Process):
                 insert_queue=self.insert_queue,
                 eventTracker=self.eventTracker,
                 process_options=self.process_options,
+                statTracker=self.statTracker,
+                index_filters=self.index_filters,
+                state_store=self.state_store,
+                telemetry=self.telemetry,
+                bulk_writer=bulk_writer,
             )
+            if self.profiler is not None:
+                self.profiler.attach(shipper_thread, 'shipper')
             shipper_thread.start()
             self.shipper_threads.append(shipper_thread)
 
@@ -278,12 +387,35 @@ class DataProcessor(Process):
             debug=True,
         )
 
-        # Queue for individual csv entries
-        self.data_queue = queue.Queue(maxsize=10000)
-        # Queue for current/new entry comparison
-        self.work_queue = queue.Queue(maxsize=10000)
+        # Queues hold batches of rows/entries/commands, so bound them by
+        # the number of batches that make up the row limit
+        maxsize = max(2, QUEUE_ROW_LIMIT // self.process_options.batch_size)
+        # Queue for batches of csv entries
+        self.data_queue = queue.Queue(maxsize=maxsize)
+        # Queues for current/new entry comparison, one per worker. The
+        # fetchers route entries to them by document id
+        self.work_queues = [
+            queue.Queue(maxsize=maxsize)
+            for _ in range(self.num_worker_threads)
+        ]
+        self.work_router = WorkRouter(self.work_queues)
         # Queue for shippers to send data
-        self.insert_queue = queue.Queue(maxsize=10000)
+        self.insert_queue = queue.Queue(maxsize=maxsize)
+
+        # Domains already handled by this pipeline during the run. The
+        # exact window of the bloom filter must be larger than the number
+        # of rows that can be in flight between the fetchers and shippers
+        if self.process_options.dedup != 'off':
+            self.seen_domains = SeenDomains(
+                mode=self.process_options.dedup,
+                capacity=self.process_options.dedup_capacity,
+                window=QUEUE_ROW_LIMIT * 10,
+            )
+
+        if self.process_options.profile_dir is not None:
+            self.profiler = PipelineProfiler(
+                self.process_options.profile_dir, self.myid,
+                logger=self.logger)
 
         self.startup_rest()
 
@@ -294,32 +426,53 @@ class DataProcessor(Process):
             data_queue=self.data_queue,
             eventTracker=self.eventTracker,
             process_options=self.process_options,
+            checkpoints=self.checkpointTracker,
+            telemetry=self.telemetry,
             logger=self.logger,
         )
+        # Only waits on the file queue once its work is done, so it isn't
+        # joined on shutdown
+        self.reader_thread.daemon = True
+        if self.profiler is not None:
+            self.profiler.attach(self.reader_thread, 'reader')
         self.reader_thread.start()
 
-        # Wait to shutdown/finish
+        # Queue depths are sampled as often as telemetry is sent
+        interval = None
+        if self.telemetry is not None:
+            interval = self.telemetry.FLUSH_INTERVAL
+
+        # Wait to shutdown/finish, woken by the event tracker
+        seen = self.eventTracker.changes
         while 1:
             if self.eventTracker.shutdown:
                 self.logger.debug("Shutdown event received")
                 self.shutdown()
                 break
 
-            if self.eventTracker.paused:
-                self._pause()
-                while self.eventTracker.paused:
-                    time.sleep(.1)
-                self._unpause()
+            (announced, index) = self.eventTracker.announcedRollover
+            if announced != self._announced.value:
+                self.prepare_rollover(index)
+                # Let the pool know the rollover can go ahead
+                self._announced.value = announced
+                self.eventTracker.notify()
+
+            if self.eventTracker.rollovers != self._rollovers:
+                self._rollovers = self.eventTracker.rollovers
+                self.handle_rollover()
 
-            self.reader_thread.join(.1)
-            if not self.reader_thread.isAlive():
+            if self.telemetry is not None:
+                self.record_depths()
+
+            if not self.reader_thread.is_alive():
                 self.logger.debug("Reader thread exited, finishing up")
                 self.finish()
                 break
 
-            time.sleep(.1)
+            seen = self.eventTracker.wait(seen, interval)
         self.logger.debug(f"Pipeline {self.myid} Shutdown")
         self._complete.value = True
+        self.eventTracker.notify()
 
 
 class DataProcessorPool:
@@ -330,6 +483,10 @@ class DataProcessorPool:
         statTracker,
         eventTracker,
         process_options,
+        checkpointTracker=None,
+        index_filters=None,
+        state_store=None,
+        telemetry=None,
     ):
 
         self.proc_count = procs
@@ -361,7 +518,17 @@ class DataProcessorPool:
                 statTracker=self.statTracker.get_tracker(),
                 eventTracker=self.eventTracker,
                 skip_fetch=skip_fetch,
-                process_options=self.process_options
+                process_options=self.process_options,
+                checkpointTracker=(
+                    checkpointTracker.get_tracker()
+                    if checkpointTracker is not None else None
+                ),
+                index_filters=index_filters,
+                state_store=state_store,
+                telemetry=(
+                    telemetry.get_tracker(f"pipeline.{pipeline_id}")
+                    if telemetry is not None else None
+                ),
             )
             self.pipelines.append(p)
 
@@ -371,13 +538,17 @@ class DataProcessorPool:
 
     def join(self):
         timer = time.time()
+        seen = self.eventTracker.changes
         while 1:
             running = any([not proc.complete for proc in self.pipelines])
             if not running:
                 break
 
             try:
-                timer = self.elastic_handler.rolloverTimer(timer)
+                # Nothing is written to the cluster while emitting
+                if self.process_options.emit_dir is None:
+                    timer = self.elastic_handler.rolloverTimer(
+                        timer, created=self.eventTracker.created)
             except RolloverRequired as rollOver:
                 # Reset Timer
                 timer = time.time()
@@ -392,48 +563,82 @@ class DataProcessorPool:
                 raise KeyboardInterrupt((
                     "Error response from ES worker, stopping processing"))
 
-        timer = time.time()
-        while 1:
-            if all([not proc.is_alive() for proc in self.pipelines]):
-                break
+            # Pipelines announce their completion, the created counts are
+            # checked for rollovers on an interval
+            seen = self.eventTracker.wait(
+                seen, self.elastic_handler.ROLLOVER_COUNT_TIME)
 
-            if time.time() - timer > 5.0:  # Wait up to 5 seconds
-                for proc in self.pipelines:
-                    if proc.is_alive():
-                        try:
-                            proc.terminate()
-                        except Exception:
-                            pass
-                break
+        deadline = time.time() + 5.0  # Wait up to 5 seconds
+        for proc in self.pipelines:
+            proc.join(max(0, deadline - time.time()))
 
-            time.sleep(.01)
+        for proc in self.pipelines:
+            if proc.is_alive():
+                try:
+                    proc.terminate()
+                except Exception:
+                    pass
 
         self.logger.debug("All processes finished, cleaning up")
 
+    def announceRollover(self, index):
+        """Wait for the running pipelines to fetch from a new index
+
+        Args:
+            index (str): Name of the index the rollover creates
+
+        Returns:
+            bool: False if the pipelines are being shut down
+        """
+        self.eventTracker.announceRollover(index)
+        (announced, _) = self.eventTracker.announcedRollover
+        seen = self.eventTracker.changes
+        while any([
+            proc.is_alive() and not proc.complete and
+            proc.announced != announced
+            for proc in self.pipelines
+        ]):
+            if self.eventTracker.shutdown or self.eventTracker.bulkError:
+                return False
+            seen = self.eventTracker.wait(
+                seen, self.elastic_handler.ROLLOVER_COUNT_TIME)
+        return True
+
     def handleRollover(self, write_alias, search_alias):
+        """Roll over a write index while the pipelines keep running
+
+        Every pipeline fetches from the new index before the write alias is
+        switched to it, so records created in it are always found. Skipped
+        while emitting bulk files, which are rolled over as they are
+        replayed
+        """
+        if self.process_options.emit_dir is not None:
+            return
+
         if self.debug >= DebugLevel.VERBOSE:
             self.logger.debug("Rolling over ElasticSearch Index")
 
-        # Pause the pipelines
-        self.eventTracker.pause()
+        try:
+            try:
+                new_index = self.elastic_handler.nextIndex(write_alias)
+            except Exception:
+                self.logger.exception("Unable to name the rolled over index")
+                return
 
-        self.logger.debug("Waiting for pipelines to pause")
-        # Ensure procs are paused
-        for proc in self.pipelines:
-            while not proc.paused:
-                if proc.complete:
-                    break
-                time.sleep(.1)
-        self.logger.debug("Pipelines paused")
+            if not self.announceRollover(new_index):
+                return
 
-        try:
-            self.elastic_handler.rolloverIndices(
+            if self.elastic_handler.rolloverIndices(
                 write_alias=write_alias,
-                search_alias=search_alias
-            )
-
-            # Index rolled over, restart processing
-            self.eventTracker.unpause()
+                search_alias=search_alias,
+                new_index=new_index
+            ):
+                self.eventTracker.setRolledOver(
+                    delta=(
+                        write_alias ==
+                        self.elastic_handler.indexNames.delta_write
+                    )
+                )
 
             if self.debug >= DebugLevel.VERBOSE:
                 self.logger.debug("Roll over complete")
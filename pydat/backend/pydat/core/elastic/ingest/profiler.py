@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+import os
+import io
+import glob
+import json
+import time
+import pstats
+import cProfile
+import logging
+from threading import Lock
+
+
+def _thread_time():
+    """CPU time of the calling thread"""
+    # time.thread_time requires python 3.7
+    try:
+        return time.clock_gettime(time.CLOCK_THREAD_CPUTIME_ID)
+    except (AttributeError, OSError):
+        # Not available on the platform, the CPU time of the whole process
+        # is the closest measure
+        return time.process_time()
+
+
+class PipelineProfiler:
+    """Profiles the threads of a pipeline process
+
+    Each thread attached to the profiler runs under its own cProfile
+    profiler timing functions by wall clock, and the CPU time of the thread
+    is measured alongside. CPU time used by a python thread is, apart from
+    C code that releases it, time the GIL was held. Profiles are written
+    per stage, e.g., 'fetcher', to the output directory by save.
+
+    Python 3.12 and later allow a single active profiler per process, a
+    thread started while another one is profiled only has its wall and CPU
+    time measured
+
+    Args:
+        path (str): Directory to write the profiles to
+        pipeline_id (int): Pipeline the profiles belong to
+        logger (Logger, optional): Defaults to None.
+    """
+
+    def __init__(self, path, pipeline_id, logger=None):
+        self.path = path
+        self.pipeline_id = pipeline_id
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = Lock()
+        # Finished thread profiles per stage as (profile, wall, cpu), the
+        # profile is None if the thread could not be profiled
+        self._profiles = dict()
+
+    def attach(self, thread, stage):
+        """Profile a thread, must be called before it is started
+
+        Args:
+            thread (Thread): The thread to profile
+            stage (str): Name of the stage the thread runs
+        """
+        run = thread.run
+
+        def profiled_run():
+            profile = cProfile.Profile(time.perf_counter)
+            wall = time.perf_counter()
+            cpu = _thread_time()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler is active
+                self.logger.warning(
+                    f"Unable to profile a {stage} thread, only its times "
+                    "are measured")
+                profile = None
+            try:
+                run()
+            finally:
+                if profile is not None:
+                    profile.disable()
+                with self._lock:
+                    self._profiles.setdefault(stage, []).append((
+                        profile,
+                        time.perf_counter() - wall,
+                        _thread_time() - cpu,
+                    ))
+
+        thread.run = profiled_run
+
+    def save(self):
+        """Write the profiles of threads that have finished
+
+        Returns:
+            list: Paths of the files written
+        """
+        os.makedirs(self.path, exist_ok=True)
+        with self._lock:
+            (profiles, self._profiles) = (self._profiles, dict())
+
+        written = list()
+        times = dict()
+        for (stage, runs) in profiles.items():
+            stage_profiles = [
+                profile for (profile, _, _) in runs if profile is not None]
+            if len(stage_profiles) > 0:
+                stats = pstats.Stats(stage_profiles[0])
+                for profile in stage_profiles[1:]:
+                    stats.add(profile)
+                stats_path = os.path.join(
+                    self.path, f"pipeline.{self.pipeline_id}.{stage}.prof")
+                stats.dump_stats(stats_path)
+                written.append(stats_path)
+            times[stage] = {
+                'threads': len(runs),
+                'wall': sum(wall for (_, wall, _) in runs),
+                'cpu': sum(cpu for (_, _, cpu) in runs),
+            }
+
+        if len(times) > 0:
+            times_path = os.path.join(
+                self.path, f"pipeline.{self.pipeline_id}.json")
+            with open(times_path, 'w') as times_file:
+                json.dump(times, times_file)
+            written.append(times_path)
+
+        return written
+
+
+def clear_profiles(path):
+    """Remove profiles left in a directory by an earlier run"""
+    for pattern in ["pipeline.*.prof", "pipeline.*.json"]:
+        for profile_path in glob.glob(os.path.join(path, pattern)):
+            os.remove(profile_path)
+
+
+def merge_profiles(path, limit=25, logger=None):
+    """Merge the profiles of every pipeline into one report
+
+    The report lists the wall and CPU time of each stage across all
+    pipelines, followed by the functions of each stage with the most
+    cumulative wall time. Merged profiles of each stage are also written,
+    as stage.prof, for use with tools like snakeviz
+
+    Args:
+        path (str): Directory the pipelines wrote their profiles to
+        limit (int, optional): Functions listed per stage. Defaults to 25.
+        logger (Logger, optional): Defaults to None.
+
+    Returns:
+        str: Path of the report, or None if there were no profiles
+    """
+    if logger is None:
+        logger = logging.getLogger(__name__)
+
+    times = dict()
+    for times_path in sorted(glob.glob(
+            os.path.join(path, "pipeline.*.json"))):
+        try:
+            with open(times_path, 'r') as times_file:
+                pipeline_times = json.load(times_file)
+        except Exception:
+            logger.warning(f"Unable to read profile times {times_path}")
+            continue
+
+        for (stage, values) in pipeline_times.items():
+            stage_times = times.setdefault(
+                stage, {'threads': 0, 'wall': 0.0, 'cpu': 0.0})
+            for (name, value) in values.items():
+                stage_times[name] += value
+
+    if len(times) == 0:
+        return None
+
+    report = io.StringIO()
+    report.write(
+        f"{'Stage':<12}{'Threads':>8}{'Wall (s)':>12}{'CPU (s)':>12}"
+        f"{'CPU %':>8}\n"
+    )
+    for (stage, values) in sorted(times.items()):
+        cpu_percent = 0.0
+        if values['wall'] > 0:
+            cpu_percent = 100 * values['cpu'] / values['wall']
+        report.write(
+            f"{stage:<12}{values['threads']:>8}{values['wall']:>12.2f}"
+            f"{values['cpu']:>12.2f}{cpu_percent:>7.1f}%\n"
+        )
+
+    for stage in sorted(times):
+        stats = None
+        for stats_path in sorted(glob.glob(
+                os.path.join(path, f"pipeline.*.{stage}.prof"))):
+            try:
+                if stats is None:
+                    stats = pstats.Stats(stats_path, stream=report)
+                else:
+                    stats.add(stats_path)
+            except Exception:
+                logger.warning(f"Unable to read profile {stats_path}")
+        if stats is None:
+            continue
+
+        stats.dump_stats(os.path.join(path, f"{stage}.prof"))
+        report.write(f"\n{stage} (wall time)\n")
+        stats.sort_stats('cumulative').print_stats(limit)
+
+    report_path = os.path.join(path, "report.txt")
+    with open(report_path, 'w') as report_file:
+        report_file.write(report.getvalue())
+
+    return report_path
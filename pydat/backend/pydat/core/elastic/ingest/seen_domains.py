@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+import math
+import hashlib
+from collections import deque
+from threading import Lock
+
+
+# Ways a pipeline can remember the domains it has already seen
+DEDUP_MODES = ['off', 'exact', 'bloom']
+
+# Results of SeenDomains.check
+NEW = 0
+DUPLICATE = 1
+MAYBE = 2
+
+
+class BloomFilter:
+    """Fixed size probabilistic set of strings
+
+    Lookups never give false negatives, but can give false positives at
+    roughly the requested error rate once 'capacity' items were added.
+    The bits can be kept in a caller provided buffer, e.g., shared memory
+    """
+
+    def __init__(self, capacity, error_rate=0.001, buffer=None):
+        if capacity <= 0:
+            raise ValueError("Capacity must be greater than 0")
+        if not 0 < error_rate < 1:
+            raise ValueError("Error rate must be between 0 and 1")
+
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = self._num_bits(capacity, error_rate)
+        self.num_hashes = max(1, int(round(
+            (self.num_bits / capacity) * math.log(2))))
+        if buffer is None:
+            self.bits = bytearray(self.num_bytes(capacity, error_rate))
+        else:
+            self.bits = memoryview(buffer).cast('B')
+            if len(self.bits) != self.num_bytes(capacity, error_rate):
+                raise ValueError("Buffer does not match the filter size")
+
+    @staticmethod
+    def _num_bits(capacity, error_rate):
+        return max(8, int(math.ceil(
+            -capacity * math.log(error_rate) / (math.log(2) ** 2))))
+
+    @classmethod
+    def num_bytes(cls, capacity, error_rate=0.001):
+        """Size in bytes of the filter for the given parameters
+        """
+        return (cls._num_bits(capacity, error_rate) + 7) // 8
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(
+            item.encode('utf-8', 'surrogateescape'), digest_size=16
+        ).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.num_hashes):
+            yield (first + i * second) % self.num_bits
+
+    def add(self, item):
+        """Add an item to the filter
+
+        Returns:
+            bool: True if the item may already have been in the filter
+        """
+        present = True
+        for position in self._positions(item):
+            mask = 1 << (position & 7)
+            if not self.bits[position >> 3] & mask:
+                present = False
+                self.bits[position >> 3] |= mask
+        return present
+
+    def __contains__(self, item):
+        for position in self._positions(item):
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class SeenDomains:
+    """Per-run record of the documents a pipeline has already handled
+
+    Shared between the fetchers of a pipeline so a domain that appears
+    more than once in the data is only fetched and written once.
+
+    In 'exact' mode every document id is kept in a set. In 'bloom' mode a
+    BloomFilter bounds memory use; a positive is confirmed against an exact
+    window of recently seen ids, which covers every document still making
+    its way through the pipeline, and anything older is reported as
+    MAYBE so the caller can fall back to fetching it from elasticsearch.
+    """
+
+    def __init__(self, mode='exact', capacity=10000000, window=100000):
+        if mode not in DEDUP_MODES or mode == 'off':
+            raise ValueError(f"Unsupported dedup mode '{mode}'")
+
+        self.mode = mode
+        self._lock = Lock()
+        if mode == 'exact':
+            self._seen = set()
+        else:
+            self._bloom = BloomFilter(capacity)
+            self._recent = set()
+            self._recent_order = deque()
+            self._window = window
+
+    def check(self, doc_id):
+        """Record a document id, reporting whether it was seen before
+
+        Args:
+            doc_id (str): The document id of the domain
+
+        Returns:
+            int: NEW if the id is new to this run, DUPLICATE if it was
+                already seen, or MAYBE if it cannot be ruled out
+        """
+        with self._lock:
+            if self.mode == 'exact':
+                if doc_id in self._seen:
+                    return DUPLICATE
+                self._seen.add(doc_id)
+                return NEW
+
+            if doc_id in self._recent:
+                return DUPLICATE
+
+            self._recent.add(doc_id)
+            self._recent_order.append(doc_id)
+            if len(self._recent_order) > self._window:
+                self._recent.discard(self._recent_order.popleft())
+
+            if self._bloom.add(doc_id):
+                return MAYBE
+            return NEW
@@ -1,16 +1,39 @@
 #!/usr/bin/env python
 
-from threading import Thread
+from collections import Counter
+from threading import Thread, Lock
 from multiprocessing import Queue as mpQueue
 import queue
+import time
 
 
 class _StatTracker:
-    MAX_CHUNK_SIZE = 100
+    """Per-process stat client
+
+    Counts are aggregated locally and only the totals since the last flush
+    are sent to the StatTracker, either every FLUSH_INTERVAL seconds or
+    once MAX_CHUNK_SIZE events have been counted
+    """
+    MAX_CHUNK_SIZE = 10000
+    FLUSH_INTERVAL = 1.0  # seconds
 
     def __init__(self, queue):
         self._queue = queue
-        self._chunk = []
+        self._lock = Lock()
+        self._stats = Counter()
+        self._changed = Counter()
+        self._timings = Counter()
+        self._pending = 0
+        self._last_flush = time.time()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
 
     def __del__(self):
         try:
@@ -18,18 +41,56 @@ class _StatTracker:
         except Exception:
             pass
 
+    @property
+    def pending(self):
+        """Number of events counted since the last flush"""
+        return self._pending
+
     def flush(self):
-        self._queue.put(self._chunk)
-        self._chunk = []
+        with self._lock:
+            chunk = (
+                [('stat', field, count)
+                 for (field, count) in self._stats.items()] +
+                [('chn', field, count)
+                 for (field, count) in self._changed.items()] +
+                [('time', field, seconds)
+                 for (field, seconds) in self._timings.items()]
+            )
+            self._stats.clear()
+            self._changed.clear()
+            self._timings.clear()
+            self._pending = 0
+            self._last_flush = time.time()
+
+        if chunk:
+            self._queue.put(chunk)
+
+    def _counted(self):
+        self._pending += 1
+        if (self._pending >= self.MAX_CHUNK_SIZE or
+                time.time() - self._last_flush >= self.FLUSH_INTERVAL):
+            return True
+        return False
 
     def addChanged(self, field):
-        self._chunk.append(('chn', field))
-        if len(self._chunk) >= self.MAX_CHUNK_SIZE:
+        with self._lock:
+            self._changed[field] += 1
+            flush = self._counted()
+        if flush:
             self.flush()
 
     def incr(self, field):
-        self._chunk.append(('stat', field))
-        if len(self._chunk) >= self.MAX_CHUNK_SIZE:
+        with self._lock:
+            self._stats[field] += 1
+            flush = self._counted()
+        if flush:
+            self.flush()
+
+    def addTime(self, field, seconds):
+        with self._lock:
+            self._timings[field] += seconds
+            flush = self._counted()
+        if flush:
             self.flush()
 
 
@@ -51,6 +112,8 @@ class StatTracker(Thread):
         self._stat_queue = mpQueue()
         self._shutdown = False
         self._changed = dict()
+        # Seconds spent in different stages, not saved with the metadata
+        self._timings = dict()
         if logger is None:
             import logging
             self.logger = logging.getLogger(__name__)
@@ -88,6 +151,10 @@ class StatTracker(Thread):
     def changed_stats(self):
         return self._changed
 
+    @property
+    def timings(self):
+        return self._timings
+
     def seed(self, stats):
         self._stats.update(stats)
 
@@ -107,23 +174,29 @@ class StatTracker(Thread):
                     break
                 continue
 
-            for (typ, field) in chunk:
+            for (typ, field, value) in chunk:
                 if typ == 'stat':
                     if field not in self._stats:
                         self.logger.error("Unknown field %s" % field)
                     else:
-                        self._stats[field] += 1
+                        self._stats[field] += value
                 elif typ == 'chn':
                     if field not in self._changed:
                         self._changed[field] = 0
-                    self._changed[field] += 1
+                    self._changed[field] += value
+                elif typ == 'time':
+                    self._timings[field] = (
+                        self._timings.get(field, 0.0) + value)
                 else:
                     self.logger.error("Unknown stat type")
 
         self._stat_queue.close()
 
     def addChanged(self, field):
-        self._stat_queue.put([('chn', field)])
+        self._stat_queue.put([('chn', field, 1)])
 
     def incr(self, field):
-        self._stat_queue.put([('stat', field)])
+        self._stat_queue.put([('stat', field, 1)])
+
+    def addTime(self, field, seconds):
+        self._stat_queue.put([('time', field, seconds)])
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+import os
+import sqlite3
+import logging
+import threading
+
+
+# Columns of a record in the state store, in order
+RECORD_FIELDS = [
+    'id',
+    'version',
+    'idx',
+    'first_seen',
+    'date_first_seen',
+    'date_created',
+    'details_hash',
+]
+
+SCHEMA = [
+    (
+        "CREATE TABLE IF NOT EXISTS records ("
+        "id TEXT PRIMARY KEY, "
+        "version INTEGER, "
+        "idx TEXT, "
+        "first_seen INTEGER, "
+        "date_first_seen TEXT, "
+        "date_created TEXT, "
+        "details_hash TEXT"
+        ") WITHOUT ROWID"
+    ),
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+]
+
+
+class StateStore:
+    """On-disk record of the current state of every domain in the cluster
+
+    Holds, per document id, the current version, owning index, first seen
+    information and details fingerprint of each record so fetchers can
+    decide what changed without querying elasticsearch. The store is kept
+    up to date by the shippers as elasticsearch confirms writes.
+
+    The store tracks the version of the last import that kept it up to
+    date. If the cluster has moved on without it, e.g., an import was run
+    without the store, it must be rebuilt from the cluster before it can
+    be used again
+
+    Connections are opened per thread, so a store can be shared between
+    the threads of a process and handed to child processes
+    """
+    FILENAME = "state.sqlite3"
+    MMAP_SIZE = 1 << 30
+    TIMEOUT = 60  # seconds
+
+    def __init__(self, state_dir, logger=None):
+        self.path = os.path.join(state_dir, self.FILENAME)
+        self._local = threading.local()
+        if logger is None:
+            self.logger = logging.getLogger(__name__)
+        else:
+            self.logger = logger
+
+        os.makedirs(state_dir, exist_ok=True)
+        connection = self.connection
+        for statement in SCHEMA:
+            connection.execute(statement)
+        connection.commit()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_local'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.TIMEOUT)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(f"PRAGMA mmap_size={self.MMAP_SIZE}")
+            self._local.connection = connection
+        return connection
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def _get_meta(self, key):
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def _set_meta(self, **values):
+        with self.connection as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                [(key, str(value)) for (key, value) in values.items()]
+            )
+
+    @property
+    def version(self):
+        """Version of the last import that updated the store, or None"""
+        version = self._get_meta('version')
+        if version is None:
+            return None
+        return int(version)
+
+    @property
+    def complete(self):
+        """Whether the last import that updated the store finished"""
+        return self._get_meta('complete') == '1'
+
+    def usable(self, version, reingest=False):
+        """Check that the store matches the cluster for an import
+
+        Args:
+            version (int): The version being imported
+            reingest (bool): Whether the version is being reprocessed
+
+        Returns:
+            bool: True if the store can be used for the import
+        """
+        if reingest:
+            return self.version == version
+        return self.version == version - 1 and self.complete
+
+    def begin(self, version):
+        """Mark the store as being updated by an import"""
+        self._set_meta(version=version, complete=0)
+
+    def finish(self, version):
+        """Mark an import as having completely updated the store"""
+        self._set_meta(version=version, complete=1)
+
+    def clear(self):
+        with self.connection as connection:
+            connection.execute("DELETE FROM records")
+            connection.execute("DELETE FROM meta")
+
+    def lookup(self, doc_ids):
+        """Retrieve the records of a list of document ids
+
+        Args:
+            doc_ids (list): Document ids to look up
+
+        Returns:
+            dict: Record tuples, as per RECORD_FIELDS, keyed by document id,
+                ids without a record are omitted
+        """
+        if len(doc_ids) == 0:
+            return dict()
+
+        placeholders = ','.join('?' * len(doc_ids))
+        rows = self.connection.execute(
+            f"SELECT {','.join(RECORD_FIELDS)} FROM records "
+            f"WHERE id IN ({placeholders})",
+            list(doc_ids)
+        ).fetchall()
+        return {row[0]: row for row in rows}
+
+    def apply(self, records=None, updates=None, placeholders=None):
+        """Write changes confirmed by elasticsearch in one transaction
+
+        Args:
+            records (list, optional): Full record tuples, as per
+                RECORD_FIELDS, to insert or replace
+            updates (list, optional): (version, details_hash, id) tuples of
+                records whose contents were unchanged
+            placeholders (list, optional): (id, index) tuples of records
+                known to exist with unknown contents
+        """
+        with self.connection as connection:
+            if records:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO records VALUES "
+                    f"({','.join('?' * len(RECORD_FIELDS))})",
+                    records
+                )
+            if updates:
+                connection.executemany(
+                    "UPDATE records SET version = ?, details_hash = ? "
+                    "WHERE id = ?",
+                    updates
+                )
+            if placeholders:
+                connection.executemany(
+                    "INSERT OR IGNORE INTO records (id, idx) VALUES (?, ?)",
+                    placeholders
+                )
@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+
+import os
+import time
+import queue
+import logging
+from bisect import bisect_left
+from collections import Counter
+from threading import Thread, Lock
+from multiprocessing import Queue as mpQueue
+
+
+# Stages rows go through, in pipeline order
+STAGES = ['read', 'fetch', 'work', 'ship']
+# Queues rows wait in between stages, in pipeline order
+QUEUES = ['file', 'data', 'work', 'insert']
+# Requests whose latency and rejections are tracked
+REQUESTS = ['mget', 'bulk']
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = [
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+
+class _Histogram:
+    """Latency histogram with the fixed LATENCY_BUCKETS bounds
+
+    The last bucket counts observations above every bound
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def merge(self, other):
+        for (position, count) in enumerate(other.buckets):
+            self.buckets[position] += count
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q):
+        """Approximate a quantile as the bound of the bucket it falls in
+        """
+        if self.count == 0:
+            return 0.0
+
+        rank = q * self.count
+        seen = 0
+        for (position, count) in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count > 0:
+                break
+
+        if position >= len(LATENCY_BUCKETS):
+            return LATENCY_BUCKETS[-1]
+        return LATENCY_BUCKETS[position]
+
+
+class _TelemetryTracker:
+    """Per-process telemetry client
+
+    Like the stat client, values are aggregated locally and sent to the
+    Telemetry thread every FLUSH_INTERVAL seconds
+    """
+    FLUSH_INTERVAL = 1.0  # seconds
+
+    def __init__(self, queue, source):
+        self._queue = queue
+        self._source = source
+        self._lock = Lock()
+        self._counters = Counter()
+        self._histograms = dict()
+        self._depths = dict()
+        self._last_flush = time.time()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+    def flush(self):
+        with self._lock:
+            chunk = {
+                'source': self._source,
+                'counters': dict(self._counters),
+                'histograms': self._histograms,
+                'depths': self._depths,
+            }
+            self._counters = Counter()
+            self._histograms = dict()
+            self._depths = dict()
+            self._last_flush = time.time()
+
+        self._queue.put(chunk)
+
+    def _update(self):
+        if time.time() - self._last_flush >= self.FLUSH_INTERVAL:
+            self.flush()
+
+    def addRows(self, stage, count):
+        """Count rows that made it through a stage"""
+        with self._lock:
+            self._counters[('rows', stage)] += count
+        self._update()
+
+    def addRejected(self, request, count):
+        """Count actions or documents rejected by the cluster (HTTP 429)"""
+        with self._lock:
+            self._counters[('rejected', request)] += count
+        self._update()
+
+    def addBytes(self, count):
+        """Count bytes sent in bulk request bodies"""
+        with self._lock:
+            self._counters[('bytes', 'bulk')] += count
+        self._update()
+
+    def observe(self, request, seconds):
+        """Record the latency of a request"""
+        with self._lock:
+            histogram = self._histograms.get(request)
+            if histogram is None:
+                histogram = self._histograms[request] = _Histogram()
+            histogram.observe(seconds)
+        self._update()
+
+    def setDepth(self, name, depth):
+        """Record the number of items waiting in a queue"""
+        with self._lock:
+            self._depths[name] = depth
+        self._update()
+
+
+class Telemetry(Thread):
+    """Live ingest telemetry
+
+    Gathers row throughput per stage, queue depths, request latencies,
+    rejections and bytes shipped from every pipeline. Every interval a
+    summary line is logged and, if a path is given, the values are written
+    to it in the Prometheus text format, e.g., for the node exporter
+    textfile collector. Depths of the in-process queues are in rows, the
+    file queue depth is in files or file ranges
+
+    Args:
+        interval (float, optional): Seconds between reports. Defaults to 10.
+        path (str, optional): File to write Prometheus metrics to.
+            Defaults to None.
+        file_queue (Queue, optional): Queue of files waiting for the
+            pipelines, its depth is sampled when reporting.
+            Defaults to None.
+        logger (Logger, optional): Defaults to None.
+    """
+
+    def __init__(
+        self,
+        interval=10,
+        path=None,
+        file_queue=None,
+        logger=None,
+        **kwargs
+    ):
+        super().__init__(**kwargs)
+        self.daemon = True
+        self.interval = interval
+        self.path = path
+        self.file_queue = file_queue
+        self._queue = mpQueue()
+        self._shutdown = False
+        self._counters = Counter()
+        self._histograms = {request: _Histogram() for request in REQUESTS}
+        # Latest queue depths reported by each source
+        self._depths = dict()
+        # Counters and time of the last report, to compute rates
+        self._last_counters = Counter()
+        self._last_report = None
+        if logger is None:
+            self.logger = logging.getLogger(__name__)
+        else:
+            self.logger = logger
+
+    def get_tracker(self, source):
+        return _TelemetryTracker(self._queue, source)
+
+    @property
+    def rows(self):
+        return {stage: self._counters[('rows', stage)] for stage in STAGES}
+
+    @property
+    def rejected(self):
+        return {
+            request: self._counters[('rejected', request)]
+            for request in REQUESTS
+        }
+
+    @property
+    def bytes_shipped(self):
+        return self._counters[('bytes', 'bulk')]
+
+    @property
+    def depths(self):
+        """Items waiting in each queue, summed across pipelines"""
+        depths = {name: 0 for name in QUEUES}
+        for source_depths in self._depths.values():
+            for (name, depth) in source_depths.items():
+                depths[name] = depths.get(name, 0) + depth
+
+        if self.file_queue is not None:
+            try:
+                depths['file'] = self.file_queue.qsize()
+            except NotImplementedError:
+                pass
+
+        return depths
+
+    @property
+    def latency(self):
+        return self._histograms
+
+    def shutdown(self):
+        self._shutdown = True
+
+    def handle_chunk(self, chunk):
+        self._counters.update(chunk['counters'])
+        for (request, histogram) in chunk['histograms'].items():
+            if request not in self._histograms:
+                self._histograms[request] = _Histogram()
+            self._histograms[request].merge(histogram)
+        if len(chunk['depths']) > 0:
+            self._depths.setdefault(chunk['source'], {}).update(
+                chunk['depths'])
+
+    def summary(self, now=None):
+        """Summarize the values since the last summary in one line
+
+        Args:
+            now (float, optional): Time of the summary. Defaults to None,
+                the current time.
+
+        Returns:
+            str: The summary line
+        """
+        if now is None:
+            now = time.time()
+        if self._last_report is None:
+            elapsed = self.interval
+        else:
+            elapsed = max(now - self._last_report, 1e-6)
+
+        rates = list()
+        for stage in STAGES:
+            rows = (
+                self._counters[('rows', stage)] -
+                self._last_counters[('rows', stage)]
+            )
+            rates.append(f"{stage}={rows / elapsed:.0f}")
+        rates = " ".join(rates)
+        depths = " ".join(
+            f"{name}={depth}" for (name, depth) in self.depths.items())
+        latencies = " ".join(
+            f"{request} p50={histogram.quantile(.5) * 1000:.0f}ms "
+            f"p95={histogram.quantile(.95) * 1000:.0f}ms"
+            for (request, histogram) in self._histograms.items()
+        )
+        rejected = " ".join(
+            f"{request}={count}" for (request, count) in self.rejected.items())
+
+        self._last_counters = Counter(self._counters)
+        self._last_report = now
+
+        return (
+            f"rows/s {rates} | queued {depths} | {latencies} | "
+            f"rejected {rejected} | "
+            f"shipped {self.bytes_shipped / (1024 * 1024):.1f}MB"
+        )
+
+    def render(self):
+        """Render the values in the Prometheus text format
+
+        Returns:
+            str: The metrics
+        """
+        lines = [
+            "# HELP pydat_ingest_rows_total Rows through each ingest stage",
+            "# TYPE pydat_ingest_rows_total counter",
+        ]
+        for (stage, count) in self.rows.items():
+            lines.append(f'pydat_ingest_rows_total{{stage="{stage}"}} {count}')
+
+        lines.extend([
+            "# HELP pydat_ingest_queue_depth Items waiting in each queue",
+            "# TYPE pydat_ingest_queue_depth gauge",
+        ])
+        for (name, depth) in self.depths.items():
+            lines.append(f'pydat_ingest_queue_depth{{queue="{name}"}} {depth}')
+
+        lines.extend([
+            "# HELP pydat_ingest_rejected_total Items rejected by the cluster",
+            "# TYPE pydat_ingest_rejected_total counter",
+        ])
+        for (request, count) in self.rejected.items():
+            lines.append(
+                f'pydat_ingest_rejected_total{{request="{request}"}} {count}')
+
+        lines.extend([
+            "# HELP pydat_ingest_bulk_bytes_total Bytes sent in bulk requests",
+            "# TYPE pydat_ingest_bulk_bytes_total counter",
+            f"pydat_ingest_bulk_bytes_total {self.bytes_shipped}",
+            "# HELP pydat_ingest_request_seconds Request latency",
+            "# TYPE pydat_ingest_request_seconds histogram",
+        ])
+        for (request, histogram) in self._histograms.items():
+            cumulative = 0
+            for (bound, count) in zip(
+                    LATENCY_BUCKETS + ['+Inf'], histogram.buckets):
+                cumulative += count
+                lines.append((
+                    'pydat_ingest_request_seconds_bucket'
+                    f'{{request="{request}",le="{bound}"}} {cumulative}'
+                ))
+            lines.append((
+                'pydat_ingest_request_seconds_sum'
+                f'{{request="{request}"}} {histogram.sum}'
+            ))
+            lines.append((
+                'pydat_ingest_request_seconds_count'
+                f'{{request="{request}"}} {histogram.count}'
+            ))
+
+        return "\n".join(lines) + "\n"
+
+    def report(self):
+        self.logger.info(self.summary())
+        if self.path is None:
+            return
+
+        try:
+            # Written aside and moved so readers never see a partial file
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as metrics_file:
+                metrics_file.write(self.render())
+            os.replace(tmp_path, self.path)
+        except Exception:
+            self.logger.exception(
+                f"Unable to write telemetry to {self.path}")
+
+    def run(self):
+        self._last_report = time.time()
+        while 1:
+            try:
+                chunk = self._queue.get(True, 0.2)
+                self.handle_chunk(chunk)
+            except queue.Empty:
+                if self._shutdown:
+                    break
+
+            if time.time() - self._last_report >= self.interval:
+                self.report()
+
+        self.report()
+        self._queue.close()
@@ -22,8 +22,12 @@ class FlaskElasticHandler(SearchHandler):
             'cacert': elastic_config.get('cacert', None),
             'disable_sniffing': elastic_config.get('disable_sniffing', False),
             'indexPrefix':  elastic_config['indexPrefix'],
-            'max_retries': 100,
+            'max_retries': elastic_config.get('maxRetries', 100),
             'retry_on_timeout': True,
+            'timeout': elastic_config.get('timeout', 100),
+            'http_compress': elastic_config.get('httpCompress', False),
+            'connections_per_node': elastic_config.get(
+                'connectionsPerNode', None),
         }
 
     def init_app(self, app):
@@ -276,6 +276,7 @@ class SearchHandler(ElasticHandler):
                     ]
                 }
             },
+            "_source": self._source_filter(),
             "size": 100
         }
 
@@ -403,6 +404,23 @@ class SearchHandler(ElasticHandler):
 
         return domains
 
+    def _source_filter(self, includes=None):
+        """Source filtering for the records returned by searches
+
+        The details fingerprint is only used by the ingest, so it is left out
+
+        Args:
+            includes (list, optional): Fields to restrict records to.
+                Defaults to None.
+
+        Returns:
+            dict: The '_source' search option
+        """
+        source = {"excludes": [self.metadata_key_map.DETAILS_HASH]}
+        if includes:
+            source["includes"] = includes
+        return source
+
     def _flatten_records(self, records):
         out_records = []
 
@@ -484,8 +502,7 @@ class SearchHandler(ElasticHandler):
             query["sort"] = [{
                 self.metadata_key_map.VERSION_KEY: {"order": "asc"}
             }]
-        if es_source:
-            query["_source"] = es_source
+        query["_source"] = self._source_filter(es_source)
 
         return query
 
@@ -549,6 +566,7 @@ class SearchHandler(ElasticHandler):
                 q["sort"] = sortParams
                 q["size"] = size
                 q["from"] = skip
+                q["_source"] = self._source_filter()
             else:
                 q["size"] = 0
                 q["aggs"] = {
@@ -561,6 +579,7 @@ class SearchHandler(ElasticHandler):
                             "max_score": {"max": {"script": "_score"}},
                             "top_domains": {
                                 "top_hits": {
+                                    "_source": self._source_filter(),
                                     "size": 1,
                                     "sort": [
                                         {"_score": {"order": "desc"}},
@@ -54,6 +54,26 @@ ELASTIC_SCHEMA = {
         "type": "integer",
         "default": 50000000
     },
+    "http_compress": {
+        "type": "boolean",
+        "default": False
+    },
+    "connections_per_node": {
+        "type": "integer",
+        "min": 1,
+        "nullable": True,
+        "default": None
+    },
+    "max_retries": {
+        "type": "integer",
+        "min": 0,
+        "default": 100
+    },
+    "timeout": {
+        "type": "integer",
+        "min": 1,
+        "default": 100
+    },
 }
 
 CONFIG_SCHEMA = {
@@ -76,10 +96,61 @@ CONFIG_SCHEMA = {
         "type": "boolean",
         "default": False
     },
+    "telemetry_interval": {
+        "type": "integer",
+        "min": 0,
+        "default": 0
+    },
+    "telemetry_file": {
+        "type": "string",
+        "nullable": True,
+        "default": None
+    },
+    "profile_dir": {
+        "type": "string",
+        "nullable": True,
+        "default": None
+    },
+    "emit_dir": {
+        "type": "string",
+        "nullable": True,
+        "default": None
+    },
     "extension": {
         "type": "string",
         "default": "csv"
     },
+    "state_dir": {
+        "type": "string",
+        "nullable": True,
+        "default": None
+    },
+    "index_filters": {
+        "type": "boolean",
+        "default": False
+    },
+    "state_store": {
+        "type": "boolean",
+        "default": False
+    },
+    "bulk_load": {
+        "type": "boolean",
+        "default": False
+    },
+    "bulk_load_async_translog": {
+        "type": "boolean",
+        "default": False
+    },
+    "state_store_slices": {
+        "type": "integer",
+        "min": 1,
+        "default": 4
+    },
+    "replay_streams": {
+        "type": "integer",
+        "min": 1,
+        "default": 4
+    },
     # data populator
     "include": {
         "type": "list",
@@ -112,6 +183,11 @@ CONFIG_SCHEMA = {
         "type": "integer",
         "default": 2
     },
+    "worker_threads": {
+        "type": "integer",
+        "min": 1,
+        "default": 1
+    },
     "bulk_fetch_size": {
         "type": "integer",
         "default": 50
@@ -120,6 +196,50 @@ CONFIG_SCHEMA = {
         "type": "integer",
         "default": 10
     },
+    "bulk_ship_mb": {
+        "type": "integer",
+        "min": 0,
+        "default": 5
+    },
+    "bulk_ship_inflight": {
+        "type": "integer",
+        "min": 1,
+        "default": 1
+    },
+    "pre_encode": {
+        "type": "boolean",
+        "default": False
+    },
+    "split_size": {
+        "type": "integer",
+        "min": 0,
+        "default": 0
+    },
+    "schedule": {
+        "type": "string",
+        "allowed": ["name", "size"],
+        "default": "name"
+    },
+    "dedup": {
+        "type": "string",
+        "allowed": ["off", "exact", "bloom"],
+        "default": "off"
+    },
+    "dedup_capacity": {
+        "type": "integer",
+        "min": 1,
+        "default": 10000000
+    },
+    "batch_size": {
+        "type": "integer",
+        "min": 1,
+        "default": 500
+    },
+    "reader_backend": {
+        "type": "string",
+        "allowed": ["csv", "arrow"],
+        "default": "csv"
+    },
     # elastic
     "es": {
         "type": "dict",
@@ -201,7 +321,20 @@ def generate_parser():
         dest="extension",
         help=(
             "When scanning for CSV files only parse files with given "
-            "extension (default: csv)"
+            "extension, ignoring any compression suffix such as .gz, .bz2, "
+            ".xz or .zst (default: csv)"
+        ),
+    )
+
+    parser.add_argument(
+        "--state-dir",
+        default=argparse.SUPPRESS,
+        dest="state_dir",
+        help=(
+            "Directory to keep local ingest state in. When set, progress "
+            "through each file is checkpointed so an interrupted import "
+            "can be resumed with '--redo' without reprocessing completed "
+            "files"
         ),
     )
 
@@ -223,6 +356,52 @@ def generate_parser():
         help="Print out Stats after running"
     )
 
+    parser.add_argument(
+        "--telemetry-interval",
+        type=int,
+        dest="telemetry_interval",
+        default=argparse.SUPPRESS,
+        help=(
+            "Log a summary of rows per second through each stage, queue "
+            "depths, request latencies and rejections every N seconds "
+            "while ingesting (default: 0, disabled)"
+        )
+    )
+
+    parser.add_argument(
+        "--telemetry-file",
+        dest="telemetry_file",
+        default=argparse.SUPPRESS,
+        help=(
+            "Also write the telemetry to this file in the Prometheus text "
+            "format every interval (requires --telemetry-interval)"
+        )
+    )
+
+    parser.add_argument(
+        "--profile",
+        dest="profile_dir",
+        default=argparse.SUPPRESS,
+        help=(
+            "Profile the threads of every pipeline and write the profiles "
+            "to this directory, along with a report of the wall and CPU "
+            "time of each stage and its slowest functions. Profiling "
+            "slows the ingest down"
+        )
+    )
+
+    parser.add_argument(
+        "--emit-bulk",
+        dest="emit_dir",
+        default=argparse.SUPPRESS,
+        help=(
+            "Write the bulk requests to compressed NDJSON files in this "
+            "directory instead of sending them to ElasticSearch, the "
+            "cluster is still read to compare records. Load the files "
+            "with --replay-bulk before ingesting the next version"
+        )
+    )
+
     # Performance Related Options
     performance = parser.add_argument_group("Performance Options")
 
@@ -261,6 +440,19 @@ def generate_parser():
         ),
     )
 
+    performance.add_argument(
+        "--worker-threads",
+        action="store",
+        dest="worker_threads",
+        type=int,
+        default=argparse.SUPPRESS,
+        help=(
+            "How many threads per pipeline to spawn to compare records and "
+            "build the bulk requests, every domain is always handled by "
+            "the same thread, defaults to 1"
+        ),
+    )
+
     performance.add_argument(
         "--bulk-ship-size",
         type=int,
@@ -269,6 +461,40 @@ def generate_parser():
         help="Size of Bulk Elasticsearch Requests (default: 10)"
     )
 
+    performance.add_argument(
+        "--bulk-ship-mb",
+        type=int,
+        dest="bulk_ship_mb",
+        default=argparse.SUPPRESS,
+        help=(
+            "Target payload size in megabytes of Bulk Elasticsearch "
+            "Requests, a request is sent once it reaches either this or "
+            "the bulk ship size, 0 disables (default: 5)"
+        )
+    )
+
+    performance.add_argument(
+        "--bulk-ship-inflight",
+        type=int,
+        dest="bulk_ship_inflight",
+        default=argparse.SUPPRESS,
+        help=(
+            "Number of Bulk Elasticsearch Requests each shipper thread keeps "
+            "in flight at once (default: 1)"
+        )
+    )
+
+    performance.add_argument(
+        "--pre-encode",
+        action="store_true",
+        dest="pre_encode",
+        default=argparse.SUPPRESS,
+        help=(
+            "Encode bulk requests in the worker thread instead of the "
+            "shipper threads, uses orjson if installed"
+        )
+    )
+
     performance.add_argument(
         "--bulk-fetch-size",
         type=int,
@@ -282,6 +508,150 @@ def generate_parser():
          )
      )
 
+    performance.add_argument(
+        "--split-size",
+        type=int,
+        dest="split_size",
+        default=argparse.SUPPRESS,
+        help=(
+            "Split uncompressed files larger than this many megabytes into "
+            "ranges that can be processed by different pipelines, requires "
+            "that every csv record be on a single line (default: 0, disabled)"
+        )
+    )
+
+    performance.add_argument(
+        "--schedule",
+        choices=["name", "size"],
+        dest="schedule",
+        default=argparse.SUPPRESS,
+        help=(
+            "Order to process files (or split ranges) in, 'name' goes in "
+            "sorted-name order while 'size' processes the largest first to "
+            "shorten the tail end of an import (default: name)"
+        )
+    )
+
+    performance.add_argument(
+        "--batch-size",
+        type=int,
+        dest="batch_size",
+        default=argparse.SUPPRESS,
+        help=(
+            "Number of rows handed between the stages of a pipeline at a "
+            "time (default: 500)"
+        )
+    )
+
+    performance.add_argument(
+        "--reader-backend",
+        choices=["csv", "arrow"],
+        dest="reader_backend",
+        default=argparse.SUPPRESS,
+        help=(
+            "CSV parser to use, 'arrow' parses and validates blocks of rows "
+            "with pyarrow and falls back to 'csv' if pyarrow is not "
+            "installed (default: csv)"
+        )
+    )
+
+    performance.add_argument(
+        "--dedup",
+        choices=["off", "exact", "bloom"],
+        dest="dedup",
+        default=argparse.SUPPRESS,
+        help=(
+            "Drop domains a pipeline already handled before they are "
+            "fetched, 'exact' keeps every domain in memory while 'bloom' "
+            "uses a fixed size filter and checks possible repeats against "
+            "Elasticsearch (default: off)"
+        )
+    )
+
+    performance.add_argument(
+        "--dedup-capacity",
+        type=int,
+        dest="dedup_capacity",
+        default=argparse.SUPPRESS,
+        help=(
+            "Number of domains per pipeline the bloom filter is sized for "
+            "(default: 10000000)"
+        )
+    )
+
+    performance.add_argument(
+        "--index-filters",
+        action="store_true",
+        dest="index_filters",
+        default=argparse.SUPPRESS,
+        help=(
+            "Keep a bloom filter of the document ids in each data index, in "
+            "the state directory, so lookups only ask the indices that may "
+            "hold a domain. Filters are built by scanning an index the "
+            "first time and whenever it changed outside of an import "
+            "(requires --state-dir)"
+        )
+    )
+
+    performance.add_argument(
+        "--state-store",
+        action="store_true",
+        dest="state_store",
+        default=argparse.SUPPRESS,
+        help=(
+            "Keep the version, index and details fingerprint of every "
+            "record in a local database in the state directory and use it "
+            "instead of fetching records from Elasticsearch. Build it from "
+            "an existing cluster with --rebuild-state-store "
+            "(requires --state-dir)"
+        )
+    )
+
+    performance.add_argument(
+        "--bulk-load",
+        action="store_true",
+        dest="bulk_load",
+        default=argparse.SUPPRESS,
+        help=(
+            "Disable refreshes and replicas on the write indices while "
+            "importing, the template settings are restored at the end of "
+            "the import, useful for first imports and large reingests"
+        )
+    )
+
+    performance.add_argument(
+        "--bulk-load-async-translog",
+        action="store_true",
+        dest="bulk_load_async_translog",
+        default=argparse.SUPPRESS,
+        help=(
+            "With --bulk-load, also fsync the translog in the background, "
+            "recently written documents can be lost if a node fails"
+        )
+    )
+
+    performance.add_argument(
+        "--state-store-slices",
+        type=int,
+        dest="state_store_slices",
+        default=argparse.SUPPRESS,
+        help=(
+            "Number of parallel scroll slices used to rebuild the state "
+            "store (default: 4)"
+        )
+    )
+
+    performance.add_argument(
+        "--replay-streams",
+        type=int,
+        dest="replay_streams",
+        default=argparse.SUPPRESS,
+        help=(
+            "Number of bulk files loaded at once by --replay-bulk, each "
+            "with its own stream of bulk requests (default: 4)"
+        )
+    )
+
     # Elastic-related options
     elastic_options = parser.add_argument_group("Elasticsearch Options")
 
@@ -352,6 +722,45 @@ def generate_parser():
         ),
     )
 
+    elastic_options.add_argument(
+        "--es-http-compress",
+        action="store_true",
+        dest="es_http_compress",
+        default=argparse.SUPPRESS,
+        help="Compress the bodies of requests sent to ElasticSearch"
+    )
+
+    elastic_options.add_argument(
+        "--es-connections-per-node",
+        type=int,
+        dest="es_connections_per_node",
+        default=argparse.SUPPRESS,
+        help=(
+            "Number of connections each pipeline keeps open to each "
+            "ElasticSearch node, defaults to enough for the fetcher and "
+            "shipper threads"
+        ),
+    )
+
+    elastic_options.add_argument(
+        "--es-max-retries",
+        type=int,
+        dest="es_max_retries",
+        default=argparse.SUPPRESS,
+        help=(
+            "Number of times a failed ElasticSearch request is retried "
+            "(default: 100)"
+        ),
+    )
+
+    elastic_options.add_argument(
+        "--es-timeout",
+        type=int,
+        dest="es_timeout",
+        default=argparse.SUPPRESS,
+        help="Timeout in seconds of ElasticSearch requests (default: 100)",
+    )
+
     # Elastic Command Line Only Options
     elastic_options.add_argument(
         "--ask-pass",
@@ -391,6 +800,27 @@ def generate_parser():
         help="Clear the interrupted flag, forcefully (NOT RECOMMENDED)",
     )
 
+    runmode.add_argument(
+        "--rebuild-state-store",
+        action="store_true",
+        default=False,
+        dest="rebuild_state_store",
+        help=(
+            "Rebuild the local state store (see --state-store) from the "
+            "data in the cluster and then exit"
+        ),
+    )
+
+    runmode.add_argument(
+        "--replay-bulk",
+        default=None,
+        dest="replay_dir",
+        help=(
+            "Load the bulk files written to this directory with "
+            "--emit-bulk into ElasticSearch and then exit"
+        ),
+    )
+
     input_source = parser.add_mutually_exclusive_group()
 
     input_source.add_argument(
@@ -565,7 +995,9 @@ def process_additional_configuration(
     if not any([
         configuration.redo,
         configuration.config_template_only,
-        configuration.clear_interrupted
+        configuration.clear_interrupted,
+        configuration.rebuild_state_store,
+        configuration.replay_dir,
     ]) and not any([
         configuration.ingest_file,
         configuration.ingest_directory
@@ -594,8 +1026,37 @@ def main():
         "disable_sniffing": elastic_configuration.disable_sniffing,
         "indexPrefix": elastic_configuration.index_prefix,
         "rollover_size": elastic_configuration.rollover_docs,
+        "http_compress": elastic_configuration.http_compress,
+        "max_retries": elastic_configuration.max_retries,
+        "timeout": elastic_configuration.timeout,
+        "connections_per_node": elastic_configuration.connections_per_node,
     }
 
+    if elastic_arguments["connections_per_node"] is None:
+        # Every fetcher and in flight bulk request of a pipeline may need
+        # a connection at once, never go below the client default of 10
+        elastic_arguments["connections_per_node"] = max(10, (
+            configuration.fetcher_threads +
+            configuration.shipper_threads * configuration.bulk_ship_inflight
+        ), configuration.replay_streams * configuration.bulk_ship_inflight)
+
+    if configuration.index_filters and configuration.state_dir is None:
+        logger.error("Index filters require a state directory (--state-dir)")
+        sys.exit(1)
+
+    if ((configuration.state_store or configuration.rebuild_state_store)
+            and configuration.state_dir is None):
+        logger.error(
+            "The state store requires a state directory (--state-dir)")
+        sys.exit(1)
+
+    if (configuration.telemetry_file is not None
+            and not configuration.telemetry_interval):
+        logger.error(
+            "A telemetry file requires a telemetry interval "
+            "(--telemetry-interval)")
+        sys.exit(1)
+
     data_populator = DataPopulator(
         elastic_args=elastic_arguments,
         include_fields=configuration.include,
@@ -609,8 +1070,27 @@ def main():
         comment=configuration.comment,
         bulk_fetch_size=configuration.bulk_fetch_size,
         bulk_ship_size=configuration.bulk_ship_size,
+        bulk_ship_bytes=configuration.bulk_ship_mb * 1024 * 1024,
+        bulk_ship_inflight=configuration.bulk_ship_inflight,
+        pre_encode=configuration.pre_encode,
         num_shipper_threads=configuration.shipper_threads,
         num_fetcher_threads=configuration.fetcher_threads,
+        num_worker_threads=configuration.worker_threads,
+        split_size=configuration.split_size * 1024 * 1024,
+        schedule=configuration.schedule,
+        batch_size=configuration.batch_size,
+        reader_backend=configuration.reader_backend,
+        index_filters=configuration.index_filters,
+        state_store=configuration.state_store,
+        bulk_load=configuration.bulk_load,
+        async_translog=configuration.bulk_load_async_translog,
+        telemetry_interval=configuration.telemetry_interval,
+        telemetry_file=configuration.telemetry_file,
+        profile_dir=configuration.profile_dir,
+        emit_dir=configuration.emit_dir,
+        dedup=configuration.dedup,
+        dedup_capacity=configuration.dedup_capacity,
+        state_dir=configuration.state_dir,
         verbose=configuration.verbose,
         debug=configuration.debug,
     )
@@ -623,6 +1103,31 @@ def main():
         data_populator.clearInterrupted()
         sys.exit(0)
 
+    if configuration.rebuild_state_store:
+        try:
+            data_populator.rebuildStateStore(
+                slices=configuration.state_store_slices)
+        except (InterruptedImportError, NoDataError) as e:
+            logger.error(str(e))
+            sys.exit(1)
+        except Exception:
+            logger.exception("Unable to rebuild state store")
+            sys.exit(1)
+        sys.exit(0)
+
+    if configuration.replay_dir is not None:
+        try:
+            data_populator.replayBulk(
+                configuration.replay_dir,
+                streams=configuration.replay_streams)
+        except (InterruptedImportError, NoDataError, MetadataError) as e:
+            logger.error(str(e))
+            sys.exit(1)
+        except Exception:
+            logger.exception("Unable to replay bulk files")
+            sys.exit(1)
+        sys.exit(0)
+
     try:
         if not configuration.redo:
             data_populator.ingest()
@@ -651,6 +1156,12 @@ def main():
             f"Duplicate Entries\t {stats.duplicates}\n"
             f"Unchanged Entries:\t {stats.unchanged}\n"
         ))
+        timings = stats.timings
+        print((
+            "Serialization Time:\n"
+            f"Worker:\t\t\t {timings.get('worker_serialize', 0.0):.2f}s\n"
+            f"Shipper:\t\t {timings.get('shipper_serialize', 0.0):.2f}s\n"
+        ))
 
 
 if __name__ == "__main__":
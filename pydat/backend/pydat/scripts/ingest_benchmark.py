@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+import sys
+import json
+import argparse
+
+from pydat.core.elastic.ingest.benchmark import SCENARIOS, run_scenarios
+from pydat.core.elastic.ingest.benchmark.runner import STAGES
+
+
+def _get_argparser():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Measure the throughput of each ingest stage on synthetic WHOIS "
+            "data, using an in-process stand-in for Elasticsearch"
+        )
+    )
+
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=SCENARIOS,
+        dest="scenarios",
+        default=None,
+        help="Scenario to run, can be repeated (default: all)"
+    )
+
+    parser.add_argument(
+        "--rows",
+        type=int,
+        dest="rows",
+        default=10000,
+        help="Number of domains in the first version (default: 10000)"
+    )
+
+    parser.add_argument(
+        "--duplicate-rate",
+        type=float,
+        dest="duplicate_rate",
+        default=0.01,
+        help="Fraction of rows repeated within a file (default: 0.01)"
+    )
+
+    parser.add_argument(
+        "--change-rate",
+        type=float,
+        dest="change_rate",
+        default=0.1,
+        help=(
+            "Fraction of domains changed in each version after the first "
+            "(default: 0.1)"
+        )
+    )
+
+    parser.add_argument(
+        "--new-rate",
+        type=float,
+        dest="new_rate",
+        default=0.05,
+        help=(
+            "New domains in each version after the first, as a fraction of "
+            "--rows (default: 0.05)"
+        )
+    )
+
+    parser.add_argument(
+        "--seed",
+        type=int,
+        dest="seed",
+        default=0,
+        help="Seed of the synthetic data (default: 0)"
+    )
+
+    parser.add_argument(
+        "--mget-latency",
+        type=float,
+        dest="mget_latency",
+        default=0,
+        help="Milliseconds added to every mget request (default: 0)"
+    )
+
+    parser.add_argument(
+        "--bulk-latency",
+        type=float,
+        dest="bulk_latency",
+        default=0,
+        help="Milliseconds added to every bulk request (default: 0)"
+    )
+
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        dest="batch_size",
+        default=500,
+        help="Rows per batch passed between stages (default: 500)"
+    )
+
+    parser.add_argument(
+        "--bulk-fetch-size",
+        type=int,
+        dest="bulk_fetch_size",
+        default=50,
+        help="Documents per mget request (default: 50)"
+    )
+
+    parser.add_argument(
+        "--bulk-ship-size",
+        type=int,
+        dest="bulk_ship_size",
+        default=1000,
+        help="Actions per bulk request (default: 1000)"
+    )
+
+    parser.add_argument(
+        "--dedup",
+        choices=["off", "exact", "bloom"],
+        dest="dedup",
+        default="off",
+        help=(
+            "How repeated domains are dropped before being fetched, as "
+            "with pydat-populator --dedup (default: off)"
+        )
+    )
+
+    parser.add_argument(
+        "--pre-encode",
+        action="store_true",
+        dest="pre_encode",
+        default=False,
+        help="Encode bulk requests in the worker stage"
+    )
+
+    parser.add_argument(
+        "--workdir",
+        dest="workdir",
+        default=None,
+        help=(
+            "Directory to write the synthetic csv files to, they are "
+            "reused by later runs with the same settings (default: a "
+            "temporary directory)"
+        )
+    )
+
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        dest="json",
+        default=False,
+        help="Print the results as JSON"
+    )
+
+    return parser
+
+
+def main():
+    options = vars(_get_argparser().parse_args())
+    as_json = options.pop("json")
+    options["mget_latency"] /= 1000
+    options["bulk_latency"] /= 1000
+
+    results = run_scenarios(**options)
+
+    if as_json:
+        json.dump(
+            [result.as_dict() for result in results], sys.stdout, indent=2)
+        print()
+        return
+
+    for result in results:
+        print(
+            f"\n{result.scenario}: {result.stages['read'].rows} rows in "
+            f"{result.seconds:.2f}s, {result.rate:.0f} rows/s"
+        )
+        print(f"{'Stage':<8}{'Rows':>10}{'Seconds':>10}{'Rows/s':>12}")
+        for name in STAGES:
+            stage = result.stages[name]
+            print(
+                f"{name:<8}{stage.rows:>10}{stage.seconds:>10.2f}"
+                f"{stage.rate:>12.0f}"
+            )
+        stats = result.stats
+        print((
+            f"new={stats['new']} updated={stats['updated']} "
+            f"unchanged={stats['unchanged']} "
+            f"duplicates={stats['duplicates']} "
+            f"mget={result.requests['mget']} bulk={result.requests['bulk']} "
+            f"dedup={result.options['dedup']}"
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,11 @@ setup(
         "requests",
         "pyyaml"
         ],
+    extras_require={
+        "zstd": ["zstandard"],
+        "arrow": ["pyarrow>=7.0.0"],
+        "orjson": ["orjson"],
+    },
     tests_require=[
         "pytest",
         "pytest-cov",
@@ -26,7 +31,8 @@ setup(
     entry_points={
         "console_scripts": [
             "pydat-dev-server = pydat.scripts.api:main",
-            "pydat-populator = pydat.scripts.elasticsearch_populate:main"
+            "pydat-populator = pydat.scripts.elasticsearch_populate:main",
+            "pydat-ingest-benchmark = pydat.scripts.ingest_benchmark:main",
         ]
     },
 )
@@ -1,6 +1,7 @@
 import pytest
 from unittest import mock
 from pydat.core.elastic import ElasticHandler
+from pydat.core.elastic.search.search_handler import SearchHandler
 import elasticsearch
 
 
@@ -22,6 +23,22 @@ def test_handler_security_args():
     assert elastic_handler.elastic_args["ca_certs"] == "test"
 
 
+def test_handler_connection_args():
+    elastic_handler = ElasticHandler("localhost:9200")
+    assert elastic_handler.elastic_args["max_retries"] == 100
+    assert elastic_handler.elastic_args["timeout"] == 100
+    assert not elastic_handler.elastic_args["http_compress"]
+    assert "maxsize" not in elastic_handler.elastic_args
+
+    elastic_handler = ElasticHandler(
+        "localhost:9200", max_retries=3, timeout=10, http_compress=True,
+        connections_per_node=32)
+    assert elastic_handler.elastic_args["max_retries"] == 3
+    assert elastic_handler.elastic_args["timeout"] == 10
+    assert elastic_handler.elastic_args["http_compress"]
+    assert elastic_handler.elastic_args["maxsize"] == 32
+
+
 def test_get_version(monkeypatch):
     fake_connect = mock.Mock()
     fake_connect.return_value.cat.nodes.return_value = "7.0\n7.10\n"
@@ -54,3 +71,26 @@ def test_check_version(monkeypatch):
         monkey.setattr(elasticsearch, 'VERSION', ["6", "0"])
         with pytest.raises(RuntimeError):
             elastic_handler.checkVersion()
+
+
+def test_search_excludes_details_hash(monkeypatch):
+    search_handler = SearchHandler(None, hosts="localhost:9200")
+    fake_connect = mock.MagicMock()
+    monkeypatch.setattr(search_handler, "connect", fake_connect)
+    es = fake_connect.return_value
+    es.search.return_value = {"hits": {"total": {"value": 0}, "hits": []}}
+
+    search_handler.search("domainName", "mitre.org", filt="domainName")
+    assert es.search.call_args[1]["body"]["_source"] == {
+        "includes": ["domainName"],
+        "excludes": ["detailsHash"],
+    }
+
+    search_handler.getLatest("domainName", "mitre.org")
+    assert es.search.call_args[1]["body"]["_source"] == {
+        "excludes": ["detailsHash"]}
+
+    query = search_handler._create_advanced_query(
+        "domainName:mitre.org", 0, 20, True)
+    top_hits = query["aggs"]["domains"]["aggs"]["top_domains"]["top_hits"]
+    assert top_hits["_source"] == {"excludes": ["detailsHash"]}
@@ -0,0 +1,44 @@
+import pytest
+from unittest import mock
+
+from pydat.core.elastic.ingest.adaptive import (
+    AdaptiveBatchSize,
+    RetriesExhausted,
+)
+
+
+def test_adaptive_batch_size():
+    controller = AdaptiveBatchSize(100, min_size=10, grow_after=2)
+    controller.rejected()
+    assert controller.size == 50
+    controller.rejected()
+    controller.rejected()
+    controller.rejected()
+    assert controller.size == 10
+
+    controller.succeeded()
+    assert controller.size == 10
+    controller.succeeded()
+    assert controller.size == 12
+
+    for _ in range(100):
+        controller.succeeded()
+    # Never grows past the configured size
+    assert controller.size == 100
+
+
+def test_adaptive_batch_size_delay():
+    controller = AdaptiveBatchSize(100, base_delay=1, max_delay=4)
+    for failures in range(1, 6):
+        controller.rejected()
+        ceiling = min(4, 2 ** (failures - 1))
+        with mock.patch('random.uniform', return_value=ceiling) as uniform:
+            assert controller.delay() == ceiling
+            uniform.assert_called_once_with(0, ceiling)
+
+
+def test_adaptive_batch_size_stop():
+    controller = AdaptiveBatchSize(100, should_stop=lambda: True)
+    controller.rejected()
+    with pytest.raises(RetriesExhausted):
+        controller.backoff()
@@ -0,0 +1,107 @@
+import csv
+import json
+
+from pydat.core.elastic.ingest.benchmark import (
+    SyntheticWhois,
+    FakeElasticsearch,
+    IngestBenchmark,
+    run_scenarios,
+)
+from pydat.core.elastic.ingest.benchmark.synthetic import WHOIS_HEADER
+
+
+def test_synthetic_whois(tmp_path):
+    data = SyntheticWhois(100, duplicate_rate=0.1, change_rate=0.2,
+                          new_rate=0.1, seed=1)
+
+    path = tmp_path / "whois.csv"
+    count = data.write(str(path), 2)
+    with open(path, newline='') as csv_file:
+        rows = list(csv.reader(csv_file))
+
+    assert rows[0] == WHOIS_HEADER
+    assert len(rows) == count + 1
+    assert len(set(row[0] for row in rows[1:])) == data.domain_count(2) == 110
+    # Duplicates are repeated rows
+    assert count > 110
+
+    # Generation is deterministic and only changed domains differ
+    again = SyntheticWhois(100, duplicate_rate=0.1, change_rate=0.2,
+                           new_rate=0.1, seed=1)
+    assert [data.row(number, 2) for number in range(110)] == [
+        again.row(number, 2) for number in range(110)]
+    changed = [
+        number for number in range(100)
+        if data.row(number, 1) != data.row(number, 2)
+    ]
+    assert len(changed) == data.changed_count(2) > 0
+
+
+def test_fake_elastic():
+    es = FakeElasticsearch()
+
+    response = es.bulk(body=(
+        b'{"create":{"_index":"pydat-data-write","_id":"1"}}\n'
+        b'{"a":1,"details":{"b":1,"c":1}}\n'
+        b'{"create":{"_index":"pydat-data-write","_id":"1"}}\n'
+        b'{"a":2}\n'
+        b'{"update":{"_index":"pydat-data-000001","_id":"1"}}\n'
+        b'{"doc":{"details":{"b":2}}}\n'
+        b'{"update":{"_index":"pydat-data-000001","_id":"2"}}\n'
+        b'{"doc":{"a":1}}\n'
+    ))
+    assert [
+        list(item.values())[0]['status'] for item in response['items']
+    ] == [201, 409, 200, 404]
+    assert response['items'][0]['create']['_index'] == "pydat-data-000001"
+
+    docs = es.mget(body={'docs': [
+        {'_index': 'pydat-data-000001', '_id': '1', '_source': ['a']},
+        {'_index': 'pydat-data-000001', '_id': '1'},
+        {'_index': 'pydat-data-000001', '_id': '2'},
+    ]})['docs']
+    assert docs[0]['_source'] == {'a': 1}
+    assert docs[1]['_source']['details'] == {'b': 2, 'c': 1}
+    assert not docs[2]['found']
+
+    assert es.cat.count(index="pydat-data-write", h="count") == "1"
+    es.rollover("pydat-data-write")
+    assert list(es.indices.get_alias(name="pydat-data-orig")) == [
+        "pydat-data-000001", "pydat-data-000002"]
+    assert es.cat.count(index="pydat-data-write", h="count") == "0"
+    assert es.requests == {'mget': 1, 'bulk': 1}
+
+
+def test_benchmark_scenarios(tmp_path):
+    data = SyntheticWhois(200, duplicate_rate=0.05, seed=2)
+    benchmark = IngestBenchmark(
+        data, workdir=str(tmp_path), batch_size=50, bulk_ship_size=100,
+        dedup='bloom')
+
+    result = benchmark.run('first_import')
+    assert result.options['dedup'] == 'bloom'
+    assert result.stats['new'] == 200
+    assert result.requests['mget'] == 0
+    assert set(result.stages) == {'read', 'fetch', 'work', 'ship'}
+    assert result.stages['ship'].rows == 200
+    json.dumps(result.as_dict())
+
+    result = benchmark.run('incremental')
+    assert result.stats['new'] == data.new_per_version
+    assert result.stats['updated'] == data.changed_count(2)
+    assert result.stats['unchanged'] == (
+        200 - data.changed_count(2))
+
+    # Everything is already at the version, nothing is shipped
+    result = benchmark.run('reingest')
+    assert result.stages['ship'].rows == 0
+    assert result.requests['bulk'] == 0
+
+
+def test_run_scenarios():
+    results = run_scenarios(
+        ['first_import'], rows=50, change_rate=0.5, mget_latency=0)
+    assert [result.scenario for result in results] == ['first_import']
+    assert results[0].rate > 0
+    # Same as the populator, repeats are only dropped when asked to
+    assert results[0].options['dedup'] == 'off'
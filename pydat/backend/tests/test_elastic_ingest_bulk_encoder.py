@@ -0,0 +1,34 @@
+import json
+import pytest
+from pydat.core.elastic.ingest import bulk_encoder
+from pydat.core.elastic.ingest.bulk_encoder import prepare, dumps
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_dumps(monkeypatch, use_orjson):
+    if not use_orjson:
+        monkeypatch.setattr(bulk_encoder, "orjson", None)
+    elif bulk_encoder.orjson is None:
+        pytest.skip("orjson not installed")
+
+    data = {'domainName': 'exämple.com', 'details': {'count': 1}}
+    encoded = dumps(data)
+    assert encoded == (
+        '{"domainName":"exämple.com","details":{"count":1}}'.encode('utf-8'))
+    assert json.loads(encoded) == data
+
+
+def test_prepare():
+    update = prepare({
+        '_op_type': 'update', '_index': 'pydat-data-000001',
+        '_id': 'org.mitre', 'doc': {'dataVersion': 2}
+    })
+    assert [json.loads(line) for line in update.lines] == [
+        {'update': {'_index': 'pydat-data-000001', '_id': 'org.mitre'}},
+        {'doc': {'dataVersion': 2}},
+    ]
+    assert update.command['_id'] == 'org.mitre'
+
+    delete = prepare({'_op_type': 'delete', '_index': 'a', '_id': 'b'})
+    assert [json.loads(line) for line in delete.lines] == [
+        {'delete': {'_index': 'a', '_id': 'b'}}]
@@ -0,0 +1,135 @@
+from unittest import mock
+
+import pytest
+
+from pydat.core.elastic.ingest.ingest_handler import (
+    IngestHandler,
+    BulkShipError,
+)
+from pydat.core.elastic.ingest.bulk_encoder import prepare
+from pydat.core.elastic.ingest.bulk_files import (
+    BulkFileWriter,
+    BulkReplayer,
+    read_actions,
+    list_bulk_files,
+    clear_bulk_files,
+    write_manifest,
+    read_manifest,
+)
+from pydat.core.elastic.ingest.benchmark import FakeElasticsearch
+from pydat.core.elastic.ingest.process_wrapper import (
+    DataProcessorPool,
+    PopulatorOptions,
+)
+
+
+def create(_id, index="pydat-data-write"):
+    return prepare({
+        '_op_type': 'create',
+        '_index': index,
+        '_id': _id,
+        '_source': {'domainName': f"{_id}.com"},
+    })
+
+
+def test_bulk_file_writer(tmp_path):
+    writer = BulkFileWriter(str(tmp_path), "bulk.0.0", max_bytes=200)
+    actions = [create(_id) for _id in range(6)] + [prepare({
+        '_op_type': 'delete', '_index': 'pydat-data-000001', '_id': 7})]
+    for action in actions:
+        writer.write(action.lines)
+
+    # The file being written is not listed until it is closed
+    assert len(list_bulk_files(str(tmp_path))) == len(writer.files) > 1
+    writer.close()
+    names = list_bulk_files(str(tmp_path))
+    assert len(names) == len(writer.files)
+    assert names[0] == "bulk.0.0.00000.ndjson.gz"
+
+    read = [
+        action.lines
+        for name in names
+        for action in read_actions(str(tmp_path / name))
+    ]
+    assert read == [action.lines for action in actions]
+
+    clear_bulk_files(str(tmp_path))
+    assert list_bulk_files(str(tmp_path)) == []
+
+
+def test_manifest(tmp_path):
+    assert read_manifest(str(tmp_path)) is None
+    write_manifest(str(tmp_path), {'version': 2, 'files': ['a']})
+    assert read_manifest(str(tmp_path)) == {'version': 2, 'files': ['a']}
+
+    clear_bulk_files(str(tmp_path))
+    assert read_manifest(str(tmp_path)) is None
+
+
+def test_bulk_replayer(tmp_path):
+    files = []
+    for stream in range(3):
+        writer = BulkFileWriter(str(tmp_path), f"bulk.{stream}.0")
+        for _id in range(stream * 10, stream * 10 + 10):
+            writer.write(create(_id).lines)
+        # Already loaded, conflicts are ignored
+        writer.write(create(0).lines)
+        writer.close()
+        files.extend(writer.files)
+
+    cluster = FakeElasticsearch()
+    es = IngestHandler(hosts="localhost:9200")
+    es._es = cluster
+    replayer = BulkReplayer(es, files, streams=2, bulk_size=4)
+
+    assert replayer.run() == 33
+    assert replayer.created == [30, 0]
+    assert cluster.count(index="pydat-data-orig")['count'] == 30
+    # Requests are bounded by the bulk size
+    assert cluster.requests['bulk'] == 3 * 3
+
+
+def test_bulk_replayer_error(tmp_path):
+    writer = BulkFileWriter(str(tmp_path), "bulk.0.0")
+    writer.write(create(1).lines)
+    writer.close()
+
+    es = IngestHandler(hosts="localhost:9200")
+    es._es = FakeElasticsearch()
+    es.shipDocuments = mock.Mock(side_effect=BulkShipError("rejected"))
+    replayer = BulkReplayer(es, writer.files * 2, streams=2)
+
+    with pytest.raises(BulkShipError):
+        replayer.run()
+
+
+def test_bulk_replayer_rollover(tmp_path):
+    es = IngestHandler(hosts="localhost:9200")
+    es._es = FakeElasticsearch()
+    on_rollover = mock.Mock()
+    replayer = BulkReplayer(es, [], on_rollover=on_rollover)
+    replayer.created = [10, 5]
+
+    replayer._rollover(
+        es.indexNames.orig_write, es.indexNames.orig_search)
+
+    assert replayer.created == [0, 5]
+    on_rollover.assert_called_once()
+    assert es.resolveAlias() == ["pydat-data-000002", "pydat-data-000001"]
+
+
+def test_emit_skips_rollover(tmp_path):
+    event_tracker = mock.Mock()
+    pool = DataProcessorPool(
+        0, None, mock.Mock(), event_tracker,
+        PopulatorOptions(
+            reingest=False, first_import=False,
+            elastic_args={'hosts': "localhost:9200"},
+            emit_dir=str(tmp_path), verbose=False, debug=0),
+    )
+    pool.elastic_handler = mock.Mock()
+
+    # The cluster is left alone, the replay rolls over as needed
+    pool.handleRollover("pydat-data-write", "pydat-data-search")
+    pool.elastic_handler.rolloverIndices.assert_not_called()
+    event_tracker.setRolledOver.assert_not_called()
@@ -0,0 +1,127 @@
+import os
+import json
+from unittest import mock
+
+from pydat.core.elastic.ingest.checkpoint_tracker import (
+    _CheckpointTracker,
+    CheckpointTracker,
+    checkpoint_key,
+)
+from pydat.core.elastic.ingest.file_reader import FileRange, FileReader
+
+
+def test_checkpoint_key(tmp_path):
+    path = tmp_path / "data.csv"
+    path.write_text("domainName\n")
+
+    key = checkpoint_key(FileRange(str(path), 0, None))
+    assert key == f"{path}|11|0|"
+    assert checkpoint_key(FileRange(str(path), 0, 100, 50)) == \
+        f"{path}|11|0|100"
+
+
+def test_checkpoint_client_ordering():
+    fake_queue = mock.Mock()
+    client = _CheckpointTracker(fake_queue)
+
+    key = client.begin(FileRange("/tmp/fake/data.csv", 0, None))
+    markers = [client.mark(key, offset) for offset in [100, 200, 300]]
+
+    # Out of order confirmation doesn't advance the committed offset
+    markers[1].ack()
+    client.flush()
+    assert not fake_queue.put.called
+
+    markers[0].ack()
+    client.flush()
+    fake_queue.put.assert_called_once_with([(key, 200, False)])
+
+    client.complete(key)
+    markers[2].ack()
+    assert fake_queue.put.call_args[0][0] == [
+        (key, 300, False), (key, None, True)]
+
+
+def test_checkpoint_client_poison():
+    fake_queue = mock.Mock()
+    client = _CheckpointTracker(fake_queue)
+
+    key = client.begin(FileRange("/tmp/fake/data.csv", 0, None))
+    markers = [client.mark(key, offset) for offset in [100, 200, 300]]
+
+    markers[0].ack()
+    markers[1].poison()
+    markers[2].ack()
+    client.complete(key)
+    client.flush()
+
+    # Nothing past the poisoned batch is committed and the unit isn't done
+    fake_queue.put.assert_called_once_with([(key, 100, False)])
+
+
+def test_checkpoint_client_empty_unit():
+    fake_queue = mock.Mock()
+    client = _CheckpointTracker(fake_queue)
+
+    key = client.begin(FileRange("/tmp/fake/data.csv", 0, None))
+    client.complete(key)
+    fake_queue.put.assert_called_once_with([(key, None, True)])
+
+
+def test_checkpoint_tracker_persist(tmp_path):
+    tracker = CheckpointTracker(str(tmp_path), 3)
+    client = tracker.get_tracker()
+
+    key = client.begin(FileRange("/tmp/fake/data.csv", 0, None))
+    client.mark(key, 100).ack()
+    done_key = client.begin(FileRange("/tmp/fake/other.csv", 0, None))
+    client.complete(done_key)
+    client.flush()
+
+    tracker.shutdown()
+    tracker.run()
+
+    with open(os.path.join(str(tmp_path), "checkpoint.json")) as saved:
+        checkpoint = json.load(saved)
+    assert checkpoint['version'] == 3
+    assert checkpoint['units'][key] == {'offset': 100, 'done': False}
+    assert checkpoint['units'][done_key]['done']
+
+    assert CheckpointTracker(str(tmp_path), 3).load() == checkpoint['units']
+    # Checkpoints for other versions are ignored
+    assert CheckpointTracker(str(tmp_path), 4).load() == {}
+
+    tracker.clear()
+    assert not os.path.exists(os.path.join(str(tmp_path), "checkpoint.json"))
+
+
+def test_file_reader_resume(tmp_path):
+    done = tmp_path / "done.csv"
+    partial = tmp_path / "partial.csv"
+    fresh = tmp_path / "fresh.csv"
+    for path in [done, partial, fresh]:
+        path.write_text("domainName\nmitre.org\n")
+
+    checkpoints = {
+        checkpoint_key(FileRange(str(done), 0, None)): {
+            'offset': None, 'done': True},
+        checkpoint_key(FileRange(str(partial), 0, None)): {
+            'offset': 11, 'done': False},
+    }
+
+    fake_queue = mock.MagicMock()
+    file_reader = FileReader(
+        fake_queue,
+        mock.MagicMock(),
+        str(tmp_path),
+        None,
+        "csv",
+        checkpoints=checkpoints,
+    )
+    file_reader.run()
+
+    queued = [args[0] for (args, _) in fake_queue.put.call_args_list]
+    assert queued == [
+        FileRange(str(fresh), 0, None),
+        FileRange(str(partial), 0, None, 11),
+    ]
@@ -1,12 +1,31 @@
 import os
+import gzip
+import json
+import queue
 from types import SimpleNamespace
 import pytest
 from unittest import mock
 
 from pydat.core.elastic.ingest.process_wrapper import PopulatorOptions
+from pydat.core.elastic.ingest.ingest_handler import (
+    IngestHandler,
+    BulkFetchError,
+)
+from pydat.core.elastic.ingest.file_reader import FileRange, END_OF_STREAM
+from pydat.core.elastic.ingest.seen_domains import SeenDomains, NEW, MAYBE
+from pydat.core.elastic.ingest.state_store import StateStore
+from pydat.core.elastic.ingest.bulk_files import BulkFileWriter
+from pydat.core.elastic.ingest.checkpoint_tracker import _CheckpointTracker
 from pydat.core.elastic.ingest.data_processors import (
     _generateDocId,
-    DataReader
+    DataReader,
+    DataFetcher,
+    IncompleteBatch,
+    DataWorker,
+    DataShipper,
+    RowDecoder,
+    DetailsHasher,
+    WorkRouter,
 )
 
 
@@ -29,6 +48,8 @@ def fake_data_reader():
     process_options = PopulatorOptions(
         verbose=True,
         debug=True,
+        batch_size=10,
+        reader_backend='csv',
     )
 
     return DataReader(
@@ -47,6 +68,8 @@ def test_data_reader():
     process_options = PopulatorOptions(
         verbose=True,
         debug=True,
+        batch_size=10,
+        reader_backend='csv',
     )
 
     assert DataReader(
@@ -66,7 +89,7 @@ def test_data_reader_check_header(fake_data_reader):
 
 
 def test_data_reader_parse_csv(monkeypatch, fake_data_reader):
-    fake_open = mock.mock_open()
+    fake_open = mock.mock_open(read_data=b"")
     fake_parse_csv_fn = mock.MagicMock()
     with mock.patch('builtins.open', fake_open):
         fake_stat = mock.Mock(return_value=SimpleNamespace(st_size=100))
@@ -81,7 +104,7 @@ def test_data_reader_parse_csv(monkeypatch, fake_data_reader):
             monkey.setattr(DataReader, "_parse_csv", fake_parse_csv_fn)
             fake_data_reader.parse_csv('testfile.csv')
 
-    fake_open = mock.mock_open()
+    fake_open = mock.mock_open(read_data=b"")
     with mock.patch('builtins.open', fake_open) as mock_file:
         mock_file.side_effect = FileNotFoundError()
 
@@ -103,3 +126,875 @@ def test_data_reader_real_parse_csv(monkeypatch, fake_data_reader, caplog):
         "mitre.org,Some Person"
     ]
     fake_data_reader._parse_csv('fakefile', csvdata)
+
+
+def test_data_reader_compressed_file(tmp_path, fake_data_reader):
+    path = str(tmp_path / "data.csv.gz")
+    with gzip.open(path, 'wt') as output:
+        output.write("domainName,registrantName\nmitre.org,Some Person\n")
+
+    fake_data_reader.parse_csv(path)
+    assert fake_data_reader.data_queue.put.call_count == 1
+
+
+def test_data_reader_file_range(tmp_path, fake_data_reader):
+    path = str(tmp_path / "data.csv")
+    with open(path, 'w') as output:
+        output.write("domainName,registrantName\n")
+        output.write("mitre.org,Some Person\n")
+        output.write("example.com,Other Person\n")
+    with open(path, 'rb') as datafile:
+        datafile.readline()
+        datafile.readline()
+        last_row = datafile.tell()
+
+    # The range only holds the last row but the header is still replayed
+    fake_data_reader.parse_csv(path, last_row, None)
+    assert fake_data_reader.data_queue.put.call_count == 1
+    (args, _) = fake_data_reader.data_queue.put.call_args
+    assert args[0]['header'] == ['domainName', 'registrantName']
+    assert args[0]['rows'] == [['example.com', 'Other Person']]
+
+
+def test_data_reader_batches(fake_data_reader):
+    csvdata = ["domainName,registrantName"]
+    csvdata.extend([f"domain{i}.com,Person {i}" for i in range(25)])
+    fake_data_reader._parse_csv('fakefile', csvdata)
+
+    batches = [
+        args[0] for (args, _) in fake_data_reader.data_queue.put.call_args_list
+    ]
+    assert [len(batch['rows']) for batch in batches] == [10, 10, 5]
+    assert all(batch['header'] == ['domainName', 'registrantName']
+               for batch in batches)
+
+
+@pytest.fixture
+def process_options():
+    return PopulatorOptions(
+        version=1,
+        reingest=False,
+        include_fields=None,
+        exclude_fields=None,
+        ignore_field_prefixes=[],
+        ingest_day="2021-01-01",
+        ingest_now="2021-01-02",
+        bulk_fetch_size=2,
+        pre_encode=False,
+        verbose=False,
+        debug=0,
+    )
+
+
+@pytest.mark.parametrize("reingest,counted", [(False, True), (True, False)])
+def test_data_fetcher_duplicates(
+        monkeypatch, process_options, reingest, counted):
+    es = IngestHandler(hosts="localhost:9200")
+    stats = mock.Mock()
+    process_options.reingest = reingest
+    fetcher = DataFetcher(
+        0, 0, mock.Mock(), mock.Mock(), mock.Mock(), es,
+        ["pydat-data-000001"], False, process_options,
+        statTracker=stats, seen_domains=SeenDomains('exact')
+    )
+    fake_fetch = mock.Mock(
+        side_effect=lambda fetch: [(entry, None) for (_, entry) in fetch])
+    monkeypatch.setattr(fetcher, "handle_fetch", fake_fetch)
+
+    batch = fetcher.handle_batch(
+        ['domainName'], [['one.com'], ['one.com'], ['two.com']])
+    batch.extend(fetcher.handle_batch(['domainName'], [['two.com']]))
+
+    assert [entry['domainName'] for (entry, _) in batch] == [
+        'one.com', 'two.com']
+    fetched = [
+        entry['domainName']
+        for (args, _) in fake_fetch.call_args_list
+        for (_, entry) in args[0]
+    ]
+    assert fetched == ['one.com', 'two.com']
+    if counted:
+        stats.incr.assert_has_calls(
+            [mock.call('total'), mock.call('duplicates')] * 2)
+    else:
+        assert not stats.incr.called
+
+
+def test_data_fetcher_maybe_duplicate(monkeypatch, process_options):
+    es = IngestHandler(hosts="localhost:9200")
+    seen = mock.Mock()
+    seen.check.side_effect = [NEW, MAYBE]
+    fetcher = DataFetcher(
+        0, 0, mock.Mock(), mock.Mock(), mock.Mock(), es,
+        ["pydat-data-000001"], True, process_options,
+        seen_domains=seen
+    )
+    fake_fetch = mock.Mock(
+        side_effect=lambda fetch: [(entry, None) for (_, entry) in fetch])
+    monkeypatch.setattr(fetcher, "handle_fetch", fake_fetch)
+
+    fetcher.handle_batch(['domainName'], [['one.com'], ['two.com']])
+
+    # With skip_fetch set, only possible duplicates go to elasticsearch
+    assert fake_fetch.call_count == 1
+    assert fake_fetch.call_args[0][0][0][1]['domainName'] == 'two.com'
+
+
+def test_data_fetcher_index_filters(process_options):
+    es = IngestHandler(hosts="localhost:9200")
+    index_filters = mock.Mock()
+    index_filters.candidates.side_effect = [
+        ["pydat-data-000001"],
+        [],
+        ["pydat-data-000002", "pydat-data-000001"],
+    ]
+    fetcher = DataFetcher(
+        0, 0, mock.Mock(), mock.Mock(), mock.Mock(), es,
+        ["pydat-data-000002", "pydat-data-000001"], False, process_options,
+        index_filters=index_filters
+    )
+    found = {
+        'found': True, '_index': "pydat-data-000001",
+        '_source': {'dataVersion': 1}
+    }
+    missing = {'found': False}
+    es.fetchDocuments = mock.Mock(return_value=[found, missing, found])
+
+    entries = [{'domainName': name} for name in ['a.com', 'b.com', 'c.com']]
+    results = fetcher.handle_fetch(
+        [('com.a', entries[0]), ('com.b', entries[1]), ('com.c', entries[2])])
+
+    (docs,) = es.fetchDocuments.call_args[0]
+    assert [(doc['_index'], doc['_id']) for doc in docs] == [
+        ("pydat-data-000001", 'com.a'),
+        ("pydat-data-000002", 'com.c'),
+        ("pydat-data-000001", 'com.c'),
+    ]
+    assert results == [
+        (entries[0], found), (entries[1], None), (entries[2], found)]
+
+    # No fetch is made when no index can hold the documents
+    index_filters.candidates.side_effect = None
+    index_filters.candidates.return_value = []
+    es.fetchDocuments.reset_mock()
+    assert fetcher.handle_fetch([('com.a', entries[0])]) == [
+        (entries[0], None)]
+    assert not es.fetchDocuments.called
+
+
+def test_details_hasher():
+    details = {'registrantName': 'Some Person', 'status': 'ok'}
+    hasher = DetailsHasher()
+    assert hasher(details) == hasher(dict(reversed(list(details.items()))))
+    assert hasher(details) != hasher({**details, 'status': 'hold'})
+
+    # Only compared fields are part of the fingerprint
+    excluded = DetailsHasher(exclude_fields=['status'])
+    assert excluded(details) == excluded({**details, 'status': 'hold'})
+    included = DetailsHasher(include_fields=['registrantName'])
+    assert included(details) == included({**details, 'status': 'hold'})
+
+    # Changing the settings invalidates fingerprints
+    assert excluded({'registrantName': 'Some Person'}) != \
+        hasher({'registrantName': 'Some Person'})
+
+
+def test_data_fetcher_fetch_sources(process_options):
+    es = IngestHandler(hosts="localhost:9200")
+    fetcher = DataFetcher(
+        0, 0, mock.Mock(), mock.Mock(), mock.Mock(), es,
+        ["pydat-data-000001"], False, process_options
+    )
+    entries = [
+        {'detailsHash': 'same'},
+        {'detailsHash': 'new'},
+        {'detailsHash': 'new'},
+    ]
+
+    def found(_id, version, details_hash):
+        return {
+            'found': True, '_index': "pydat-data-000001", '_id': _id,
+            '_source': {'dataVersion': version, 'detailsHash': details_hash}
+        }
+
+    results = [
+        (entries[0], found('com.a', 0, 'same')),
+        (entries[1], found('com.b', 0, 'old')),
+        (entries[2], found('com.c', 1, 'old')),
+    ]
+    full = {
+        'found': True, '_index': "pydat-data-000001", '_id': 'com.b',
+        '_source': {'dataVersion': 0, 'details': {}}
+    }
+    es.fetchDocuments = mock.Mock(return_value=[full])
+
+    fetched = fetcher.fetch_sources(list(results))
+
+    # Only the changed record that is not a duplicate is fully fetched
+    es.fetchDocuments.assert_called_once_with(
+        [{'_index': "pydat-data-000001", '_id': 'com.b'}])
+    assert fetched == [results[0], (entries[1], full), results[2]]
+
+
+def test_data_fetcher_update_index_list(process_options):
+    es = IngestHandler(hosts="localhost:9200")
+    fetcher = DataFetcher(
+        0, 0, mock.Mock(), mock.Mock(), mock.Mock(), es,
+        ["pydat-data-000001"], True, process_options
+    )
+    fetcher.fetch_size.base_delay = 0
+    es.fetchDocuments = mock.Mock(return_value=[])
+
+    fetcher.update_index_list(["pydat-data-000002", "pydat-data-000001"])
+    # The documents are missing from every response, so the fetch fails
+    with pytest.raises(IncompleteBatch):
+        fetcher.handle_batch(['domainName'], [['one.com']])
+    assert es.fetchDocuments.call_count == DataFetcher.FETCH_RETRIES + 1
+
+    # Records may now exist in an earlier index, so they are fetched
+    docs = es.fetchDocuments.call_args[0][0]
+    assert [doc['_index'] for doc in docs] == [
+        "pydat-data-000002", "pydat-data-000001"]
+
+
+def test_data_worker_details_hash(process_options):
+    es = IngestHandler(hosts="localhost:9200")
+    stats = mock.Mock()
+    worker = DataWorker(
+        0, mock.Mock(), mock.Mock(), stats, mock.Mock(), es, process_options)
+    entry = {
+        'domainName': 'mitre.org',
+        'details': {'registrantName': 'Some Person'},
+        'detailsHash': 'same',
+    }
+    current = {
+        '_index': "pydat-data-000001", '_id': 'org.mitre',
+        '_source': {'dataVersion': 0, 'detailsHash': 'same'}
+    }
+
+    commands = worker.process_entry(entry, current)
+    assert len(commands) == 1
+    assert commands[0]['_op_type'] == 'update'
+    assert commands[0]['doc']['detailsHash'] == 'same'
+    stats.incr.assert_called_once_with('unchanged')
+
+
+def test_data_fetcher_state_store(tmp_path, process_options):
+    es = IngestHandler(hosts="localhost:9200")
+    store = StateStore(str(tmp_path))
+    store.apply(records=[
+        ('com.one', 0, 'pydat-data-000001', 0, '2020-01-01', '2020-01-01',
+         'same'),
+    ])
+    fetcher = DataFetcher(
+        0, 0, mock.Mock(), mock.Mock(), mock.Mock(), es,
+        ["pydat-data-000001"], False, process_options,
+        state_store=store
+    )
+    es.fetchDocuments = mock.Mock()
+    entries = [{'detailsHash': 'same'}, {'detailsHash': 'new'}]
+
+    results = fetcher.handle_fetch(
+        [('com.one', entries[0]), ('com.two', entries[1])])
+
+    assert not es.fetchDocuments.called
+    assert results[1] == (entries[1], None)
+    (entry, found) = results[0]
+    assert found['_index'] == 'pydat-data-000001'
+    assert found['_source']['dataVersion'] == 0
+    assert found['_source']['dateFirstSeen'] == '2020-01-01'
+
+
+def test_data_shipper_state_store(tmp_path):
+    store = StateStore(str(tmp_path))
+    es = IngestHandler(hosts="localhost:9200", indexPrefix="pydat")
+    worker = DataWorker(
+        0, mock.Mock(), mock.Mock(), mock.Mock(), mock.Mock(), es,
+        PopulatorOptions(
+            version=2, reingest=False, include_fields=None,
+            exclude_fields=None, ingest_day="2021-01-02",
+            ingest_now="2021-01-02", pre_encode=False, verbose=False,
+            debug=0)
+    )
+    new_entry = {
+        'dataVersion': 2, 'dataFirstSeen': 2, 'dateFirstSeen': '2021-01-02',
+        'dateCreated': '2021-01-02', 'detailsHash': 'new',
+    }
+    commands = [
+        worker.process_command(
+            'create', 'pydat-data-write', 'com.new', new_entry),
+        worker.process_command(
+            'update', 'pydat-data-000001', 'com.old',
+            {'doc': {'dataVersion': 2, 'detailsHash': 'old'}}),
+        worker.process_command(
+            'create', 'pydat-data-delta-write', 'com.old#1', new_entry),
+        worker.process_command(
+            'create', 'pydat-data-write', 'com.exists', new_entry),
+    ]
+    responses = [
+        (True, {'create': {
+            '_index': 'pydat-data-000002', '_id': 'com.new',
+            'status': 201}}),
+        (True, {'update': {
+            '_index': 'pydat-data-000001', '_id': 'com.old',
+            'status': 200}}),
+        (True, {'create': {
+            '_index': 'pydat-data-delta-000001', '_id': 'com.old#1',
+            'status': 201}}),
+        (False, {'create': {
+            '_index': 'pydat-data-000002', '_id': 'com.exists',
+            'status': 409}}),
+    ]
+
+    def fake_ship(documents, bulk_size, bulk_bytes=None, callback=None,
+                  controller=None, max_inflight=1, telemetry=None):
+        for (document, response) in zip(documents, responses):
+            callback(*response)
+
+    es.shipDocuments = mock.Mock(side_effect=fake_ship)
+    insert_queue = queue.Queue()
+    insert_queue.put((None, commands))
+    event_tracker = mock.Mock()
+    shipper = DataShipper(
+        0, 0, es, insert_queue, event_tracker,
+        PopulatorOptions(
+            bulk_ship_size=10, bulk_ship_bytes=0, bulk_ship_inflight=1),
+        state_store=store
+    )
+    shipper.finish()
+    shipper.run()
+
+    # Created documents are counted per write index for rollovers
+    event_tracker.addCreated.assert_called_once_with(data=1, delta=1)
+
+    records = store.lookup(
+        ['com.new', 'com.old', 'com.old#1', 'com.exists'])
+    assert records['com.new'] == (
+        'com.new', 2, 'pydat-data-000002', 2, '2021-01-02', '2021-01-02',
+        'new')
+    # The store did not know the record before, so only a placeholder
+    assert records['com.old'][:3] == ('com.old', None, 'pydat-data-000001')
+    assert records['com.exists'][:3] == (
+        'com.exists', None, 'pydat-data-000002')
+    assert 'com.old#1' not in records
+
+
+def test_data_fetcher_fetch_retry(process_options):
+    es = IngestHandler(hosts="localhost:9200")
+    eventTracker = mock.Mock()
+    fetcher = DataFetcher(
+        0, 0, mock.Mock(), mock.Mock(), eventTracker, es,
+        ["pydat-data-000001"], False, process_options
+    )
+    fetcher.fetch_size.base_delay = 0
+    es.fetchDocuments = mock.Mock(side_effect=[
+        BulkFetchError("fetch rejected"),
+        [{'found': False}],
+        [{'found': False}],
+    ])
+
+    fetched = fetcher._fetch([{'_id': 'com.a'}, {'_id': 'com.b'}])
+
+    assert fetched == [{'found': False}, {'found': False}]
+    # The rejected fetch is retried at half the size
+    assert [len(args[0]) for (args, _) in
+            es.fetchDocuments.call_args_list] == [2, 1, 1]
+    assert not eventTracker.setShipError.called
+
+
+def test_data_fetcher_fetch_short_response(process_options):
+    es = IngestHandler(hosts="localhost:9200")
+    fetcher = DataFetcher(
+        0, 0, mock.Mock(), mock.Mock(), mock.Mock(), es,
+        ["pydat-data-000001"], False, process_options
+    )
+    fetcher.fetch_size.base_delay = 0
+    found = {'found': True, '_id': 'com.b'}
+    es.fetchDocuments = mock.Mock(side_effect=[
+        [{'found': False}],
+        [{'error': {'type': 'shard_failure'}}],
+        [found],
+    ])
+
+    fetched = fetcher._fetch([{'_id': 'com.a'}, {'_id': 'com.b'}])
+
+    # Missing and failed documents are fetched again
+    assert fetched == [{'found': False}, found]
+    assert [args[0] for (args, _) in es.fetchDocuments.call_args_list] == [
+        [{'_id': 'com.a'}, {'_id': 'com.b'}],
+        [{'_id': 'com.b'}],
+        [{'_id': 'com.b'}],
+    ]
+
+
+def test_data_fetcher_fetch_missing_index(process_options):
+    es = IngestHandler(hosts="localhost:9200")
+    fetcher = DataFetcher(
+        0, 0, mock.Mock(), mock.Mock(), mock.Mock(), es,
+        ["pydat-data-000002", "pydat-data-000001"], False, process_options
+    )
+    missing = {
+        '_index': 'pydat-data-000002',
+        '_id': 'com.a',
+        'error': {'type': 'index_not_found_exception'},
+    }
+    es.fetchDocuments = mock.Mock(return_value=[missing, {'found': False}])
+
+    # An index that a rollover is about to create holds no records yet
+    fetched = fetcher._fetch([{'_id': 'com.a'}, {'_id': 'com.a'}])
+    assert [res['found'] for res in fetched] == [False, False]
+    assert es.fetchDocuments.call_count == 1
+
+
+def test_data_fetcher_fetch_failure(process_options):
+    es = IngestHandler(hosts="localhost:9200")
+    data_queue = queue.Queue()
+    work_queue = queue.Queue()
+    fetcher = DataFetcher(
+        0, 0, data_queue, work_queue, mock.Mock(), es,
+        ["pydat-data-000001"], False, process_options
+    )
+    es.fetchDocuments = mock.Mock(side_effect=[
+        RuntimeError("fetch failed"),
+        [{'found': False}],
+    ])
+
+    fake_queue = mock.Mock()
+    client = _CheckpointTracker(fake_queue)
+    key = client.begin(FileRange("/tmp/fake/data.csv", 0, None))
+    for (offset, domain) in [(100, 'one.com'), (200, 'two.com')]:
+        data_queue.put({
+            'header': ['domainName'],
+            'rows': [[domain]],
+            'marker': client.mark(key, offset),
+        })
+    client.complete(key)
+    data_queue.put(END_OF_STREAM)
+    fetcher.run()
+
+    # Only the batch that was fetched is passed on, with its marker
+    (marker, batch) = work_queue.get_nowait()
+    assert [entry['domainName'] for (entry, _) in batch] == ['two.com']
+    assert work_queue.empty()
+    marker.ack()
+    client.flush()
+
+    # The failed batch is never acknowledged, so the checkpoint stays put
+    assert not fake_queue.put.called
+
+
+def test_data_fetcher_batch(process_options):
+    es = IngestHandler(hosts="localhost:9200")
+    fetcher = DataFetcher(
+        0, 0, mock.Mock(), mock.Mock(), mock.Mock(), es,
+        ["pydat-data-000001"], True, process_options
+    )
+
+    batch = fetcher.handle_batch(
+        ['domainName', 'registrantName'],
+        [['mitre.org', ''], ['example.com', '']]
+    )
+
+    assert len(batch) == 2
+    assert batch[0][0]['domainName'] == 'mitre.org'
+    assert batch[0][1] is None
+    assert batch[1][0]['tld'] == 'com'
+
+
+def test_data_fetcher_batch_fetch(process_options, monkeypatch):
+    es = IngestHandler(hosts="localhost:9200")
+    fake_fetch = mock.Mock(side_effect=lambda fetch_list: [
+        (entry, None) for (_, entry) in fetch_list])
+    fetcher = DataFetcher(
+        0, 0, mock.Mock(), mock.Mock(), mock.Mock(), es,
+        ["pydat-data-000001"], False, process_options
+    )
+    monkeypatch.setattr(fetcher, "handle_fetch", fake_fetch)
+
+    batch = fetcher.handle_batch(
+        ['domainName'],
+        [['one.com'], ['two.com'], ['three.com']]
+    )
+
+    # Fetches are done bulk_fetch_size records at a time
+    assert fake_fetch.call_count == 2
+    assert [entry['domainName'] for (entry, _) in batch] == [
+        'one.com', 'two.com', 'three.com']
+
+
+def test_data_worker_batch(process_options):
+    es = IngestHandler(hosts="localhost:9200")
+    stat_tracker = mock.Mock()
+    worker = DataWorker(
+        0, mock.Mock(), mock.Mock(), stat_tracker, mock.Mock(), es,
+        process_options
+    )
+
+    entry = {'domainName': 'mitre.org', 'details': {}}
+    commands = worker.handle_batch([(entry, None), (None, None)])
+
+    assert len(commands) == 1
+    assert commands[0]['_op_type'] == 'create'
+    assert commands[0]['_id'] == 'org.mitre'
+    stat_tracker.incr.assert_any_call('new')
+
+
+def test_row_decoder():
+    decoder = RowDecoder(
+        ['registrantName', 'domainName', 'zoneContact_email', 'status'],
+        ['zoneContact']
+    )
+
+    assert decoder.domain_index == 1
+    assert decoder.columns == [(0, 'registrantName'), (3, 'status')]
+
+    (domainName, details) = decoder.decode(
+        ['Smith &amp; Sons', 'mitre.org', 'a@b.com', ''])
+    assert domainName == 'mitre.org'
+    assert details == {'registrantName': 'Smith & Sons', 'status': None}
+
+
+def test_row_decoder_no_prefixes():
+    decoder = RowDecoder(['domainName', 'status'], None)
+    assert decoder.decode(['mitre.org', 'ok']) == (
+        'mitre.org', {'status': 'ok'})
+
+
+def test_data_fetcher_decoder_cache(process_options):
+    es = IngestHandler(hosts="localhost:9200")
+    fetcher = DataFetcher(
+        0, 0, mock.Mock(), mock.Mock(), mock.Mock(), es,
+        ["pydat-data-000001"], True, process_options
+    )
+
+    header = ['domainName', 'status']
+    decoder = fetcher.get_decoder(header)
+    assert fetcher.get_decoder(header) is decoder
+    assert fetcher.get_decoder(list(header)) is decoder
+    assert fetcher.get_decoder(['domainName']) is not decoder
+
+    entry = fetcher.parse_entry(['mitre.org', 'a &lt; b'], header)
+    assert entry['details'] == {'status': 'a < b'}
+
+
+@pytest.mark.parametrize("backend", ["csv", "arrow"])
+def test_data_reader_backends(tmp_path, backend, caplog):
+    if backend == "arrow":
+        pytest.importorskip("pyarrow")
+
+    path = str(tmp_path / "data.csv")
+    with open(path, 'w') as output:
+        output.write(
+            "domainName,registrantName,status\n"
+            "mitre.org,\"Some, Person\",  ok\n"
+            "bad..label!.com,Person,ok\n"
+            "short.com,Person\n"
+            "example.com,\"Multi\nLine\",ok\n"
+        )
+
+    data_queue = mock.Mock()
+    data_reader = DataReader(
+        0,
+        mock.Mock(),
+        data_queue,
+        mock.Mock(),
+        PopulatorOptions(
+            verbose=False,
+            debug=0,
+            batch_size=10,
+            reader_backend=backend
+        )
+    )
+    data_reader.parse_csv(path)
+
+    rows = []
+    for (args, _) in data_queue.put.call_args_list:
+        rows.extend(args[0]['rows'])
+    assert rows == [
+        ['mitre.org', 'Some, Person', 'ok'],
+        ['example.com', 'Multi\nLine', 'ok'],
+    ]
+    assert "does not match valid pattern" in caplog.text
+    assert "less than length of header" in caplog.text
+
+
+def test_data_reader_backends_parity(tmp_path, monkeypatch):
+    pytest.importorskip("pyarrow")
+    from pydat.core.elastic.ingest import data_processors
+    # Small blocks so some are parsed by pyarrow and some by the csv module
+    monkeypatch.setattr(data_processors, "ARROW_READ_SIZE", 64)
+
+    path = str(tmp_path / "data.csv")
+    with open(path, 'w') as output:
+        output.write(
+            "domainName,registrantName,status\n"
+            "mitre.org, \"Some, Person\",\"a&amp;b\"\n" +
+            "example.com,Person,ok\n" * 4 +
+            "spaced.com, \"Person\",  ok\n"
+            "quoted.com,\"\"\"Person\"\"\",ok\n"
+            "multi.com,\"Multi\nLine, Person\",ok\n" +
+            "example.org,Person,ok\n" * 4
+        )
+
+    def parse(backend):
+        data_queue = mock.Mock()
+        data_reader = DataReader(
+            0,
+            mock.Mock(),
+            data_queue,
+            mock.Mock(),
+            PopulatorOptions(
+                verbose=False,
+                debug=0,
+                batch_size=10,
+                reader_backend=backend
+            )
+        )
+        data_reader.parse_csv(path)
+        rows = []
+        for (args, _) in data_queue.put.call_args_list:
+            rows.extend(args[0]['rows'])
+        return rows
+
+    rows = parse('csv')
+    assert len(rows) == 12
+    assert rows[0] == ['mitre.org', 'Some, Person', 'a&amp;b']
+    assert parse('arrow') == rows
+
+
+def test_data_reader_arrow_fallback(monkeypatch):
+    from pydat.core.elastic.ingest import data_processors
+    monkeypatch.setattr(data_processors, "pyarrow", None)
+
+    data_reader = DataReader(
+        0,
+        mock.Mock(),
+        mock.Mock(),
+        mock.Mock(),
+        PopulatorOptions(
+            verbose=False,
+            debug=0,
+            batch_size=10,
+            reader_backend='arrow'
+        )
+    )
+    assert data_reader.reader_backend == 'csv'
+
+
+def test_data_shipper_confirm():
+    markers = [mock.Mock(), None, mock.Mock()]
+    batches = [
+        (markers[0], [{'_id': 1}, {'_id': 2}]),
+        (markers[1], [{'_id': 3}]),
+        (markers[2], [{'_id': 4}]),
+    ]
+    insert_queue = queue.Queue()
+    for batch in batches:
+        insert_queue.put(batch)
+
+    def fake_ship(documents, bulk_size, bulk_bytes=None, callback=None,
+                  controller=None, max_inflight=1, telemetry=None):
+        for document in documents:
+            if document.command['_id'] == 2:
+                # First marker must not be acknowledged until all of its
+                # commands are confirmed
+                assert not markers[0].ack.called
+            callback(True, {'index': {}})
+
+    es = mock.Mock()
+    es.shipDocuments.side_effect = fake_ship
+    shipper = DataShipper(
+        0, 0, es, insert_queue, mock.Mock(),
+        PopulatorOptions(
+            bulk_ship_size=10, bulk_ship_bytes=0, bulk_ship_inflight=1)
+    )
+    shipper.finish()
+    shipper.run()
+
+    assert markers[0].ack.call_count == 1
+    assert markers[2].ack.call_count == 1
+
+
+def test_data_shipper_pre_encoded(process_options):
+    es = IngestHandler(hosts="localhost:9200")
+    worker_stats = mock.Mock()
+    worker = DataWorker(
+        0, mock.Mock(), mock.Mock(), worker_stats, mock.Mock(), es,
+        process_options
+    )
+    prepared = worker.encode_batch([
+        worker.process_command(
+            'create', 'pydat-data-write', 'org.mitre',
+            {'domainName': 'mitre.org'}),
+    ])
+    assert [json.loads(line) for line in prepared[0].lines] == [
+        {'create': {'_index': 'pydat-data-write', '_id': 'org.mitre'}},
+        {'domainName': 'mitre.org'},
+    ]
+    assert worker_stats.addTime.call_args[0][0] == 'worker_serialize'
+
+    insert_queue = queue.Queue()
+    insert_queue.put((None, prepared + [{'_id': 2}]))
+    sent = []
+
+    def fake_ship(documents, bulk_size, bulk_bytes=None, callback=None,
+                  controller=None, max_inflight=1, telemetry=None):
+        for document in documents:
+            sent.append(document)
+            callback(True, {'index': {}})
+
+    es.shipDocuments = mock.Mock(side_effect=fake_ship)
+    shipper_stats = mock.Mock()
+    shipper = DataShipper(
+        0, 0, es, insert_queue, mock.Mock(),
+        PopulatorOptions(
+            bulk_ship_size=10, bulk_ship_bytes=0, bulk_ship_inflight=1),
+        statTracker=shipper_stats
+    )
+    shipper.finish()
+    shipper.run()
+
+    # Encoded commands are passed through, the rest encoded by the shipper
+    assert sent[0] is prepared[0]
+    assert sent[1].lines[0] == b'{"index":{"_id":2}}'
+    assert shipper_stats.addTime.call_args[0][0] == 'shipper_serialize'
+
+
+def test_work_router():
+    work_queues = [queue.Queue() for _ in range(3)]
+    router = WorkRouter(work_queues)
+    entries = [{'domainName': f"domain{i}.com"} for i in range(30)]
+    marker = mock.Mock()
+    router.put((marker, [(entry, None) for entry in entries]))
+    router.put((None, [(entries[0], None)]))
+
+    routed = [list(work_queue.queue) for work_queue in work_queues]
+    assert all(len(parts) > 0 for parts in routed)
+    assert router.qsize() == sum(len(parts) for parts in routed)
+    # A domain always lands on the same worker
+    position = router.route(entries[0])
+    assert routed[position][-1] == (None, [(entries[0], None)])
+    for (position, parts) in enumerate(routed):
+        for (_, batch) in parts:
+            assert all(router.route(entry) == position for (entry, _) in batch)
+
+    # The marker of a split batch is acknowledged once every part is
+    split_markers = [parts[0][0] for parts in routed]
+    for split_marker in split_markers:
+        marker.ack.assert_not_called()
+        split_marker.ack()
+    marker.ack.assert_called_once()
+
+    # With a single worker batches are passed as is
+    work_queue = queue.Queue()
+    batch = (marker, [(entries[0], None), (entries[1], None)])
+    WorkRouter([work_queue]).put(batch)
+    assert work_queue.get_nowait() is batch
+
+
+def test_data_shipper_emit(tmp_path):
+    marker = mock.Mock()
+    insert_queue = queue.Queue()
+    insert_queue.put((marker, [
+        {'_op_type': 'create', '_index': 'pydat-data-write', '_id': 1,
+         '_source': {'a': 1}},
+        {'_op_type': 'delete', '_index': 'pydat-data-000001', '_id': 2},
+    ]))
+
+    es = IngestHandler(hosts="localhost:9200")
+    es.shipDocuments = mock.Mock()
+    event_tracker = mock.Mock()
+    shipper = DataShipper(
+        0, 0, es, insert_queue, event_tracker,
+        PopulatorOptions(
+            bulk_ship_size=10, bulk_ship_bytes=0, bulk_ship_inflight=1),
+        bulk_writer=BulkFileWriter(str(tmp_path), "bulk.0.0"),
+    )
+    shipper.finish()
+    shipper.run()
+
+    # Nothing is sent to the cluster or counted as created
+    es.shipDocuments.assert_not_called()
+    event_tracker.addCreated.assert_not_called()
+    marker.ack.assert_called_once()
+    with gzip.open(tmp_path / "bulk.0.0.00000.ndjson.gz") as bulk_file:
+        assert [json.loads(line) for line in bulk_file] == [
+            {'create': {'_index': 'pydat-data-write', '_id': 1}},
+            {'a': 1},
+            {'delete': {'_index': 'pydat-data-000001', '_id': 2}},
+        ]
+
+
+def test_data_reader_end_of_stream(fake_data_reader):
+    file_queue = queue.Queue()
+    file_queue.put(END_OF_STREAM)
+    file_queue.put("never-read.csv")
+    fake_data_reader.file_queue = file_queue
+    fake_data_reader.run()
+
+    # Every reader takes a single end of stream
+    assert file_queue.get_nowait() == "never-read.csv"
+    fake_data_reader.eventTracker.notify.assert_called_once()
+
+
+def test_data_shippers_end_of_stream():
+    shipped = []
+
+    def fake_ship(documents, bulk_size, bulk_bytes=None, callback=None,
+                  controller=None, max_inflight=1, telemetry=None):
+        shipped.extend(documents)
+
+    es = IngestHandler(hosts="localhost:9200")
+    es.shipDocuments = mock.Mock(side_effect=fake_ship)
+    insert_queue = queue.Queue()
+    shippers = [
+        DataShipper(
+            0, shipperid, es, insert_queue, mock.Mock(),
+            PopulatorOptions(
+                bulk_ship_size=10, bulk_ship_bytes=0, bulk_ship_inflight=1),
+        )
+        for shipperid in range(2)
+    ]
+    for shipper in shippers:
+        shipper.start()
+
+    for _id in range(10):
+        insert_queue.put((None, [{'_op_type': 'index', '_id': _id}]))
+    # The shippers share their queue, so both must be sent the end of the
+    # stream before either is waited on
+    for shipper in shippers:
+        shipper.finish()
+    for shipper in shippers:
+        shipper.join(1)
+        assert not shipper.is_alive()
+    assert len(shipped) == 10
+
+    # Shutdown wakes a shipper blocked on an empty queue
+    shipper = DataShipper(
+        0, 0, es, insert_queue, mock.Mock(),
+        PopulatorOptions(
+            bulk_ship_size=10, bulk_ship_bytes=0, bulk_ship_inflight=1),
+    )
+    shipper.start()
+    shipper.shutdown()
+    insert_queue.put(END_OF_STREAM)
+    shipper.join(1)
+    assert not shipper.is_alive()
+
+
+def test_data_reader_markers(tmp_path, fake_data_reader):
+    path = tmp_path / "data.csv"
+    path.write_text("domainName\n" + "".join(
+        f"domain{i}.com\n" for i in range(15)))
+
+    checkpoints = mock.Mock()
+    fake_data_reader.checkpoints = checkpoints
+    fake_data_reader.parse_range(FileRange(str(path), 0, None))
+
+    offsets = [args[1] for (args, _) in checkpoints.mark.call_args_list]
+    assert offsets == [
+        len("domainName\n") + sum(
+            len(f"domain{i}.com\n") for i in range(10)),
+        os.path.getsize(str(path)),
+    ]
+    checkpoints.complete.assert_called_once()
@@ -1,3 +1,5 @@
+from threading import Timer
+
 from pydat.core.elastic.ingest.event_tracker import EventTracker
 
 
@@ -32,3 +34,44 @@ def test_event_tracker_bulk():
     assert event_tracker.fetchError
     assert event_tracker.bulkError
     assert not event_tracker.shipError
+
+
+def test_event_tracker_rollover():
+    event_tracker = EventTracker()
+
+    assert event_tracker.rollovers == 0
+    event_tracker.setCreated(10, 5)
+    event_tracker.addCreated(data=2)
+    event_tracker.addCreated(delta=1)
+    assert event_tracker.created == (12, 6)
+
+    event_tracker.setRolledOver(delta=True)
+    assert event_tracker.created == (12, 0)
+    assert event_tracker.rollovers == 1
+
+
+def test_event_tracker_announce_rollover():
+    event_tracker = EventTracker()
+
+    assert event_tracker.announcedRollover == (0, '')
+    seen = event_tracker.changes
+    event_tracker.announceRollover("pydat-data-000002")
+    assert event_tracker.announcedRollover == (1, "pydat-data-000002")
+    assert event_tracker.changes == seen + 1
+
+
+def test_event_tracker_wait():
+    event_tracker = EventTracker()
+
+    seen = event_tracker.changes
+    assert event_tracker.wait(seen, timeout=.01) == seen
+
+    # Events recorded before waiting aren't missed
+    event_tracker.setShutdown()
+    seen = event_tracker.wait(seen)
+    assert seen == event_tracker.changes
+
+    waker = Timer(.05, event_tracker.notify)
+    waker.start()
+    assert event_tracker.wait(seen) == seen + 1
+    waker.join()
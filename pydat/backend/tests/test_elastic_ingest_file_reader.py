@@ -1,28 +1,33 @@
 import os
+import bz2
+import gzip
+import lzma
 import pytest
 from unittest import mock
-from pydat.core.elastic.ingest.file_reader import FileReader
-
-
-def fake_idsir(path):
-    if path in [
-            '/tmp/fake/subdir',
-    ]:
-        return True
-    else:
-        return False
+from pydat.core.elastic.ingest.file_reader import (
+    END_OF_STREAM,
+    FileRange,
+    FileReader,
+    LineReader,
+    RangeStream,
+    detect_compression,
+    split_file,
+    open_data_file,
+    strip_compression_extension,
+)
 
 
-def fake_isfile(path):
-    if path in [
-            '/tmp/fake/file1.csv',
-            '/tmp/fake/file2.csv',
-            '/tmp/fake/file1.txt',
-            '/tmp/fake/file3.txt'
-    ]:
-        return True
-    else:
-        return False
+@pytest.fixture
+def data_dir(tmp_path):
+    def make_dir(pathlist):
+        for (name, size) in pathlist:
+            path = tmp_path / name
+            if size is None:
+                path.mkdir()
+            else:
+                path.write_bytes(b"x" * size)
+        return str(tmp_path)
+    return make_dir
 
 
 def test_file_reader_file(monkeypatch):
@@ -47,20 +52,24 @@ def test_file_reader_file(monkeypatch):
 @pytest.mark.parametrize(
     "pathlist,call_count", [
         (
-            ['file1.csv', 'file2.csv'],
+            [('file1.csv', 1), ('file2.csv', 1)],
             2
         ),
         (
-            ['subdir'],
+            [('subdir', None)],
             0
         ),
         (
-            ['file3.txt'],
+            [('file3.txt', 1)],
             0
+        ),
+        (
+            [('file4.csv.gz', 1), ('file5.txt.bz2', 1)],
+            1
         )
     ]
 )
-def test_file_reader_directory(monkeypatch, pathlist, call_count):
+def test_file_reader_directory(data_dir, pathlist, call_count):
     fake_eventTracker = mock.MagicMock()
     fake_eventTracker.setFileReaderDone = mock.MagicMock()
     fake_queue = mock.MagicMock()
@@ -68,22 +77,16 @@ def test_file_reader_directory(monkeypatch, pathlist, call_count):
     file_reader = FileReader(
         fake_queue,
         fake_eventTracker,
-        "/tmp/fake",
+        data_dir(pathlist),
         None,
         "csv"
     )
 
-    monkeypatch.setattr(os.path, "isdir", fake_idsir)
-    monkeypatch.setattr(os.path, "isfile", fake_isfile)
-
-    fake_listdir = mock.MagicMock(return_value=pathlist)
-    with monkeypatch.context() as monkey:
-        monkey.setattr(os, "listdir", fake_listdir)
-        file_reader.run()
-        assert fake_queue.put.call_count == call_count
+    file_reader.run()
+    assert fake_queue.put.call_count == call_count
 
 
-def test_file_reader_shutdown(monkeypatch):
+def test_file_reader_shutdown(data_dir):
     fake_eventTracker = mock.MagicMock()
     fake_eventTracker.setFileReaderDone = mock.MagicMock()
     fake_queue = mock.MagicMock()
@@ -91,7 +94,7 @@ def test_file_reader_shutdown(monkeypatch):
     file_reader = FileReader(
         fake_queue,
         fake_eventTracker,
-        "/tmp/fake",
+        data_dir([('file1.csv', 1)]),
         None,
         ""
     )
@@ -99,14 +102,31 @@ def test_file_reader_shutdown(monkeypatch):
     file_reader.shutdown()
     assert file_reader._shutdown is True
 
-    fake_listdir = mock.MagicMock(return_value=['file1.csv'])
-    with monkeypatch.context() as monkey:
-        monkey.setattr(os, "listdir", fake_listdir)
-        file_reader.run()
-        assert fake_queue.put.call_count == 0
+    file_reader.run()
+    assert fake_queue.put.call_count == 0
 
 
-def test_file_reader_noextension_check(monkeypatch):
+def test_file_reader_readers(data_dir):
+    fake_eventTracker = mock.MagicMock()
+    fake_queue = mock.MagicMock()
+
+    file_reader = FileReader(
+        fake_queue,
+        fake_eventTracker,
+        data_dir([('file1.csv', 1)]),
+        None,
+        "csv",
+        readers=2,
+    )
+
+    file_reader.run()
+    # Every reader is sent the end of the stream after the files
+    queued = [args[0] for (args, _) in fake_queue.put.call_args_list]
+    assert queued[1:] == [END_OF_STREAM, END_OF_STREAM]
+    assert queued[0] is not END_OF_STREAM
+
+
+def test_file_reader_noextension_check(data_dir):
     fake_eventTracker = mock.MagicMock()
     fake_eventTracker.setFileReaderDone = mock.MagicMock()
     fake_queue = mock.MagicMock()
@@ -114,15 +134,197 @@ def test_file_reader_noextension_check(monkeypatch):
     file_reader = FileReader(
         fake_queue,
         fake_eventTracker,
-        "/tmp/fake",
+        data_dir([('file1.txt', 1)]),
         None,
         ""
     )
 
-    monkeypatch.setattr(os.path, "isdir", fake_idsir)
-    monkeypatch.setattr(os.path, "isfile", fake_isfile)
-    fake_listdir = mock.MagicMock(return_value=['file1.txt'])
-    with monkeypatch.context() as monkey:
-        monkey.setattr(os, "listdir", fake_listdir)
-        file_reader.run()
-        assert fake_queue.put.call_count == 1
+    file_reader.run()
+    assert fake_queue.put.call_count == 1
+
+
+def test_file_reader_recursive(data_dir, tmp_path):
+    directory = data_dir([('b.csv', 5), ('subdir', None)])
+    (tmp_path / 'subdir' / 'a.csv').write_bytes(b"x" * 7)
+
+    file_reader = FileReader(
+        mock.MagicMock(), mock.MagicMock(), directory, None, "csv")
+
+    assert file_reader.collect_files(directory) == [
+        (os.path.join(directory, 'b.csv'), 5),
+        (os.path.join(directory, 'subdir', 'a.csv'), 7),
+    ]
+
+
+@pytest.mark.parametrize(
+    "schedule,expected", [
+        ("name", ['a.csv', 'b.csv', 'c.csv']),
+        ("size", ['b.csv', 'c.csv', 'a.csv']),
+    ]
+)
+def test_file_reader_schedule(data_dir, schedule, expected):
+    directory = data_dir([('a.csv', 10), ('b.csv', 300), ('c.csv', 20)])
+    fake_queue = mock.MagicMock()
+
+    file_reader = FileReader(
+        fake_queue,
+        mock.MagicMock(),
+        directory,
+        None,
+        "csv",
+        schedule=schedule
+    )
+
+    file_reader.run()
+    queued = [
+        os.path.basename(args[0].path)
+        for (args, _) in fake_queue.put.call_args_list
+    ]
+    assert queued == expected
+    assert file_reader.total_bytes == 330
+
+
+@pytest.mark.parametrize(
+    "opener,filename,compression", [
+        (gzip.open, "data.csv.gz", "gzip"),
+        (bz2.open, "data.csv.bz2", "bz2"),
+        (lzma.open, "data.csv.xz", "xz"),
+        (open, "data.csv", None),
+    ]
+)
+def test_open_data_file(tmp_path, opener, filename, compression):
+    content = b"domainName,registrantName\nmitre.org,Some Person\n"
+    path = str(tmp_path / filename)
+    with opener(path, 'wb') as output:
+        output.write(content)
+
+    assert detect_compression(path) == compression
+    with open_data_file(path) as datafile:
+        assert datafile.read() == content
+
+
+def test_detect_compression_magic(tmp_path):
+    # Detection should rely on content, not a misleading extension
+    path = str(tmp_path / "data.csv")
+    with gzip.open(path, 'wb') as output:
+        output.write(b"domainName\n")
+
+    assert detect_compression(path) == "gzip"
+
+
+def test_detect_compression_extension():
+    assert detect_compression("/tmp/fake/missing.csv.zst") == "zstd"
+    assert detect_compression("/tmp/fake/missing.csv") is None
+
+
+def test_strip_compression_extension():
+    assert strip_compression_extension("file.csv.gz") == "file.csv"
+    assert strip_compression_extension("file.csv.XZ") == "file.csv"
+    assert strip_compression_extension("file.csv") == "file.csv"
+
+
+@pytest.fixture
+def large_csv(tmp_path):
+    path = str(tmp_path / "large.csv")
+    with open(path, 'w') as output:
+        output.write("domainName,registrantName\n")
+        for i in range(1000):
+            output.write(f"domain{i}.com,Person {i}\n")
+    return path
+
+
+def test_split_file(large_csv):
+    assert split_file(large_csv, 0) == [FileRange(large_csv, 0, None)]
+    assert split_file(large_csv, 1 << 30) == [FileRange(large_csv, 0, None)]
+
+    ranges = split_file(large_csv, 1000)
+    assert len(ranges) > 1
+    assert ranges[0].start == 0
+    assert ranges[-1].end is None
+    for (current, following) in zip(ranges, ranges[1:]):
+        assert current.end == following.start
+
+    with open(large_csv, 'rb') as datafile:
+        data = datafile.read()
+    for file_range in ranges[1:]:
+        # Every range must begin at the start of a line
+        assert data[file_range.start - 1:file_range.start] == b"\n"
+
+
+def test_split_file_compressed(tmp_path):
+    path = str(tmp_path / "large.csv.gz")
+    with gzip.open(path, 'wt') as output:
+        for i in range(1000):
+            output.write(f"domain{i}.com,Person {i}\n")
+
+    assert split_file(path, 100) == [FileRange(path, 0, None)]
+
+
+def test_line_reader_ranges(large_csv):
+    rows = []
+    for file_range in split_file(large_csv, 1000):
+        with open_data_file(large_csv) as datafile:
+            lines = list(
+                LineReader(datafile, file_range.start, file_range.end))
+        assert lines[0] == "domainName,registrantName\n"
+        rows.extend(lines[1:])
+
+    assert len(rows) == 1000
+    assert rows[0] == "domain0.com,Person 0\n"
+    assert rows[-1] == "domain999.com,Person 999\n"
+
+
+def test_file_reader_split(large_csv):
+    fake_eventTracker = mock.MagicMock()
+    fake_queue = mock.MagicMock()
+
+    file_reader = FileReader(
+        fake_queue,
+        fake_eventTracker,
+        None,
+        large_csv,
+        "csv",
+        split_size=1000
+    )
+
+    file_reader.run()
+    assert fake_queue.put.call_count == len(split_file(large_csv, 1000))
+
+
+def test_range_stream(large_csv):
+    ranges = split_file(large_csv, 1000)
+    with open_data_file(large_csv) as datafile:
+        data = datafile.read()
+    header = data[:data.index(b"\n") + 1]
+
+    body = b""
+    for file_range in ranges:
+        with open_data_file(large_csv) as datafile:
+            content = RangeStream(
+                datafile, file_range.start, file_range.end).read()
+        assert content.startswith(header)
+        body += content[len(header):]
+
+    assert header + body == data
+
+
+def test_file_reader_schedule_ranges(large_csv, tmp_path):
+    small = tmp_path / "small.csv"
+    small.write_text("domainName,registrantName\nmitre.org,Some Person\n")
+    fake_queue = mock.MagicMock()
+
+    file_reader = FileReader(
+        fake_queue,
+        mock.MagicMock(),
+        str(tmp_path),
+        None,
+        "csv",
+        split_size=8000,
+        schedule="size"
+    )
+
+    file_reader.run()
+    queued = [args[0] for (args, _) in fake_queue.put.call_args_list]
+    # Split ranges of the large file all come before the small file
+    assert len(queued) == len(split_file(large_csv, 8000)) + 1
+    assert queued[-1].path == str(small)
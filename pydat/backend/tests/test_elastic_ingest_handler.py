@@ -1,6 +1,15 @@
+import time
 import pytest
+import threading
 from unittest import mock
-from pydat.core.elastic.ingest.ingest_handler import IngestHandler
+from pydat.core.elastic.ingest.ingest_handler import (
+    IngestHandler,
+    BulkShipError,
+    RolloverRequired,
+)
+from pydat.core.elastic.ingest.adaptive import AdaptiveBatchSize
+from pydat.core.elastic.ingest.bulk_encoder import PreparedAction
+from pydat.core.elastic.ingest.benchmark import FakeElasticsearch
 import elasticsearch
 
 
@@ -76,3 +85,219 @@ def test_fetchdocuments_fn(mock_handler):
     }
 
     assert mock_handler.fetchDocuments([])
+
+
+def bulk_item(status, op='index'):
+    return {op: {'_index': 'test', '_id': '1', 'status': status}}
+
+
+def test_bulk_load(mock_handler):
+    es = mock_handler.connect.return_value
+    es.indices.get_alias.side_effect = [
+        {'pydat-data-000002': {}},
+        {'pydat-data-delta-000001': {}},
+    ]
+    es.indices.get_template.return_value = {
+        'pydat-template': {'settings': {'index': {
+            'refresh_interval': '30s', 'number_of_replicas': '1'}}}
+    }
+    es.cluster.health.return_value = {'timed_out': False}
+
+    indices = mock_handler.startBulkLoad(async_translog=True)
+    assert indices == ['pydat-data-000002', 'pydat-data-delta-000001']
+    es.indices.put_settings.assert_called_once_with(
+        index='pydat-data-000002,pydat-data-delta-000001',
+        body={'index': {
+            'refresh_interval': "-1",
+            'number_of_replicas': 0,
+            'translog.durability': "async",
+        }}
+    )
+
+    es.indices.put_settings.reset_mock()
+    mock_handler.finishBulkLoad(indices)
+    # The template values are restored, the durability reset
+    es.indices.put_settings.assert_called_once_with(
+        index='pydat-data-000002,pydat-data-delta-000001',
+        body={'index': {
+            'refresh_interval': '30s',
+            'number_of_replicas': '1',
+            'translog.durability': None,
+        }}
+    )
+    es.indices.refresh.assert_called_once()
+    assert es.cluster.health.call_args[1]['wait_for_status'] == "green"
+
+
+def test_rollover_timer_created(mock_handler):
+    es = mock_handler.connect.return_value
+    mock_handler.rollover_size = 100
+
+    timer = mock_handler.rolloverTimer(0, created=(100, 50))
+    assert timer > 0
+    # Checks are spaced out
+    assert mock_handler.rolloverTimer(timer, created=(200, 0)) == timer
+
+    with pytest.raises(RolloverRequired) as rollover:
+        mock_handler.rolloverTimer(0, created=(50, 101))
+    assert rollover.value.write_alias == mock_handler.indexNames.delta_write
+    # Tracked counts replace asking the cluster
+    assert not es.cat.count.called
+
+
+def test_rollover_next_index():
+    handler = IngestHandler(hosts="localhost:9200")
+    handler._es = FakeElasticsearch()
+    write_alias = handler.indexNames.orig_write
+
+    new_index = handler.nextIndex(write_alias)
+    assert new_index == "pydat-data-000002"
+    # Naming the index doesn't roll over
+    assert handler.resolveAlias() == ["pydat-data-000001"]
+
+    assert handler.rolloverIndices(
+        write_alias, handler.indexNames.orig_search, new_index=new_index)
+    assert handler.resolveAlias() == [new_index, "pydat-data-000001"]
+
+
+def test_shipdocuments_retry(mock_handler):
+    es = mock_handler.connect.return_value
+    es.transport.serializer.dumps.side_effect = lambda data: str(data)
+    es.bulk.side_effect = [
+        elasticsearch.exceptions.TransportError(429, "rejected", {}),
+        {'items': [bulk_item(201), bulk_item(429)]},
+        {'items': [bulk_item(201)]},
+        {'items': [bulk_item(201)]},
+        {'items': [bulk_item(409)]},
+    ]
+    controller = AdaptiveBatchSize(4, base_delay=0)
+    callback = mock.Mock()
+
+    documents = [{'_op_type': 'index', '_id': i} for i in range(4)]
+    mock_handler.shipDocuments(
+        iter(documents), 4, callback=callback, controller=controller)
+
+    bodies = [kwargs['body'] for (_, kwargs) in es.bulk.call_args_list]
+    # The rejected request was resent with a halved size
+    assert bodies[1].count(b"\n") == 4
+    # Only the rejected item is resent, with the size halved again
+    assert bodies[2].count(b"\n") == 2
+    assert b"'_id': 1" in bodies[2]
+    assert controller.rejections == 2
+    # Results are delivered in the order actions were sent
+    assert [args[0] for (args, _) in callback.call_args_list] == [
+        True, True, True, False]
+
+
+def test_shipdocuments_bytes(mock_handler):
+    es = mock_handler.connect.return_value
+    es.transport.serializer.dumps.side_effect = lambda data: str(data)
+    es.bulk.side_effect = lambda body: {
+        'items': [bulk_item(201)] * (body.count(b"\n") // 2)}
+    callback = mock.Mock()
+
+    documents = [
+        {'_op_type': 'index', '_id': i, 'data': 'x' * size}
+        for (i, size) in enumerate([10, 10, 500, 10, 10, 10])
+    ]
+    mock_handler.shipDocuments(
+        iter(documents), 4, bulk_bytes=100, callback=callback)
+
+    counts = [
+        kwargs['body'].count(b"\n") // 2
+        for (_, kwargs) in es.bulk.call_args_list]
+    # Requests are closed before going over the payload size, and a
+    # single large action is sent on its own
+    assert counts == [2, 1, 2, 1]
+    assert callback.call_count == 6
+
+
+def test_shipdocuments_prepared(mock_handler):
+    es = mock_handler.connect.return_value
+    es.bulk.return_value = {'items': [bulk_item(201)]}
+    prepared = PreparedAction(
+        {'_id': 1}, [b'{"index":{"_id":1}}', b'{"a":1}'])
+
+    mock_handler.shipDocuments(iter([prepared]), 10)
+
+    # Encoded lines are sent as is
+    assert not es.transport.serializer.dumps.called
+    es.bulk.assert_called_once_with(
+        body=b'{"index":{"_id":1}}\n{"a":1}\n')
+
+
+def test_shipdocuments_telemetry(mock_handler):
+    es = mock_handler.connect.return_value
+    es.bulk.side_effect = [
+        {'items': [bulk_item(429), bulk_item(201)]},
+        {'items': [bulk_item(201)]},
+    ]
+    telemetry = mock.Mock()
+    prepared = [
+        PreparedAction({'_id': i}, [b'{"index":{}}', b'{}'])
+        for i in range(2)
+    ]
+
+    mock_handler.shipDocuments(
+        iter(prepared), 2, telemetry=telemetry,
+        controller=AdaptiveBatchSize(2, base_delay=0))
+
+    assert telemetry.observe.call_count == 2
+    assert [args[0] for (args, _) in telemetry.addBytes.call_args_list] == [
+        len(b'{"index":{}}\n{}\n') * 2, len(b'{"index":{}}\n{}\n')]
+    telemetry.addRejected.assert_called_once_with('bulk', 1)
+
+
+def test_shipdocuments_inflight(mock_handler):
+    es = mock_handler.connect.return_value
+    es.transport.serializer.dumps.side_effect = lambda data: str(data)
+    second_sent = threading.Event()
+
+    def fake_bulk(body):
+        if b"'_id': 0" in body:
+            # Only completes if the next request is sent concurrently
+            assert second_sent.wait(5)
+        else:
+            second_sent.set()
+        return {'items': [bulk_item(201)]}
+
+    es.bulk.side_effect = fake_bulk
+    callback = mock.Mock()
+
+    documents = [{'_op_type': 'index', '_id': i} for i in range(3)]
+    mock_handler.shipDocuments(
+        iter(documents), 1, callback=callback, max_inflight=2)
+
+    assert es.bulk.call_count == 3
+    assert callback.call_count == 3
+
+
+def test_shipdocuments_inflight_order(mock_handler):
+    es = mock_handler.connect.return_value
+    es.transport.serializer.dumps.side_effect = lambda data: str(data)
+
+    def fake_bulk(body):
+        if b"'_id': 0" in body:
+            time.sleep(.2)
+            return {'items': [bulk_item(201)]}
+        return {'items': [bulk_item(409)]}
+
+    es.bulk.side_effect = fake_bulk
+    results = []
+    mock_handler.shipDocuments(
+        iter([{'_op_type': 'index', '_id': i} for i in range(2)]), 1,
+        callback=lambda ok, response: results.append(ok), max_inflight=2)
+
+    # The slower first request is still handled first
+    assert results == [True, False]
+
+
+def test_shipdocuments_error(mock_handler):
+    es = mock_handler.connect.return_value
+    es.transport.serializer.dumps.side_effect = lambda data: str(data)
+    item = bulk_item(400)
+    item['index']['error'] = {'reason': 'bad document'}
+    es.bulk.return_value = {'items': [item]}
+
+    with pytest.raises(BulkShipError):
+        mock_handler.shipDocuments(iter([{'_id': 1}]), 10)
@@ -0,0 +1,71 @@
+from unittest import mock
+
+from pydat.core.elastic.ingest.index_filters import IndexFilters
+
+
+def fake_es(indices):
+    es = mock.Mock()
+    es.countDocuments.side_effect = lambda index: len(indices[index])
+    es.scanDocumentIds.side_effect = lambda index: iter(indices[index])
+    return es
+
+
+def test_index_filters_build(tmp_path):
+    indices = {
+        'pydat-data-000002': ['com.new'],
+        'pydat-data-000001': ['com.old', 'org.old'],
+    }
+    filters = IndexFilters(str(tmp_path), 1000)
+    filters.setup(fake_es(indices), list(indices))
+
+    index_list = ['pydat-data-000003'] + list(indices)
+    # Indices without a filter are always candidates
+    assert filters.candidates(index_list, 'com.old') == [
+        'pydat-data-000003', 'pydat-data-000001']
+    assert filters.candidates(index_list, 'com.new') == [
+        'pydat-data-000003', 'pydat-data-000002']
+    assert filters.candidates(index_list[1:], 'net.missing') == []
+
+    filters.add('pydat-data-000002', 'net.missing')
+    filters.add('pydat-data-000003', 'net.other')
+    assert filters.candidates(index_list[1:], 'net.missing') == [
+        'pydat-data-000002']
+
+
+def test_index_filters_save_load(tmp_path):
+    indices = {'pydat-data-000001': ['com.old']}
+    es = fake_es(indices)
+    filters = IndexFilters(str(tmp_path), 1000)
+    filters.setup(es, list(indices))
+    filters.add('pydat-data-000001', 'com.added')
+    indices['pydat-data-000001'].append('com.added')
+    filters.save(es)
+
+    es.scanDocumentIds.reset_mock()
+    loaded = IndexFilters(str(tmp_path), 1000)
+    loaded.setup(es, list(indices))
+    assert not es.scanDocumentIds.called
+    assert loaded.candidates(['pydat-data-000001'], 'com.added') == [
+        'pydat-data-000001']
+
+    # A change to the index outside of an import forces a rebuild
+    indices['pydat-data-000001'].append('com.other')
+    rebuilt = IndexFilters(str(tmp_path), 1000)
+    rebuilt.setup(es, list(indices))
+    assert es.scanDocumentIds.called
+    assert rebuilt.candidates(['pydat-data-000001'], 'com.other') == [
+        'pydat-data-000001']
+
+
+def test_index_filters_shared(tmp_path):
+    indices = {'pydat-data-000001': []}
+    filters = IndexFilters(str(tmp_path), 1000)
+    filters.setup(fake_es(indices), list(indices))
+    assert filters.candidates(['pydat-data-000001'], 'com.mitre') == []
+
+    # Copies, e.g., in pipeline processes, share the same bits
+    copy = IndexFilters.__new__(IndexFilters)
+    copy.__dict__.update(filters.__getstate__())
+    copy.add('pydat-data-000001', 'com.mitre')
+    assert filters.candidates(['pydat-data-000001'], 'com.mitre') == [
+        'pydat-data-000001']
@@ -0,0 +1,77 @@
+from threading import Thread
+from types import SimpleNamespace
+from unittest import mock
+
+from pydat.core.elastic.ingest.event_tracker import EventTracker
+from pydat.core.elastic.ingest.process_wrapper import (
+    DataProcessorPool,
+    PopulatorOptions,
+)
+
+
+def test_pool_rollover_announced():
+    event_tracker = EventTracker()
+    pool = DataProcessorPool(
+        0, None, mock.Mock(), event_tracker,
+        PopulatorOptions(
+            reingest=False, first_import=False,
+            elastic_args={'hosts': "localhost:9200"},
+            emit_dir=None, verbose=False, debug=0),
+    )
+    pipelines = [
+        SimpleNamespace(
+            announced=0, complete=False, is_alive=lambda: True),
+        # Pipelines that are done aren't waited on
+        SimpleNamespace(
+            announced=0, complete=True, is_alive=lambda: True),
+    ]
+    pool.pipelines = pipelines
+    pool.elastic_handler = mock.Mock(ROLLOVER_COUNT_TIME=1)
+    pool.elastic_handler.nextIndex.return_value = "pydat-data-000002"
+
+    def rollover(**kwargs):
+        # The new index is fetched from before the alias is switched
+        assert pipelines[0].announced == 1
+        return True
+    pool.elastic_handler.rolloverIndices.side_effect = rollover
+
+    def pipeline():
+        seen = 0
+        while event_tracker.announcedRollover[0] == 0:
+            seen = event_tracker.wait(seen, 1)
+        assert event_tracker.announcedRollover[1] == "pydat-data-000002"
+        pipelines[0].announced = 1
+        event_tracker.notify()
+
+    applier = Thread(target=pipeline)
+    applier.start()
+    pool.handleRollover("pydat-data-write", "pydat-data-search")
+    applier.join()
+
+    pool.elastic_handler.rolloverIndices.assert_called_once_with(
+        write_alias="pydat-data-write",
+        search_alias="pydat-data-search",
+        new_index="pydat-data-000002"
+    )
+    assert event_tracker.rollovers == 1
+
+
+def test_pool_rollover_shutdown():
+    event_tracker = EventTracker()
+    pool = DataProcessorPool(
+        0, None, mock.Mock(), event_tracker,
+        PopulatorOptions(
+            reingest=False, first_import=False,
+            elastic_args={'hosts': "localhost:9200"},
+            emit_dir=None, verbose=False, debug=0),
+    )
+    pool.pipelines = [
+        SimpleNamespace(announced=0, complete=False, is_alive=lambda: True)]
+    pool.elastic_handler = mock.Mock(ROLLOVER_COUNT_TIME=1)
+    pool.elastic_handler.nextIndex.return_value = "pydat-data-000002"
+    event_tracker.setShutdown()
+
+    # Nothing is rolled over once the pipelines stop answering
+    pool.handleRollover("pydat-data-write", "pydat-data-search")
+    pool.elastic_handler.rolloverIndices.assert_not_called()
+    assert event_tracker.rollovers == 0
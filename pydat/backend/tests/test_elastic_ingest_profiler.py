@@ -0,0 +1,85 @@
+import json
+import cProfile
+import threading
+
+from pydat.core.elastic.ingest.profiler import (
+    PipelineProfiler,
+    clear_profiles,
+    merge_profiles,
+)
+
+
+def busy_stage():
+    return sum(range(10000))
+
+
+def test_profiler(tmp_path):
+    for pipeline_id in range(2):
+        profiler = PipelineProfiler(str(tmp_path), pipeline_id)
+        for stage in ['fetcher', 'fetcher', 'shipper']:
+            thread = threading.Thread(target=busy_stage)
+            profiler.attach(thread, stage)
+            thread.start()
+            thread.join()
+
+        written = profiler.save()
+        assert len(written) == 3
+        # Profiles are only saved once
+        assert profiler.save() == []
+
+    report_path = merge_profiles(str(tmp_path))
+    with open(report_path) as report_file:
+        report = report_file.read()
+
+    # Threads of every pipeline are counted per stage
+    assert [line.split()[:2] for line in report.splitlines()[1:3]] == [
+        ['fetcher', '4'], ['shipper', '2']]
+    assert "busy_stage" in report
+    assert (tmp_path / "fetcher.prof").exists()
+
+    clear_profiles(str(tmp_path))
+    assert merge_profiles(str(tmp_path)) is None
+
+
+class SingleProfile(cProfile.Profile):
+    """Only one may be enabled at a time, as on python 3.12 and later"""
+    active = []
+
+    def enable(self):
+        if len(SingleProfile.active) > 0:
+            raise ValueError("Another profiling tool is already active")
+        super().enable()
+        SingleProfile.active.append(self)
+
+    def disable(self):
+        super().disable()
+        # Also disabled again when the stats are created
+        if self in SingleProfile.active:
+            SingleProfile.active.remove(self)
+
+
+def test_profiler_concurrent_threads(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(cProfile, "Profile", SingleProfile)
+    profiler = PipelineProfiler(str(tmp_path), 0)
+    running = threading.Barrier(2)
+    results = []
+
+    def stage():
+        # Both threads are inside their stage at the same time
+        running.wait(5)
+        results.append(busy_stage())
+        running.wait(5)
+
+    threads = [threading.Thread(target=stage) for _ in range(2)]
+    for thread in threads:
+        profiler.attach(thread, 'worker')
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    # The thread that could not be profiled still ran its stage
+    assert len(results) == 2
+    assert "Unable to profile a worker thread" in caplog.text
+    assert len(profiler.save()) == 2
+    with open(tmp_path / "pipeline.0.json") as times_file:
+        assert json.load(times_file)['worker']['threads'] == 2
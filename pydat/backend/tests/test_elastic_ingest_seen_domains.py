@@ -0,0 +1,52 @@
+import pytest
+from pydat.core.elastic.ingest.seen_domains import (
+    BloomFilter,
+    SeenDomains,
+    NEW,
+    DUPLICATE,
+    MAYBE,
+)
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(1000, 0.01)
+    assert bloom.add("domain0") is False
+    assert bloom.add("domain0") is True
+    for i in range(1, 1000):
+        bloom.add(f"domain{i}")
+
+    for i in range(1000):
+        assert f"domain{i}" in bloom
+
+    false_positives = sum(
+        1 for i in range(1000, 11000) if f"domain{i}" in bloom)
+    assert false_positives < 300
+
+
+def test_bloom_filter_invalid():
+    with pytest.raises(ValueError):
+        BloomFilter(0)
+    with pytest.raises(ValueError):
+        BloomFilter(10, 1.5)
+
+
+def test_seen_domains_exact():
+    seen = SeenDomains('exact')
+    assert seen.check("com.mitre") == NEW
+    assert seen.check("org.mitre") == NEW
+    assert seen.check("com.mitre") == DUPLICATE
+
+
+def test_seen_domains_bloom():
+    seen = SeenDomains('bloom', capacity=1000, window=2)
+    assert seen.check("com.one") == NEW
+    assert seen.check("com.one") == DUPLICATE
+    assert seen.check("com.two") == NEW
+    assert seen.check("com.three") == NEW
+    # Outside of the exact window, the filter can only say maybe
+    assert seen.check("com.one") == MAYBE
+
+
+def test_seen_domains_invalid():
+    with pytest.raises(ValueError):
+        SeenDomains('off')
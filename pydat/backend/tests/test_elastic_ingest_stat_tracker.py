@@ -97,10 +97,34 @@ def test_stat_tracker_client():
     client.addChanged('total')
     client.incr('registrant_name')
 
-    assert len(client._chunk) == 2
+    assert client.pending == 2
     client.flush()
     assert stat_tracker._stat_queue.qsize() == 1
     stat_tracker.shutdown()
     stat_tracker.run()
     stat_tracker._stat_queue.close()
     stat_tracker._stat_queue.join_thread()
+
+
+def test_stat_tracker_client_aggregate():
+    stat_tracker = StatTracker()
+    stat_tracker.seed({'total': 10})
+    stat_tracker.seedChanged({'registrant_name': 1})
+    client = stat_tracker.get_tracker()
+
+    for _ in range(5):
+        client.incr('total')
+        client.addChanged('registrant_name')
+    client.addTime('fetch', 1.5)
+    client.flush()
+
+    # Counts are sent as totals in a single chunk
+    assert stat_tracker._stat_queue.qsize() == 1
+    stat_tracker.shutdown()
+    stat_tracker.run()
+
+    assert stat_tracker.total == 15
+    assert stat_tracker.changed_stats['registrant_name'] == 6
+    assert stat_tracker.timings['fetch'] == 1.5
+    stat_tracker._stat_queue.close()
+    stat_tracker._stat_queue.join_thread()
@@ -0,0 +1,56 @@
+import pickle
+
+from pydat.core.elastic.ingest.state_store import StateStore
+
+
+def test_state_store_apply_lookup(tmp_path):
+    store = StateStore(str(tmp_path))
+    store.apply(records=[
+        ('com.one', 1, 'pydat-data-000001', 1, '2021-01-01', '2021-01-01',
+         'hash1'),
+        ('com.two', 1, 'pydat-data-000001', 1, '2021-01-01', '2021-01-01',
+         'hash2'),
+    ])
+    store.apply(
+        updates=[(2, 'hash3', 'com.one'), (2, 'hash4', 'com.missing')],
+        placeholders=[
+            ('com.one', 'pydat-data-000001'),
+            ('com.missing', 'pydat-data-000002'),
+        ]
+    )
+
+    records = store.lookup(['com.one', 'com.missing', 'com.none'])
+    assert set(records) == {'com.one', 'com.missing'}
+    assert records['com.one'] == (
+        'com.one', 2, 'pydat-data-000001', 1, '2021-01-01', '2021-01-01',
+        'hash3')
+    # Placeholders are records with unknown contents
+    assert records['com.missing'] == (
+        'com.missing', None, 'pydat-data-000002', None, None, None, None)
+
+    store.clear()
+    assert store.lookup(['com.one']) == {}
+
+
+def test_state_store_usable(tmp_path):
+    store = StateStore(str(tmp_path))
+    assert store.version is None
+    assert not store.usable(1)
+
+    store.begin(2)
+    assert store.usable(2, reingest=True)
+    assert not store.usable(3)
+
+    store.finish(2)
+    assert store.complete
+    assert store.usable(3)
+    assert not store.usable(4)
+
+
+def test_state_store_pickle(tmp_path):
+    store = StateStore(str(tmp_path))
+    store.apply(records=[
+        ('com.one', 1, 'pydat-data-000001', 1, None, None, None)])
+
+    copy = pickle.loads(pickle.dumps(store))
+    assert list(copy.lookup(['com.one'])) == ['com.one']
@@ -0,0 +1,100 @@
+import queue
+
+from pydat.core.elastic.ingest.telemetry import Telemetry
+
+
+def test_telemetry_client():
+    telemetry = Telemetry()
+    client = telemetry.get_tracker("pipeline.0")
+
+    client.addRows('read', 100)
+    client.addRows('read', 50)
+    client.addRejected('mget', 10)
+    client.addBytes(1024)
+    client.observe('bulk', 0.2)
+    client.setDepth('data', 500)
+    client.flush()
+
+    telemetry.handle_chunk(telemetry._queue.get(True, 5))
+    assert telemetry.rows['read'] == 150
+    assert telemetry.rows['ship'] == 0
+    assert telemetry.rejected == {'mget': 10, 'bulk': 0}
+    assert telemetry.bytes_shipped == 1024
+    assert telemetry.latency['bulk'].count == 1
+    assert telemetry.depths['data'] == 500
+
+    # Values are sent once
+    client.flush()
+    telemetry.handle_chunk(telemetry._queue.get(True, 5))
+    assert telemetry.rows['read'] == 150
+    assert telemetry.depths['data'] == 500
+
+
+def test_telemetry_depths():
+    file_queue = queue.Queue()
+    file_queue.put("file.csv")
+    telemetry = Telemetry(file_queue=file_queue)
+
+    for source in ["pipeline.0", "pipeline.1"]:
+        telemetry.handle_chunk({
+            'source': source,
+            'counters': {},
+            'histograms': {},
+            'depths': {'insert': 10},
+        })
+
+    # Depths are the latest of each pipeline summed
+    assert telemetry.depths == {
+        'file': 1, 'data': 0, 'work': 0, 'insert': 20}
+
+
+def test_telemetry_summary():
+    telemetry = Telemetry(interval=10)
+    client = telemetry.get_tracker("pipeline.0")
+    client.addRows('fetch', 1000)
+    for latency in [0.01, 0.01, 0.01, 0.4]:
+        client.observe('mget', latency)
+    client.flush()
+    telemetry.handle_chunk(telemetry._queue.get(True, 5))
+
+    telemetry._last_report = 0
+    summary = telemetry.summary(now=2)
+    assert "fetch=500" in summary
+    assert "mget p50=10ms p95=500ms" in summary
+
+    # Rates are since the last summary
+    assert "fetch=0" in telemetry.summary(now=4)
+
+
+def test_telemetry_render():
+    telemetry = Telemetry()
+    client = telemetry.get_tracker("pipeline.0")
+    client.addRows('ship', 5)
+    client.observe('bulk', 0.02)
+    client.observe('bulk', 60)
+    client.flush()
+    telemetry.handle_chunk(telemetry._queue.get(True, 5))
+
+    metrics = telemetry.render()
+    assert 'pydat_ingest_rows_total{stage="ship"} 5' in metrics
+    assert (
+        'pydat_ingest_request_seconds_bucket{request="bulk",le="0.025"} 1'
+        in metrics)
+    assert (
+        'pydat_ingest_request_seconds_bucket{request="bulk",le="+Inf"} 2'
+        in metrics)
+    assert 'pydat_ingest_request_seconds_count{request="bulk"} 2' in metrics
+
+
+def test_telemetry_run(tmp_path):
+    path = tmp_path / "pydat.prom"
+    telemetry = Telemetry(interval=60, path=str(path))
+    client = telemetry.get_tracker("pipeline.0")
+    client.addRows('read', 1)
+    client.flush()
+
+    telemetry.shutdown()
+    telemetry.run()
+
+    # A final report is written at shutdown
+    assert 'pydat_ingest_rows_total{stage="read"} 1' in path.read_text()
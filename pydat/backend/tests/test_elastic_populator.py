@@ -104,6 +104,8 @@ def ingest_test_data():
         ask_password=False,
         config_template_only=False,
         clear_interrupted=False,
+        rebuild_state_store=False,
+        replay_dir=None,
         ingest_file="file",
         ingest_directory=None
     )